@@ -6,16 +6,20 @@
 
 
 import os
-import wave
-from pydub import AudioSegment
-import matplotlib.pyplot as plt
+import shutil
+import struct
+import threading
+import subprocess
 import numpy as np
 import sys
 import logging
 import urllib.request
 
-#need to specify path of tool that we use
-AudioSegment.converter = "C:/Users/vinay/Documents/ffmpeg/ffmpeg/bin/ffmpeg.exe"
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+#need to specify path of tool that we use (pydub is only imported when an mp3 is converted)
+FFMPEG_PATH = "C:/Users/vinay/Documents/ffmpeg/ffmpeg/bin/ffmpeg.exe"
 
 # audio_files = os.listdir("C:/Users/vinay/Documents/s750/assignments-vbhatia7/shazam/Test_MP3s")
 # for filename in audio_files:
@@ -44,6 +48,8 @@ def convert_to_local_wav(path, source):
                       
     Output parameters: Nothing returned.                  
     """
+    from pydub import AudioSegment
+    AudioSegment.converter = FFMPEG_PATH
     if(source == "local"):
         filename = os.path.basename(path)
         name,ext = os.path.splitext(filename)
@@ -61,5 +67,228 @@ def convert_to_local_wav(path, source):
         if ext==".wav": 
             fullfilename = os.path.join("WAVs", filename)
             urllib.request.urlretrieve(path,fullfilename)
-   
+
+
+def ffmpeg_command():
+    """
+    Function finds ffmpeg: FFMPEG_PATH if it exists on this machine, otherwise ffmpeg on the PATH.
+
+    Inputs: None
+
+    Outputs: path or name of the ffmpeg executable (str)
+    """
+    if os.path.exists(FFMPEG_PATH):
+        return(FFMPEG_PATH)
+    return(shutil.which("ffmpeg") or "ffmpeg")
+
+
+def _feed(stream, pipe, block_size, head = b"", errors = None):
+    # Copies a readable stream (e.g. an HTTP response), after the head already read from it, into ffmpeg's stdin,
+    # so it decodes while the bytes are still arriving. A stream which fails (a dropped download) is recorded in errors
+    try:
+        pipe.write(head)
+        while True:
+            chunk = stream.read(block_size)
+            if not chunk:
+                break
+            pipe.write(chunk)
+    except (BrokenPipeError, ValueError):
+        pass
+    except Exception as error:
+        if errors is not None:
+            errors.append(error)
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+
+def mp3_length(head):
+    """
+    Function reads how many samples an MP3 decodes to from the Xing (or Info) and LAME tags of its first frame: its frames
+    less the encoder delay and padding. ffmpeg drops that padding when it decodes a file, but can't find it in a stream.
+
+    Inputs: head (bytes, the start of the MP3: any ID3v2 tag and the first frame)
+
+    Outputs: number of samples (integer), or None if head isn't an MP3 with both tags
+    """
+    start = 0
+    if head[:3] == b"ID3" and len(head) >= 10:
+        start = 10 + (head[6] << 21 | head[7] << 14 | head[8] << 7 | head[9]) + (10 if head[5] & 0x10 else 0)
+    if len(head) < start + 4:
+        return(None)
+    frame_header = struct.unpack(">I", head[start:start + 4])[0]
+    version, layer, mono = frame_header >> 19 & 3, frame_header >> 17 & 3, frame_header >> 6 & 3 == 3
+    if frame_header >> 21 != 0x7FF or version == 1 or layer != 1:
+        return(None)
+    # the tag follows the side information, whose size depends on the MPEG version and the channels
+    position = start + 4 + ((17 if mono else 32) if version == 3 else (9 if mono else 17))
+    if head[position:position + 4] not in (b"Xing", b"Info") or len(head) < position + 8:
+        return(None)
+    flags = struct.unpack(">I", head[position + 4:position + 8])[0]
+    position += 8
+    if not flags & 1:
+        return(None)
+    frames = struct.unpack(">I", head[position:position + 4])[0]
+    position += 4 + 4*bool(flags & 2) + 100*bool(flags & 4) + 4*bool(flags & 8)
+    if head[position:position + 4] not in (b"LAME", b"Lavf", b"Lavc") or len(head) < position + 24:
+        return(None)
+    padding = int.from_bytes(head[position + 21:position + 24], "big")
+    return(frames*(1152 if version == 3 else 576) - (padding >> 12) - (padding & 0xFFF))
+
+
+def _read_head(stream, size = 8192):
+    # Reads the start of a stream up to its first audio frame: any ID3v2 tag (which may hold cover art) and size more bytes
+    head = _read_upto(stream, 10)
+    if head[:3] == b"ID3" and len(head) == 10:
+        head += _read_upto(stream, (head[6] << 21 | head[7] << 14 | head[8] << 7 | head[9]) + (10 if head[5] & 0x10 else 0))
+    return(head + _read_upto(stream, size))
+
+
+def _read_upto(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return(data)
+
+
+class WavFormatError(ValueError):
+    """
+    Raised by read_wav_stream for data it can't stream: not a WAV, or a WAV that isn't 16-bit PCM (24-bit, float, ...).
+    Such files can still be read in full with spectral_analysis.analyze_song.
+    """
+
+
+def _read_exactly(stream, size, wav_file = None):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError("The WAV stream ended early")
+        data += chunk
+    if wav_file is not None:
+        wav_file.write(data)
+    return(data)
+
+
+def read_wav_stream(stream, wav_file = None, block_size = 2**20, frames = None):
+    """
+    Function reads 16-bit PCM WAV data from a stream that can't seek (such as ffmpeg's output), downmixing each block to mono
+    as it arrives, so the only full-length array is the mono series. Reading stops at the end of the data chunk, so chunks after it
+    (LIST or id3 metadata) are never read as samples; a data chunk without a size (0 or 0xFFFFFFFF, as ffmpeg writes to a pipe) is read to the end.
+
+    Inputs: stream (readable binary file object)
+            wav_file (writable, seekable binary file object, optional: the WAV is copied to it, with its sizes fixed at the end)
+            block_size (integer, bytes read at a time)
+            frames (integer, keep at most this many frames, e.g. an MP3's length without its padding: the rest is read and dropped)
+
+    Outputs: The samplerate (integer) and series data (numpy.ndarray, float32), the same as spectral_analysis.analyze_song on the WAV.
+             Raises WavFormatError if the stream isn't a 16-bit PCM WAV.
+    """
+    import spectral_analysis
+    header = _read_exactly(stream, 12, wav_file)
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise WavFormatError("Not a WAV stream")
+    channels = samplerate = None
+    while True:
+        chunk_id, chunk_size = struct.unpack("<4sI", _read_exactly(stream, 8, wav_file))
+        if chunk_id == b"data":
+            break
+        chunk = _read_exactly(stream, chunk_size + chunk_size % 2, wav_file)
+        if chunk_id == b"fmt ":
+            audio_format, channels, samplerate, _, _, bits = struct.unpack("<HHIIHH", chunk[:16])
+            if audio_format not in (1, 0xFFFE) or bits != 16:
+                raise WavFormatError("Only 16-bit PCM can be streamed, not format " + str(audio_format) + " with " + str(bits) + " bits")
+    if channels is None:
+        raise WavFormatError("The WAV stream has no fmt chunk")
+    data_start = wav_file.tell() if wav_file is not None else None
+    frame_bytes = 2*channels
+    remaining = None if chunk_size in (0, 0xFFFFFFFF) else chunk_size
+    wanted = None if frames is None else frames*frame_bytes
+    blocks, rest = [], b""
+    while remaining is None or remaining > 0:
+        chunk = stream.read(block_size if remaining is None else min(block_size, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        if wanted is not None:
+            # the writer is still drained to its end, so it never blocks on a full pipe
+            chunk = chunk[:max(wanted, 0)]
+            wanted -= len(chunk)
+            if not chunk:
+                continue
+        if wav_file is not None:
+            wav_file.write(chunk)
+        if rest:
+            chunk = rest + chunk
+        usable = len(chunk) - len(chunk) % frame_bytes
+        rest = chunk[usable:]
+        if usable:
+            blocks.append(spectral_analysis.to_mono(np.frombuffer(chunk[:usable], dtype = "<i2").reshape(-1, channels)))
+    if wav_file is not None:
+        end = wav_file.tell()
+        wav_file.seek(4)
+        wav_file.write(struct.pack("<I", end - 8))
+        wav_file.seek(data_start - 4)
+        wav_file.write(struct.pack("<I", end - data_start))
+        wav_file.seek(end)
+    series = np.concatenate(blocks) if blocks else np.zeros(0, dtype = np.float32)
+    return([samplerate, series])
+
+
+def decode_audio(source, samplerate = None, wav_path = None, block_size = 2**20):
+    """
+    Function decodes an MP3 (or anything ffmpeg reads) straight into memory: ffmpeg's PCM output is read from a pipe and
+    downmixed to mono block by block, so nothing is written to disk unless a WAV is asked for.
+
+    Inputs: source (str, path to the audio file, or a readable binary stream such as an HTTP response, which is decoded as it downloads;
+                    ffmpeg can't seek a stream to find an MP3's end padding, so it is cut using the length in the MP3's tags, see mp3_length)
+            samplerate (integer, resample to this rate while decoding, default keeps the file's rate)
+            wav_path (str, also write the decoded WAV here, optional)
+            block_size (integer, bytes read at a time)
+
+    Outputs: The samplerate (integer) and series data (numpy.ndarray, float32)
+    """
+    head = frames = None
+    if not isinstance(source, str):
+        head = _read_head(source)
+        frames = mp3_length(head) if samplerate is None else None
+    command = [ffmpeg_command(), "-v", "error"] + (["-nostdin", "-i", source] if isinstance(source, str) else ["-i", "pipe:0"])
+    command += ["-vn", "-f", "wav", "-acodec", "pcm_s16le"]
+    if samplerate is not None:
+        command += ["-ar", str(int(samplerate))]
+    command.append("pipe:1")
+    process = subprocess.Popen(command, stdin = subprocess.DEVNULL if isinstance(source, str) else subprocess.PIPE,
+                               stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    feeder = None
+    errors = []
+    if not isinstance(source, str):
+        feeder = threading.Thread(target = _feed, args = (source, process.stdin, block_size, head, errors), daemon = True)
+        feeder.start()
+    wav_file = open(wav_path, "w+b") if wav_path is not None else None
+    try:
+        result = read_wav_stream(process.stdout, wav_file = wav_file, block_size = block_size, frames = frames)
+    except (ValueError, AssertionError):
+        process.kill()
+        raise ValueError("Could not decode " + str(source) + ": " + process.stderr.read().decode(errors = "replace").strip())
+    finally:
+        if wav_file is not None:
+            wav_file.close()
+        process.stdout.close()
+        if feeder is not None:
+            feeder.join()
+        process.wait()
+        process.stderr.close()
+    if errors:
+        # ffmpeg only saw part of the stream
+        raise errors[0]
+    if process.returncode != 0:
+        raise ValueError("Could not decode " + str(source) + " (ffmpeg exited with " + str(process.returncode) + ")")
+    logger.info('Decoded ' + str(len(result[1])) + ' samples in memory')
+    return(result)
 
@@ -0,0 +1,1435 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 17, 2020
+### Use: Benchmarks for the performance-sensitive parts of Freezam
+#########################################
+
+## NOTE: To run, use: (example queries)
+#  python benchmarks.py periodogram
+#  python benchmarks.py periodogram --path="WAVs/betty_Taylor Swift_folklore_2020.wav" --repeats=5
+#  python benchmarks.py windowing --seconds=3600
+#  python benchmarks.py distances --method=two
+#  python benchmarks.py knn --dsn="dbname=freezam_bench host=localhost" --songs=500
+#  python benchmarks.py ingest --dsn="dbname=freezam_bench host=localhost" --songs=20
+#  python benchmarks.py catalog_scan --songs=2000
+#  python benchmarks.py index --sizes 100 1000 10000
+#  python benchmarks.py index --sizes 100 1000 --dsn="dbname=freezam_bench host=localhost"
+#  python benchmarks.py backends --songs=200
+#  python benchmarks.py backends --songs=200 --dsn="dbname=freezam_bench host=localhost"
+#  python benchmarks.py constellation --sizes 10 100 1000
+#  python benchmarks.py add_dir --files=64 --workers 1 2 4 8
+#  python benchmarks.py recommend --files=200 --catalog_songs=100
+#  python benchmarks.py cache --files=32
+#  python benchmarks.py profiling --seconds=240
+#  python benchmarks.py serve --songs=50 --clients 1 4 16 --requests=400
+#  python benchmarks.py startup --repeats=5
+#  python benchmarks.py progressive --songs=20 --snippet_seconds=30
+#  python benchmarks.py streaming --songs=20 --queries=10
+#  python benchmarks.py decimation --seconds=240
+#  python benchmarks.py decode --files=8
+#  python benchmarks.py fetch --files=32 --latency=0.1 --workers 1 4 8
+## NOTE: the database benchmarks create tables and load synthetic songs, so point --dsn at a throwaway local database.
+
+import argparse
+import io
+import os
+import sys
+import subprocess
+import threading
+import http.client
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import shutil
+import logging
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from scipy import signal
+from scipy.spatial import distance
+import pandas
+
+import spectral_analysis
+import audio_processing
+import fingerprint_index
+import fingerprint_cache
+import profiling
+import storage_backends
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def synthetic_track(seconds = 240, samplerate = 44100, seed = 0):
+    """
+    Function builds a reproducible stand-in for a song (a few drifting tones plus noise) so benchmarks can run without the WAVs folder.
+
+    Inputs: seconds (integer, length of the track)
+            samplerate (integer)
+            seed (integer, seed for the noise)
+
+    Outputs: The samplerate (integer) and series data (numpy.ndarray)
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds*samplerate))/samplerate
+    series = np.zeros(len(t))
+    for base in (110.0, 220.0, 440.0, 880.0, 1760.0):
+        series += np.sin(2*np.pi*base*(1 + 0.01*np.sin(2*np.pi*t/30))*t)
+    series += 0.5*rng.standard_normal(len(t))
+    series = np.round(series/np.abs(series).max()*20000)
+    return([samplerate, series])
+
+
+def time_call(function, repeats = 3):
+    """
+    Function times a zero-argument callable.
+
+    Inputs: function (callable)
+            repeats (integer, number of timed runs)
+
+    Outputs: The best wall time in seconds (float) and the result of the last call
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return([best, result])
+
+
+def load_track(path = None, seconds = 240):
+    """
+    Function reads in the track to benchmark, or builds a synthetic one if no path is given.
+
+    Inputs: path (string, path to a WAV, optional)
+            seconds (integer, length of the synthetic track)
+
+    Outputs: The samplerate (integer) and series data (numpy.ndarray)
+    """
+    if path:
+        return(spectral_analysis.analyze_song(path))
+    return(synthetic_track(seconds = seconds))
+
+
+def benchmark_periodogram(path = None, seconds = 240, h = 5, delta = 1, repeats = 3):
+    """
+    Function compares the per-window signal.periodogram loop against get_periodogram_batch on a full-length track.
+
+    Inputs: path (string, path to a WAV, optional)
+            seconds (integer, length of the synthetic track if no path is given)
+            h (integer, window length in seconds)
+            delta (integer, window step in seconds)
+            repeats (integer, number of timed runs)
+
+    Outputs: Dictionary of timings (seconds), speedups and the largest relative error
+    """
+    samplerate, series = load_track(path, seconds)
+    windows = spectral_analysis.get_window(series = series, sample_rate = samplerate, h = h, delta = delta)
+
+    def per_window():
+        return([signal.periodogram(x = window, fs = samplerate, scaling = "spectrum")[1] for window in windows])
+
+    loop_time, reference = time_call(per_window, repeats)
+    batch_time, (_, batch) = time_call(lambda: spectral_analysis.get_periodogram_batch(windows, samplerate), repeats)
+    batch32_time, (_, batch32) = time_call(lambda: spectral_analysis.get_periodogram_batch(windows, samplerate, dtype = np.float32), repeats)
+    reference = np.array(reference)
+    scale = reference.max()
+    results = {
+        "windows": int(len(windows)),
+        "window_length": int(windows.shape[1]),
+        "per_window_seconds": loop_time,
+        "batch_seconds": batch_time,
+        "batch_float32_seconds": batch32_time,
+        "speedup": loop_time/batch_time,
+        "speedup_float32": loop_time/batch32_time,
+        "max_relative_error": float(np.abs(batch - reference).max()/scale),
+        "max_relative_error_float32": float(np.abs(batch32 - reference).max()/scale),
+    }
+    return(results)
+
+
+def peak_memory(function):
+    """
+    Function runs a zero-argument callable and measures the peak memory it allocates (numpy arrays included).
+
+    Inputs: function (callable)
+
+    Outputs: The peak allocation in megabytes (float), the wall time in seconds (float) and the result of the call
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return([peak/2**20, elapsed, result])
+
+
+def benchmark_windowing(path = None, seconds = 240, h = 5, delta = 1, block_size = 16, full = True):
+    """
+    Function compares the peak memory of fingerprinting with every window materialized (get_window + get_periodogram)
+    against the block-at-a-time pipeline (compute_fingerprints).
+
+    Inputs: path (string, path to a WAV, optional)
+            seconds (integer, length of the synthetic track if no path is given)
+            h (integer, window length in seconds)
+            delta (integer, window step in seconds)
+            block_size (integer, windows per block for the streaming pipeline)
+            full (boolean, also run the fully materialized pipeline; turn off for hour-long tracks)
+
+    Outputs: Dictionary of peak memory (MB) and wall time (seconds) for each pipeline
+    """
+    samplerate, series = load_track(path, seconds)
+
+    def materialized():
+        windows = spectral_analysis.get_window(series = series, sample_rate = samplerate, h = h, delta = delta)
+        freq, pd = spectral_analysis.get_periodogram(series, windows, samplerate, h = h, delta = delta)
+        return([spectral_analysis.fingerprint_one(pd, freq), spectral_analysis.fingerprint_five(pd, freq)])
+
+    def streamed():
+        return(spectral_analysis.compute_fingerprints(series, samplerate, methods = ("one", "five"), h = h, delta = delta, block_size = block_size))
+
+    results = {"series_mb": series.nbytes/2**20}
+    streamed_peak, streamed_time, _ = peak_memory(streamed)
+    results["streamed_peak_mb"] = streamed_peak
+    results["streamed_seconds"] = streamed_time
+    if full:
+        full_peak, full_time, _ = peak_memory(materialized)
+        results["materialized_peak_mb"] = full_peak
+        results["materialized_seconds"] = full_time
+        results["memory_ratio"] = full_peak/streamed_peak
+    return(results)
+
+
+def pandas_match_fingerprints(snip_fingerprint, song_fingerprint):
+    """Function is the old DataFrame + double loop version of match_fingerprints, kept as the baseline."""
+    df1 = pandas.DataFrame(snip_fingerprint).T
+    df2 = pandas.DataFrame(song_fingerprint).T
+    dist = np.empty([int(len(df2.columns)), int(len(df1.columns))])
+    for index1 in range(int(len(df1.columns))):
+        array_dist = []
+        for index2 in range(int(len(df2.columns))):
+            array_dist.append(distance.euclidean(df1[index1], df2[index2]))
+        dist[:, index1] = array_dist
+    return(pandas.DataFrame(dist))
+
+
+def benchmark_distances(path = None, seconds = 240, snippet_seconds = 15, method = "five", repeats = 3):
+    """
+    Function compares the pandas double loop against the vectorized match_fingerprints for a snippet against a full-length track.
+
+    Inputs: path (string, path to a WAV, optional)
+            seconds (integer, length of the synthetic track if no path is given)
+            snippet_seconds (integer, length of the snippet cut from the track)
+            method (string, fingerprint method: one, two or five)
+            repeats (integer, number of timed runs)
+
+    Outputs: Dictionary of timings (seconds), speedups and the largest absolute difference
+    """
+    samplerate, series = load_track(path, seconds)
+    song = spectral_analysis.compute_fingerprints(series, samplerate, methods = (method,))[method]
+    snippet_start = len(series)//3
+    snip = spectral_analysis.compute_fingerprints(series[snippet_start:snippet_start + snippet_seconds*samplerate], samplerate, methods = (method,))[method]
+
+    loop_time, reference = time_call(lambda: pandas_match_fingerprints(snip, song), repeats)
+    kernel_time, dist = time_call(lambda: spectral_analysis.match_fingerprints(snip, song), repeats)
+    kernel32_time, dist32 = time_call(lambda: spectral_analysis.match_fingerprints(snip, song, dtype = np.float32), repeats)
+    squared_time, _ = time_call(lambda: spectral_analysis.match_fingerprints(snip, song, squared = True), repeats)
+    reference = reference.to_numpy()
+    results = {
+        "song_windows": int(len(song)),
+        "snippet_windows": int(len(snip)),
+        "dimensions": int(song.shape[1]),
+        "pandas_loop_seconds": loop_time,
+        "kernel_seconds": kernel_time,
+        "kernel_float32_seconds": kernel32_time,
+        "kernel_squared_seconds": squared_time,
+        "speedup": loop_time/kernel_time,
+        "max_relative_error": float(np.abs(dist - reference).max()/max(reference.max(), 1e-300)),
+        "max_relative_error_float32": float(np.abs(dist32 - reference).max()/max(reference.max(), 1e-300)),
+    }
+    return(results)
+
+
+def use_database(dsn):
+    """
+    Function points database_manager at the given Postgres server (e.g. a local stand-in) and imports it.
+
+    Inputs: dsn (string, libpq connection string)
+
+    Outputs: The database_manager module
+    """
+    os.environ["FREEZAM_DSN"] = dsn
+    os.environ["FREEZAM_BACKEND"] = "postgres"
+    import database_manager
+    return(database_manager)
+
+
+def load_synthetic_catalog(database_manager, songs = 500, windows = 240, seed = 0):
+    """
+    Function fills the database with synthetic songs whose fingerprints look like the real ones (3-D normalized peaks, 8-D octave maxima).
+
+    Inputs: database_manager (module, from use_database)
+            songs (integer, number of songs to add)
+            windows (integer, fingerprints per song)
+            seed (integer)
+
+    Outputs: Dictionary of song_id -> fingerprints ("one" and "five" numpy.ndarrays)
+    """
+    import psycopg2.extras
+    rng = np.random.RandomState(seed)
+    cur = database_manager.cur
+    catalog = {}
+    for index_song in range(songs):
+        fingerprints1 = np.sort(rng.rand(windows, 3), axis = 1)
+        fingerprints5 = rng.lognormal(8, 2, (windows, 8))
+        cur.execute("INSERT INTO songs (title, artist, album, path, sample_rate, date, source) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING song_id",
+                    ("bench song " + str(index_song), "bench artist", "bench album", "bench", 44100, "2020", "local"))
+        song_id = cur.fetchone()[0]
+        psycopg2.extras.execute_values(cur, "INSERT INTO fingerprints (song_id, num_fingerprints, fingerprint1, fingerprint5) VALUES %s",
+                                       [(song_id, windows, list(fingerprints1[i]), list(fingerprints5[i])) for i in range(windows)],
+                                       template = "(%s, %s, cube(%s::float8[]), cube(%s::float8[]))", page_size = 1000)
+        catalog[song_id] = {"one": fingerprints1, "five": fingerprints5}
+    database_manager.backend.conn.commit()
+    database_manager.maintain_indexes()
+    return(catalog)
+
+
+def per_window_nearest(database_manager, fingerprints, method):
+    """Function is the old one-query-per-window kNN lookup from fast_search, kept as the baseline."""
+    column = database_manager.FINGERPRINT_COLUMNS[method]
+    cur = database_manager.cur
+    matches = []
+    for index_row in range(len(fingerprints)):
+        cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist," + column + " <-> cube(%s) as euclidean FROM fingerprints,songs "
+                    "where fingerprints.song_id = songs.song_id ORDER BY " + column + " <-> cube(%s) LIMIT 1;",
+                    (list(fingerprints[index_row]), list(fingerprints[index_row])))
+        matches.extend(cur.fetchall())
+    return(matches)
+
+
+def benchmark_knn(dsn, songs = 500, windows = 240, snippet_windows = 11, queries = 20, method = "five", seed = 0):
+    """
+    Function compares the per-window kNN queries against the single batched LATERAL query (nearest_fingerprints) on a local Postgres.
+
+    Inputs: dsn (string, libpq connection string of a throwaway database)
+            songs (integer, synthetic songs in the catalog)
+            windows (integer, fingerprints per song)
+            snippet_windows (integer, windows per query snippet)
+            queries (integer, number of snippets timed)
+            method (string, one or five)
+            seed (integer)
+
+    Outputs: Dictionary of mean/median latency per snippet (seconds) and the speedup
+    """
+    database_manager = use_database(dsn)
+    catalog = load_synthetic_catalog(database_manager, songs = songs, windows = windows, seed = seed)
+    rng = np.random.RandomState(seed + 1)
+    song_ids = list(catalog)
+    per_window_times = []
+    batched_times = []
+    agree = 0
+    for _ in range(queries):
+        song_id = song_ids[rng.randint(len(song_ids))]
+        start = rng.randint(windows - snippet_windows)
+        snippet = catalog[song_id][method][start:start + snippet_windows]*(1 + 1e-6*rng.randn(snippet_windows, 1))
+        per_window_time, per_window = time_call(lambda: per_window_nearest(database_manager, snippet, method), 1)
+        batched_time, batched = time_call(lambda: database_manager.nearest_fingerprints(snippet, method), 1)
+        per_window_times.append(per_window_time)
+        batched_times.append(batched_time)
+        agree += int([row[0] for row in per_window] == [row[1] for row in batched])
+    results = {
+        "catalog_fingerprints": songs*windows,
+        "snippet_windows": snippet_windows,
+        "per_window_mean_seconds": float(np.mean(per_window_times)),
+        "per_window_median_seconds": float(np.median(per_window_times)),
+        "batched_mean_seconds": float(np.mean(batched_times)),
+        "batched_median_seconds": float(np.median(batched_times)),
+        "speedup": float(np.mean(per_window_times)/np.mean(batched_times)),
+        "queries_with_identical_matches": agree,
+        "queries": queries,
+    }
+    return(results)
+
+
+def per_row_write_song(database_manager, title, fingerprints1, fingerprints5):
+    """Function is the old add_function write path (one INSERT and one commit per window), kept as the baseline."""
+    cur = database_manager.cur
+    cur.execute("INSERT INTO songs (title, artist, album, path, sample_rate, date, source) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING song_id", (title, "bench artist", "bench album", "bench", 44100, "2020", "local"))
+    song_id = cur.fetchone()[0]
+    database_manager.backend.conn.commit()
+    for i in range(len(fingerprints1)):
+        cur.execute("INSERT INTO fingerprints (song_id, num_fingerprints, fingerprint1, fingerprint5) "
+                    "VALUES (%s, %s, cube(%s), cube(%s))", (song_id, len(fingerprints1), list(fingerprints1[i]), list(fingerprints5[i])))
+        database_manager.backend.conn.commit()
+    return(song_id)
+
+
+def benchmark_ingest(dsn, songs = 20, windows = 240, seed = 0):
+    """
+    Function compares the ingest throughput of one INSERT + commit per window against write_song (one COPY in one transaction), against a local Postgres.
+
+    Inputs: dsn (string, libpq connection string of a throwaway database)
+            songs (integer, synthetic songs written with each path)
+            windows (integer, fingerprints per song)
+            seed (integer)
+
+    Outputs: Dictionary of rows per second for each path and the speedup
+    """
+    database_manager = use_database(dsn)
+    rng = np.random.RandomState(seed)
+    data = [(np.sort(rng.rand(windows, 3), axis = 1), rng.lognormal(8, 2, (windows, 8))) for _ in range(2*songs)]
+
+    start = time.perf_counter()
+    for index_song in range(songs):
+        per_row_write_song(database_manager, "bench per-row " + str(seed) + " " + str(index_song), *data[index_song])
+    per_row_rate = songs*windows/(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for index_song in range(songs):
+        fingerprints1, fingerprints5 = data[songs + index_song]
+        song_hash = spectral_analysis.content_hash(np.concatenate([fingerprints1.ravel(), fingerprints5.ravel()]), 44100)
+        database_manager.write_song("bench copy " + str(seed) + " " + str(index_song), "bench artist", "bench album", "bench", 44100, "2020", "local",
+                                    fingerprints1, fingerprints5, song_hash)
+    copy_rate = songs*windows/(time.perf_counter() - start)
+    results = {
+        "songs": songs,
+        "fingerprints_per_song": windows,
+        "per_row_rows_per_second": per_row_rate,
+        "copy_rows_per_second": copy_rate,
+        "speedup": copy_rate/per_row_rate,
+    }
+    return(results)
+
+
+def synthetic_catalog(songs = 2000, windows = 240, method = "five", seed = 0):
+    """
+    Function builds an in-memory catalog of synthetic fingerprints, laid out like database_manager.load_catalog returns them.
+
+    Inputs: songs (integer)
+            windows (integer, fingerprints per song)
+            method (string, one or five)
+            seed (integer)
+
+    Outputs: song_ids (numpy.ndarray, song of each row) and fingerprints (2-D numpy.ndarray)
+    """
+    rng = np.random.RandomState(seed)
+    if method == "one":
+        fingerprints = np.sort(rng.rand(songs*windows, 3), axis = 1)
+    else:
+        fingerprints = rng.lognormal(8, 2, (songs*windows, 8))
+    return([np.repeat(np.arange(1, songs + 1), windows), fingerprints])
+
+
+def benchmark_catalog_scan(songs = 2000, windows = 240, snippet_windows = 11, method = "five", epsilon = 1000, repeats = 3):
+    """
+    Function compares the old per-song slow_search loop (DataFrame filter per song, then match + score) against one pass of score_catalog.
+
+    Inputs: songs (integer, synthetic songs in the catalog)
+            windows (integer, fingerprints per song)
+            snippet_windows (integer, windows in the snippet)
+            method (string, one or five)
+            epsilon (float)
+            repeats (integer, number of timed runs)
+
+    Outputs: Dictionary of timings (seconds), the speedup and whether both found the same best song
+    """
+    song_ids, catalog = synthetic_catalog(songs = songs, windows = windows, method = method)
+    snippet = catalog[windows*(songs//2) + 100:windows*(songs//2) + 100 + snippet_windows]*1.0001
+    finger_df = pandas.DataFrame({"song_id": song_ids, "row": np.arange(len(song_ids))})
+
+    def per_song():
+        best_song, best_ratio = None, 0
+        for index_row in finger_df.song_id.unique():
+            rows = finger_df[finger_df['song_id']==index_row]["row"].to_numpy()
+            _, _, hit_ratio = spectral_analysis.score_alignment(spectral_analysis.match_fingerprints(snippet, catalog[rows]), epsilon)
+            if hit_ratio >= .05 and hit_ratio > best_ratio:
+                best_song, best_ratio = index_row, hit_ratio
+        return(best_song)
+
+    def one_pass():
+        songs_found, song_starts = np.unique(song_ids, return_index = True)
+        _, _, hit_ratio = spectral_analysis.score_catalog(snippet, catalog, song_starts, epsilon)
+        return(songs_found[np.argmax(hit_ratio)] if hit_ratio.max() >= .05 else None)
+
+    loop_time, loop_song = time_call(per_song, repeats)
+    scan_time, scan_song = time_call(one_pass, repeats)
+    results = {
+        "catalog_fingerprints": int(len(catalog)),
+        "catalog_mb": catalog.nbytes/2**20,
+        "per_song_seconds": loop_time,
+        "one_pass_seconds": scan_time,
+        "speedup": loop_time/scan_time,
+        "one_pass_mb_per_second": catalog.nbytes/2**20/scan_time,
+        "same_best_song": bool(loop_song == scan_song),
+    }
+    return(results)
+
+
+def benchmark_index(sizes = (100, 1000, 10000), windows = 240, snippet_windows = 11, queries = 20, method = "five", dsn = None, seed = 0):
+    """
+    Function measures batched k-NN latency against catalog size for the in-process KD-tree, a brute-force numpy scan and
+    (if a dsn is given) the batched SQL query in Postgres.
+
+    Inputs: sizes (list of integers, catalog sizes in songs)
+            windows (integer, fingerprints per song)
+            snippet_windows (integer, windows per query snippet)
+            queries (integer, number of snippets timed per size)
+            method (string, one or five)
+            dsn (string, connection string of a throwaway Postgres database, optional)
+            seed (integer)
+
+    Outputs: Dictionary of catalog size -> build time and mean query latency (seconds) of each backend
+    """
+    database_manager = use_database(dsn) if dsn else None
+    results = {}
+    loaded_songs = 0
+    for songs in sizes:
+        song_ids, catalog = synthetic_catalog(songs = songs, windows = windows, method = method, seed = seed)
+        build_time, index = time_call(lambda: fingerprint_index.build_index(song_ids, np.arange(len(song_ids)), catalog), 1)
+        rng = np.random.RandomState(seed + 1)
+        snippets = []
+        for _ in range(queries):
+            start = rng.randint(len(catalog) - snippet_windows)
+            snippets.append(catalog[start:start + snippet_windows]*(1 + 1e-6*rng.randn(snippet_windows, 1)))
+        tree_times = [time_call(lambda: fingerprint_index.query_index(index, snippet), 1)[0] for snippet in snippets]
+        brute_times = [time_call(lambda: np.argmin(spectral_analysis.match_fingerprints(snippet, catalog, squared = True), axis = 0), 1)[0] for snippet in snippets]
+        row = {"fingerprints": int(len(catalog)), "build_seconds": build_time,
+               "kdtree_query_seconds": float(np.mean(tree_times)), "brute_force_query_seconds": float(np.mean(brute_times))}
+        if database_manager is not None:
+            # the SQL catalog only grows, so top it up to this size
+            load_synthetic_catalog(database_manager, songs = songs - loaded_songs, windows = windows, seed = seed + songs)
+            loaded_songs = songs
+            row["sql_query_seconds"] = float(np.mean([time_call(lambda: database_manager.nearest_fingerprints(snippet, method), 1)[0] for snippet in snippets]))
+        results[str(songs) + "_songs"] = row
+    return(results)
+
+
+def benchmark_backends(songs = 200, windows = 240, snippet_windows = 11, queries = 20, method = "five", dsn = None, seed = 0):
+    """
+    Function runs the same workload (write every song, load the catalog, search snippets) against the embedded SQLite backend
+    and, if a dsn is given, the Postgres backend.
+
+    Inputs: songs (integer, synthetic songs written)
+            windows (integer, fingerprints per song)
+            snippet_windows (integer, windows per query snippet)
+            queries (integer, number of snippets timed)
+            method (string, one or five)
+            dsn (string, connection string of a throwaway Postgres database, optional)
+            seed (integer)
+
+    Outputs: Dictionary of backend -> write throughput (rows per second), catalog load time and mean search latency (seconds)
+    """
+    rng = np.random.RandomState(seed)
+    data = [(np.sort(rng.rand(windows, 3), axis = 1), rng.lognormal(8, 2, (windows, 8))) for _ in range(songs)]
+    snippets = []
+    for _ in range(queries):
+        fingerprints = data[rng.randint(songs)][0 if method == "one" else 1]
+        start = rng.randint(windows - snippet_windows)
+        snippets.append(fingerprints[start:start + snippet_windows]*(1 + 1e-6*rng.randn(snippet_windows, 1)))
+
+    workdir = tempfile.TemporaryDirectory()
+    backends = {"sqlite": storage_backends.get_backend("sqlite", path = os.path.join(workdir.name, "freezam.db"))}
+    if dsn:
+        backends["postgres"] = storage_backends.get_backend("postgres", dsn = dsn)
+    results = {}
+    for name, backend in backends.items():
+        backend.create_tables()
+        start = time.perf_counter()
+        for index_song in range(songs):
+            fingerprints1, fingerprints5 = data[index_song]
+            song_hash = spectral_analysis.content_hash(np.concatenate([fingerprints1.ravel(), fingerprints5.ravel()]), 44100 + seed)
+            backend.write_song("bench backend " + str(index_song), "bench artist", "bench album", "bench", 44100, "2020", "local",
+                               fingerprints1, fingerprints5, song_hash)
+        write_rate = songs*windows/(time.perf_counter() - start)
+        backend.maintain_indexes()
+        load_time, _ = time_call(lambda: backend.load_catalog(method), 1)
+        # the first search pays for any index build, so it is reported on its own
+        first_time, _ = time_call(lambda: backend.nearest_fingerprints(snippets[0], method), 1)
+        search_times = [time_call(lambda: backend.nearest_fingerprints(snippet, method), 1)[0] for snippet in snippets]
+        results[name] = {"write_rows_per_second": write_rate, "load_catalog_seconds": load_time,
+                         "first_search_seconds": first_time, "search_seconds": float(np.mean(search_times))}
+        backend.close()
+    workdir.cleanup()
+    return(results)
+
+
+def benchmark_constellation(sizes = (10, 100, 1000), hashes_per_song = 20000, snippet_seconds = 10, queries = 10, dsn = None, seed = 0):
+    """
+    Function measures constellation search latency (hash lookup in the inverted index + offset voting) against catalog size.
+    The catalog is one real (synthetic-audio) song plus filler songs with random hashes, on the SQLite backend (and on Postgres with a dsn).
+
+    Inputs: sizes (list of integers, catalog sizes in songs)
+            hashes_per_song (integer, hashes of each filler song, about a 4-minute song)
+            snippet_seconds (integer, length of each query snippet)
+            queries (integer, number of snippets timed per size)
+            dsn (string, connection string of a throwaway Postgres database, optional)
+            seed (integer)
+
+    Outputs: Dictionary of backend and catalog size -> mean lookup and scoring time (seconds), rows matched and share of correct answers
+    """
+    samplerate, series = synthetic_track(seconds = 60, seed = seed)
+    song_hashes = spectral_analysis.constellation_hashes(series)
+    rng = np.random.RandomState(seed)
+    snippets = []
+    for _ in range(queries):
+        start = rng.randint(len(series) - snippet_seconds*samplerate)
+        snippets.append(spectral_analysis.constellation_hashes(series[start:start + snippet_seconds*samplerate]))
+
+    workdir = tempfile.TemporaryDirectory()
+    backends = {"sqlite": storage_backends.get_backend("sqlite", path = os.path.join(workdir.name, "freezam.db"))}
+    if dsn:
+        backends["postgres"] = storage_backends.get_backend("postgres", dsn = dsn)
+    results = {}
+    empty = np.zeros((1, 3)), np.zeros((1, 8))
+    for name, backend in backends.items():
+        backend.create_tables()
+        song_id = backend.write_song("bench constellation", "bench artist", "bench album", "bench", samplerate, "2020", "local",
+                                     *empty, "bench constellation " + str(seed), hashes = song_hashes)[0]
+        loaded_songs = 1
+        for songs in sizes:
+            # the catalog only grows, so top it up to this size with filler songs
+            for index_song in range(loaded_songs, songs):
+                filler = (rng.randint(0, 2**26, hashes_per_song).astype(np.int32), np.sort(rng.randint(0, 20000, hashes_per_song)).astype(np.int32))
+                backend.write_song("bench filler " + str(index_song), "bench artist", "bench album", "bench", samplerate, "2020", "local",
+                                   *empty, "bench filler " + str(seed) + " " + str(index_song), hashes = filler)
+            loaded_songs = max(loaded_songs, songs)
+            backend.maintain_indexes()
+
+            def search(snippet):
+                found = backend.lookup_hashes(snippet[0])
+                return(spectral_analysis.score_hashes(snippet[0], snippet[1], *found), len(found[0]))
+
+            times, rows, correct = [], [], 0
+            for snippet in snippets:
+                search_time, ((matched_songs, _, score), matched_rows) = time_call(lambda: search(snippet), 1)
+                times.append(search_time)
+                rows.append(matched_rows)
+                correct += int(len(score) > 0 and matched_songs[np.argmax(score)] == song_id)
+            results[name + "_" + str(songs) + "_songs"] = {"catalog_hashes": songs*hashes_per_song, "search_seconds": float(np.mean(times)),
+                                                           "rows_matched": float(np.mean(rows)), "correct": correct/queries}
+        backend.close()
+    workdir.cleanup()
+    return(results)
+
+
+def benchmark_add_dir(files = 32, seconds = 60, workers = (1, None), batch_size = 32, seed = 0):
+    """
+    Function measures directory ingestion throughput (add_dir) for different numbers of worker processes,
+    on a directory of synthetic WAVs and a fresh SQLite database for each run.
+
+    Inputs: files (integer, WAVs in the directory)
+            seconds (integer, length of each WAV)
+            workers (list of integers, worker processes per run, None uses every core)
+            batch_size (integer, songs written per transaction)
+            seed (integer)
+
+    Outputs: Dictionary of workers -> files per minute and seconds taken
+    """
+    workdir = tempfile.TemporaryDirectory()
+    wav_dir = os.path.join(workdir.name, "WAVs")
+    os.mkdir(wav_dir)
+    write_synthetic_wavs(wav_dir, files, seconds = seconds, seed = seed)
+    import database_manager
+    results = {}
+    for index_run, count in enumerate(workers):
+        database_manager.set_backend(storage_backends.get_backend("sqlite", path = os.path.join(workdir.name, "run" + str(index_run) + ".db")))
+        summary = database_manager.add_dir(wav_dir, workers = count, batch_size = batch_size)
+        results[str(count or os.cpu_count()) + "_workers"] = {"files_per_minute": summary["files_per_minute"], "seconds": summary["seconds"],
+                                                                 "failed": summary["failed"]}
+        database_manager.backend.close()
+    workdir.cleanup()
+    return(results)
+
+
+def write_synthetic_wavs(directory, files, seconds = 60, seed = 0, prefix = "bench song "):
+    """
+    Function fills a directory with synthetic WAVs named with the title_artist_album_date convention.
+
+    Inputs: directory (str)
+            files (integer, number of WAVs)
+            seconds (integer, length of each WAV)
+            seed (integer, seed of the first WAV)
+            prefix (str, start of each title)
+
+    Outputs: List of paths written
+    """
+    from scipy.io import wavfile
+    paths = []
+    for index_file in range(files):
+        samplerate, series = synthetic_track(seconds = seconds, seed = seed + index_file)
+        scaled = (series/np.abs(series).max()*20000).astype(np.int16)
+        paths.append(os.path.join(directory, prefix + str(index_file) + "_bench artist " + str(index_file % 7) + "_bench album_2020.wav"))
+        wavfile.write(paths[-1], samplerate, scaled)
+    return(paths)
+
+
+def per_file_recommend(database_manager, path_to_data):
+    """Function is the old recommend loop (one kNN query per window, DataFrame grown file by file), kept as the baseline."""
+    ultimate_df = pandas.DataFrame(columns=['song_id', 'f_id', 'title', 'artist', 'distance'])
+    for filename in sorted(os.listdir(path_to_data)):
+        fingerprints = spectral_analysis.fingerprint_wav(os.path.join(path_to_data, filename))["one"]
+        finger_df = pandas.DataFrame(columns=['song_id', 'f_id', 'title', 'artist', 'distance'])
+        for index_row in range(len(fingerprints)):
+            matches = database_manager.nearest_fingerprints(fingerprints[index_row:index_row + 1], "one")
+            finger_df = pandas.concat([finger_df, pandas.DataFrame([row[1:] for row in matches], columns = finger_df.columns)])
+        ultimate_df = pandas.concat([ultimate_df, finger_df[finger_df['distance'] == finger_df['distance'].min()]])
+    return(ultimate_df.groupby(['title'])['distance'].count().sort_values(ascending=False).head(10))
+
+
+def benchmark_recommend(catalog_songs = 50, files = 40, seconds = 60, workers = None, dsn = None, seed = 0):
+    """
+    Function compares the old recommend loop with the parallel, batched recommend, on a SQLite catalog of synthetic songs
+    and a library of synthetic WAVs (half of them also in the catalog).
+
+    Inputs: catalog_songs (integer, songs in the catalog)
+            files (integer, WAVs in the library)
+            seconds (integer, length of each WAV)
+            workers (integer, worker processes of the batched recommend, default is every core)
+            seed (integer)
+
+    Outputs: Dictionary of timings (seconds), the speedup and whether both recommended the same songs
+    """
+    import database_manager
+    workdir = tempfile.TemporaryDirectory()
+    catalog_dir, library_dir = os.path.join(workdir.name, "catalog"), os.path.join(workdir.name, "library")
+    os.mkdir(catalog_dir)
+    os.mkdir(library_dir)
+    write_synthetic_wavs(catalog_dir, catalog_songs, seconds = seconds, seed = seed)
+    write_synthetic_wavs(library_dir, files, seconds = seconds, seed = seed + catalog_songs - files//2, prefix = "library song ")
+    database_manager.set_backend(storage_backends.get_backend("sqlite", path = os.path.join(workdir.name, "freezam.db")))
+    database_manager.add_dir(catalog_dir, workers = workers)
+    database_manager.nearest_fingerprints(np.zeros((1, 3)), "one")
+
+    loop_time, loop_songs = time_call(lambda: per_file_recommend(database_manager, library_dir), 1)
+    batched_time, (batched_songs, _) = time_call(lambda: database_manager.recommend(library_dir, workers = workers), 1)
+    results = {
+        "files": files,
+        "per_file_seconds": loop_time,
+        "batched_seconds": batched_time,
+        "speedup": loop_time/batched_time,
+        "same_top_songs": bool(set(loop_songs.index) == set(batched_songs.index)),
+    }
+    database_manager.backend.close()
+    workdir.cleanup()
+    return(results)
+
+
+def benchmark_cache(files = 32, seconds = 60, seed = 0):
+    """
+    Function measures how long fingerprinting a corpus (fingerprint_file, as in add_dir) takes with an empty fingerprint cache,
+    again over the unchanged files, and over renamed copies of them (which are decoded and found by content hash).
+
+    Inputs: files (integer, synthetic WAVs in the corpus)
+            seconds (integer, length of each WAV)
+            seed (integer)
+
+    Outputs: Dictionary of pass -> seconds taken, and the speedup of each cached pass
+    """
+    workdir = tempfile.TemporaryDirectory()
+    wav_dir = os.path.join(workdir.name, "WAVs")
+    os.mkdir(wav_dir)
+    paths = write_synthetic_wavs(wav_dir, files, seconds = seconds, seed = seed)
+    previous_dir = fingerprint_cache.CACHE_DIR
+    fingerprint_cache.CACHE_DIR = os.path.join(workdir.name, "cache")
+    try:
+        cold = time_call(lambda: [spectral_analysis.fingerprint_file(path) for path in paths], repeats = 1)[0]
+        warm = time_call(lambda: [spectral_analysis.fingerprint_file(path) for path in paths], repeats = 3)[0]
+        copies = []
+        for path in paths:
+            copies.append(path.replace("bench song", "renamed song"))
+            shutil.copyfile(path, copies[-1])
+        renamed = time_call(lambda: [spectral_analysis.fingerprint_file(path) for path in copies], repeats = 1)[0]
+        results = {
+            "files": files,
+            "cold_seconds": cold,
+            "warm_seconds": warm,
+            "renamed_seconds": renamed,
+            "warm_speedup": cold/warm,
+            "renamed_speedup": cold/renamed,
+            "cache_mb": fingerprint_cache.cache_size()/2**20,
+        }
+    finally:
+        fingerprint_cache.CACHE_DIR = previous_dir
+        workdir.cleanup()
+    return(results)
+
+
+def benchmark_profiling(path = None, seconds = 240, calls = 1000000, repeats = 3):
+    """
+    Function measures what the profiling instrumentation costs: the time added per call of a timed function while profiling is off,
+    and how long fingerprinting a track takes with profiling off, on (timings only) and on with memory tracking.
+
+    Inputs: path (str, WAV to fingerprint, default a synthetic track)
+            seconds (integer, length of the synthetic track)
+            calls (integer, calls timed for the per-call overhead)
+            repeats (integer, timed runs per variant)
+
+    Outputs: Dictionary of timings, the estimated overhead of the disabled instrumentation and the slowdown when it is on
+    """
+    samplerate, series = load_track(path, seconds)
+    nothing = lambda: None
+    timed_nothing = profiling.timed("nothing")(nothing)
+    plain_seconds = time_call(lambda: [nothing() for _ in range(calls)], repeats = repeats)[0]
+    timed_seconds = time_call(lambda: [timed_nothing() for _ in range(calls)], repeats = repeats)[0]
+    fingerprint = lambda: spectral_analysis.compute_fingerprints(series, samplerate, methods = ("one", "five"))
+    off = time_call(fingerprint, repeats = repeats)[0]
+    profiling.enable(memory = False)
+    timings_only = time_call(fingerprint, repeats = repeats)[0]
+    profiling.disable()
+    spans = sum(stage["calls"] for stage in profiling.summary().values())/repeats
+    profiling.enable(memory = True)
+    with_memory = time_call(fingerprint, repeats = 1)[0]
+    profiling.disable()
+    overhead_ns = max(timed_seconds - plain_seconds, 0)/calls*1e9
+    results = {
+        "disabled_overhead_ns_per_call": overhead_ns,
+        "spans_per_track": spans,
+        "disabled_overhead_percent": 100*overhead_ns*1e-9*spans/off,
+        "profiling_off_seconds": off,
+        "timings_only_seconds": timings_only,
+        "with_memory_seconds": with_memory,
+        "timings_only_slowdown": timings_only/off,
+        "with_memory_slowdown": with_memory/off,
+    }
+    return(results)
+
+
+def load_test(port, payloads, clients, requests, path = "/identify?method=five&epsilon=10000"):
+    """
+    Function sends requests to a local server from several client threads, each keeping one connection alive.
+
+    Inputs: port (integer, of a server on 127.0.0.1)
+            payloads (list of bytes, WAV bodies sent in turn)
+            clients (integer, concurrent client threads)
+            requests (integer, requests sent in total)
+            path (str, path and query of each request)
+
+    Outputs: Dictionary with the requests per second, latency percentiles (ms) and the number of failed requests
+    """
+    latencies = []
+    failures = []
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        while True:
+            with counter_lock:
+                number = next(counter, None)
+            if number is None:
+                break
+            start = time.perf_counter()
+            connection.request("POST", path, body = payloads[number % len(payloads)], headers = {"Content-Type": "audio/wav"})
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                failures.append(response.status)
+        connection.close()
+
+    threads = [threading.Thread(target = client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    milliseconds = 1000*np.array(latencies)
+    return({"requests_per_second": len(latencies)/elapsed, "p50_ms": float(np.percentile(milliseconds, 50)),
+            "p95_ms": float(np.percentile(milliseconds, 95)), "p99_ms": float(np.percentile(milliseconds, 99)), "failed": len(failures)})
+
+
+def benchmark_serve(songs = 50, seconds = 60, snippet_seconds = 10, clients = (1, 4), requests = 200, cli_queries = 3, method = "five", epsilon = 10000, seed = 0):
+    """
+    Function load-tests the warm search server (freezam.py serve) on a SQLite catalog of synthetic songs, for each number of
+    concurrent clients, and compares it with running one freezam.py fast_search process per query.
+
+    Inputs: songs (integer, songs in the catalog)
+            seconds (integer, length of each song)
+            snippet_seconds (integer, length of each snippet sent)
+            clients (list of integers, concurrent clients of each run)
+            requests (integer, requests per run)
+            cli_queries (integer, freezam.py processes timed, 0 to skip)
+            method (str), epsilon (float)
+            seed (integer)
+
+    Outputs: Dictionary of run -> requests per second and latency percentiles, and the seconds per query of the command line
+    """
+    from scipy.io import wavfile
+    import database_manager
+    import server
+    workdir = tempfile.TemporaryDirectory()
+    catalog_dir = os.path.join(workdir.name, "catalog")
+    os.mkdir(catalog_dir)
+    paths = write_synthetic_wavs(catalog_dir, songs, seconds = seconds, seed = seed)
+    database_path = os.path.join(workdir.name, "freezam.db")
+    database_manager.set_backend(storage_backends.get_backend("sqlite", path = database_path))
+    database_manager.add_dir(catalog_dir, workers = 1)
+    rng = np.random.RandomState(seed)
+    payloads = []
+    for path in paths[:20]:
+        samplerate, data = wavfile.read(path)
+        start = rng.randint(0, len(data) - snippet_seconds*samplerate)
+        buffer = io.BytesIO()
+        wavfile.write(buffer, samplerate, data[start:start + snippet_seconds*samplerate])
+        payloads.append(buffer.getvalue())
+    httpd = server.make_server(port = 0, methods = [method])
+    thread = threading.Thread(target = httpd.serve_forever, daemon = True)
+    thread.start()
+    results = {}
+    try:
+        for count in clients:
+            results[str(count) + "_clients"] = load_test(httpd.server_address[1], payloads, count, requests, path = "/identify?method=" + method + "&epsilon=" + str(epsilon))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    if cli_queries:
+        snippet_path = os.path.join(workdir.name, "snippet.wav")
+        with open(snippet_path, "wb") as f:
+            f.write(payloads[0])
+        environment = dict(os.environ, FREEZAM_BACKEND = "sqlite", FREEZAM_SQLITE_PATH = database_path, FREEZAM_CACHE = "off")
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "freezam.py"), "fast_search", "--path=" + snippet_path,
+                   "--source=local", "--epsilon=" + str(epsilon), "--method=" + method]
+        cli_time = time_call(lambda: subprocess.run(command, env = environment, cwd = workdir.name, capture_output = True, check = True), cli_queries)[0]
+        results["command_line"] = {"seconds_per_query": cli_time, "requests_per_second": 1/cli_time}
+    database_manager.backend.close()
+    workdir.cleanup()
+    return(results)
+
+
+def benchmark_startup(repeats = 5):
+    """
+    Function measures how long freezam.py takes from launch to exit for each kind of subcommand, on an empty SQLite database,
+    so the cost of start-up (imports, connecting) shows up separately from the work of a search.
+
+    Inputs: repeats (integer, runs of each command, the median is reported)
+
+    Outputs: Dictionary of command -> median seconds
+    """
+    from scipy.io import wavfile
+    workdir = tempfile.TemporaryDirectory()
+    database_path = os.path.join(workdir.name, "freezam.db")
+    storage_backends.get_backend("sqlite", path = database_path).create_tables()
+    snippet_path = os.path.join(workdir.name, "snippet.wav")
+    wavfile.write(snippet_path, 44100, (np.random.RandomState(0).randn(44100*10)*3000).astype(np.int16))
+    commands = {
+        "version": ["--version"],
+        "help": ["--help"],
+        "list": ["list"],
+        "update_album": ["update_album", "--title=none", "--artist=none", "--new_album=none"],
+        "fast_search": ["fast_search", "--path=" + snippet_path, "--source=local", "--method=constellation"],
+    }
+    environment = dict(os.environ, FREEZAM_BACKEND = "sqlite", FREEZAM_SQLITE_PATH = database_path, FREEZAM_CACHE = "off")
+    freezam = os.path.join(os.path.dirname(os.path.abspath(__file__)), "freezam.py")
+    results = {}
+    for name, arguments in commands.items():
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, freezam] + arguments, env = environment, cwd = workdir.name, capture_output = True)
+            timings.append(time.perf_counter() - start)
+        results[name] = float(np.median(timings))
+    workdir.cleanup()
+    return(results)
+
+
+def benchmark_progressive(songs = 20, seconds = 60, snippet_seconds = 30, queries = 10, noise = 1.0, method = "five", epsilon = 10000, seed = 0):
+    """
+    Function compares the full fast_search identification (every window fingerprinted and looked up) with progressive_identify,
+    which stops once the leading song's lead is decisive, on clean and noisy excerpts of catalog songs and on songs not in the catalog.
+    Excerpts start on a whole second (the window hop), since the synthetic songs are too alike for method five to tell apart otherwise.
+
+    Inputs: songs (integer, songs in the catalog)
+            seconds (integer, length of each song)
+            snippet_seconds (integer, length of each excerpt)
+            queries (integer, excerpts per kind)
+            noise (float, standard deviation of the noise added to the noisy excerpts, relative to the excerpt's)
+            method (str), epsilon (float)
+            seed (integer)
+
+    Outputs: Dictionary of kind of excerpt -> seconds per query of both searches, the speedup, the mean share of windows
+             progressive search used and how often both searches gave the same answer
+    """
+    from scipy.io import wavfile
+    import database_manager
+    workdir = tempfile.TemporaryDirectory()
+    catalog_dir, other_dir = os.path.join(workdir.name, "catalog"), os.path.join(workdir.name, "other")
+    os.mkdir(catalog_dir)
+    os.mkdir(other_dir)
+    paths = write_synthetic_wavs(catalog_dir, songs, seconds = seconds, seed = seed)
+    others = write_synthetic_wavs(other_dir, queries, seconds = seconds, seed = seed + songs, prefix = "other song ")
+    database_manager.set_backend(storage_backends.get_backend("sqlite", path = os.path.join(workdir.name, "freezam.db")))
+    database_manager.add_dir(catalog_dir, workers = 1)
+    database_manager.nearest_fingerprints(np.zeros((1, database_manager.FINGERPRINT_DIMENSIONS[method])), method)
+    rng = np.random.RandomState(seed)
+    excerpts = {"clean": [], "noisy": [], "not_in_catalog": []}
+    for index_query in range(queries):
+        for kind, path in [("clean", paths[index_query % songs]), ("not_in_catalog", others[index_query])]:
+            samplerate, data = wavfile.read(path)
+            start = rng.randint(0, len(data)//samplerate - snippet_seconds)*samplerate
+            excerpts[kind].append(data[start:start + snippet_seconds*samplerate].astype(np.float32))
+        excerpts["noisy"].append(excerpts["clean"][-1] + (rng.randn(len(excerpts["clean"][-1]))*noise*excerpts["clean"][-1].std()).astype(np.float32))
+
+    def full_search(series):
+        fingerprints = spectral_analysis.compute_fingerprints(series, samplerate, methods = (method,))[method]
+        return(database_manager.identify_matches(database_manager.nearest_fingerprints(fingerprints, method), len(fingerprints), epsilon))
+
+    results = {}
+    for kind, series_list in excerpts.items():
+        full_time, full = time_call(lambda: [full_search(series) for series in series_list], 1)
+        progressive_time, progressive = time_call(lambda: [database_manager.progressive_identify(series, samplerate, method, epsilon) for series in series_list], 1)
+        results[kind] = {
+            "full_seconds_per_query": full_time/queries,
+            "progressive_seconds_per_query": progressive_time/queries,
+            "speedup": full_time/progressive_time,
+            "windows_used": float(np.mean([result["windows"]/result["windows_total"] for result in progressive])),
+            "same_answer": sum(1 for a, b in zip(full, progressive) if a["match"] == b["match"] and (not a["match"] or a["title"] == b["title"]))/queries,
+        }
+    database_manager.backend.close()
+    workdir.cleanup()
+    return(results)
+
+
+def benchmark_streaming(songs = 20, seconds = 60, queries = 10, block_seconds = .25, record_seconds = 15, method = "five", epsilon = 10000, seed = 0):
+    """
+    Function measures how soon the streaming recognizer answers, against recording a fixed snippet (record_song: a 3-second
+    countdown and record_seconds of audio) before searching it. Excerpts of a SQLite catalog of synthetic songs are streamed
+    in blocks as fast as they can be processed, so the latency of a live stream is the audio it needed plus the time behind it.
+
+    Inputs: songs (integer, songs in the catalog)
+            seconds (integer, length of each song)
+            queries (integer, excerpts streamed)
+            block_seconds (float, length of each block)
+            record_seconds (integer, length of the recorded snippet it is compared with)
+            method (str), epsilon (float)
+            seed (integer)
+
+    Outputs: Dictionary with the mean audio seconds needed, the processing time per window and the latency of a live stream
+             and of recording then searching, and the share of streams matched to the right song
+    """
+    from scipy.io import wavfile
+    import database_manager
+    import streaming
+    workdir = tempfile.TemporaryDirectory()
+    catalog_dir = os.path.join(workdir.name, "catalog")
+    os.mkdir(catalog_dir)
+    paths = write_synthetic_wavs(catalog_dir, songs, seconds = seconds, seed = seed)
+    database_manager.set_backend(storage_backends.get_backend("sqlite", path = os.path.join(workdir.name, "freezam.db")))
+    database_manager.add_dir(catalog_dir, workers = 1)
+    database_manager.nearest_fingerprints(np.zeros((1, database_manager.FINGERPRINT_DIMENSIONS[method])), method)
+    rng = np.random.RandomState(seed)
+    streams = []
+    for index_query in range(queries):
+        samplerate, data = wavfile.read(paths[index_query % songs])
+        start = rng.randint(0, len(data)//samplerate - record_seconds)*samplerate
+        result = streaming.recognize_stream(streaming.array_source(data[start:], samplerate, block_seconds = block_seconds), samplerate, method, epsilon)
+        result["expected"] = database_manager.parse_filename(paths[index_query % songs])[0]
+        streams.append(result)
+    search_time = time_call(lambda: database_manager.identify(data[:record_seconds*samplerate].astype(np.float32), samplerate, method, epsilon), 3)[0]
+    audio_seconds = float(np.mean([result["audio_seconds"] for result in streams]))
+    seconds_per_window = float(np.sum([result["seconds"] for result in streams])/np.sum([result["windows"] for result in streams]))
+    results = {
+        "stream_audio_seconds": audio_seconds,
+        "stream_seconds_per_window": seconds_per_window,
+        "stream_latency_seconds": audio_seconds + seconds_per_window,
+        "record_then_search_seconds": 3 + record_seconds + search_time,
+        "stream_correct": sum(1 for result in streams if result["match"] and result["title"] == result["expected"])/queries,
+    }
+    database_manager.backend.close()
+    workdir.cleanup()
+    return(results)
+
+
+def benchmark_decimation(path = None, seconds = 240, snippet_seconds = 15, h = 5, repeats = 3):
+    """
+    Function compares computing fingerprints at the full sample rate with computing them from decimated audio, for ingesting
+    a track (methods one and five, as add_function does, and each method alone) and for searching a snippet (method five).
+    It also reports the window length (FFT size) of each method, the peak memory of fingerprinting, and how far the decimated
+    fingerprints are from the full-rate ones.
+
+    Inputs: path (str, WAV to fingerprint, default a synthetic track)
+            seconds (integer, length of the synthetic track)
+            snippet_seconds (integer, length of the snippet searched)
+            h (integer, window length in seconds)
+            repeats (integer)
+
+    Outputs: Dictionary of timings (seconds), speedups, window lengths, peak memory (MB) and the largest relative distance per method
+    """
+    samplerate, series = load_track(path = path, seconds = seconds)
+    series = np.asarray(series, dtype = np.float32)
+    snippet = series[:snippet_seconds*samplerate]
+    results = {}
+    workloads = {"ingest_one_five": (series, ("one", "five")), "ingest_two": (series, ("two",)), "ingest_five": (series, ("five",)),
+                 "search_five": (snippet, ("five",))}
+    for name, (track, methods) in workloads.items():
+        full_time, full = time_call(lambda: spectral_analysis.compute_fingerprints(track, samplerate, methods = methods, h = h, decimate = False), repeats)
+        fast_time, fast = time_call(lambda: spectral_analysis.compute_fingerprints(track, samplerate, methods = methods, h = h, decimate = True), repeats)
+        results[name] = {"full_seconds": full_time, "decimated_seconds": fast_time, "speedup": full_time/fast_time}
+        if name.startswith("ingest"):
+            for method in methods:
+                error = np.linalg.norm(fast[method] - full[method], axis = 1)/np.maximum(np.linalg.norm(full[method], axis = 1), 1e-12)
+                results[name][method + "_max_relative_distance"] = float(error.max())
+    for method in ("two", "five"):
+        factor = spectral_analysis.decimation_factor(samplerate, method, h = h)
+        full_mb = peak_memory(lambda: spectral_analysis.compute_fingerprints(series, samplerate, methods = (method,), h = h, decimate = False))[0]
+        fast_mb = peak_memory(lambda: spectral_analysis.compute_fingerprints(series, samplerate, methods = (method,), h = h, decimate = True))[0]
+        results["window_" + method] = {"factor": factor, "full_window": h*samplerate, "decimated_window": h*samplerate//factor,
+                                       "full_peak_mb": full_mb, "decimated_peak_mb": fast_mb}
+    return(results)
+
+
+def benchmark_decode(files = 8, seconds = 240, seed = 0):
+    """
+    Function compares the old MP3 ingest path (the MP3 is decoded to a WAV in WAVs/, which is read back and fingerprinted)
+    with decoding straight into memory (audio_processing.decode_audio) and fingerprinting the series, on synthetic MP3s
+    encoded with ffmpeg. The old path is timed with ffmpeg writing the WAV directly, which is cheaper than pydub (a temporary
+    file, a copy in memory, then the export), so its timings are a lower bound. The fingerprint cache is off, so both paths do all of their work.
+
+    Inputs: files (integer, MP3s), seconds (integer, length of each)
+            seed (integer)
+
+    Outputs: Dictionary of seconds per file of decoding alone and of decoding plus fingerprinting for both paths,
+             the MB written to disk per file by the old path and whether both paths gave the same content hashes
+    """
+    workdir = tempfile.TemporaryDirectory()
+    wav_dir = os.path.join(workdir.name, "WAVs")
+    os.mkdir(wav_dir)
+    mp3_paths = []
+    for path in write_synthetic_wavs(workdir.name, files, seconds = seconds, seed = seed):
+        mp3_paths.append(os.path.splitext(path)[0] + ".mp3")
+        subprocess.run([audio_processing.ffmpeg_command(), "-v", "error", "-y", "-i", path, "-ac", "2", mp3_paths[-1]], check = True)
+        os.remove(path)
+
+    def wav_round_trip(path, fingerprint):
+        wav_path = os.path.join(wav_dir, os.path.splitext(os.path.basename(path))[0] + ".wav")
+        subprocess.run([audio_processing.ffmpeg_command(), "-v", "error", "-y", "-i", path, wav_path], check = True)
+        if fingerprint:
+            return(spectral_analysis.fingerprint_file(wav_path)["content_hash"])
+        return(spectral_analysis.analyze_song(wav_path)[1])
+
+    def in_memory(path, fingerprint):
+        samplerate, series = audio_processing.decode_audio(path)
+        if fingerprint:
+            return(spectral_analysis.fingerprint_series(series, samplerate)["content_hash"])
+        return(series)
+
+    previous = fingerprint_cache.CACHE_ENABLED
+    fingerprint_cache.CACHE_ENABLED = False
+    try:
+        results = {"files": files}
+        for fingerprint in (False, True):
+            stage = "ingest" if fingerprint else "decode"
+            old_time, old_hashes = time_call(lambda: [wav_round_trip(path, fingerprint) for path in mp3_paths], 1)
+            new_time, new_hashes = time_call(lambda: [in_memory(path, fingerprint) for path in mp3_paths], 1)
+            results[stage + "_wav_round_trip_seconds_per_file"] = old_time/files
+            results[stage + "_in_memory_seconds_per_file"] = new_time/files
+            results[stage + "_speedup"] = old_time/new_time
+        results["wav_mb_written_per_file"] = sum(os.path.getsize(os.path.join(wav_dir, name)) for name in os.listdir(wav_dir))/files/2**20
+        results["same_content_hashes"] = old_hashes == new_hashes
+    finally:
+        fingerprint_cache.CACHE_ENABLED = previous
+        workdir.cleanup()
+    return(results)
+
+
+class FileServerHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for a remote file server: serves a directory over keep-alive connections with ETags, conditional requests and
+    byte ranges, waiting server.latency seconds before each reply and sending at most server.bandwidth bytes per second per connection.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+        path = os.path.join(self.server.directory, urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/"))
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            return(self.end_headers())
+        size = os.path.getsize(path)
+        etag = '"' + str(os.stat(path).st_mtime_ns) + "-" + str(size) + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            return(self.end_headers())
+        start = 0
+        requested = self.headers.get("Range", "")
+        if requested.startswith("bytes=") and self.headers.get("If-Range", etag) == etag:
+            start = min(int(requested[6:].split("-")[0]), size)
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header("Content-Range", "bytes " + str(start) + "-" + str(size - 1) + "/" + str(size))
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        chunk_size = 2**16
+        with open(path, "rb") as f:
+            f.seek(start)
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                self.wfile.write(chunk)
+                if self.server.bandwidth:
+                    time.sleep(len(chunk)/self.server.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory, latency = 0.0, bandwidth = None):
+    """
+    Function serves a directory with FileServerHandler on a free local port, in a background thread.
+
+    Inputs: directory (str)
+            latency (float, seconds before each reply)
+            bandwidth (float, bytes per second per connection, default unlimited)
+
+    Outputs: server (ThreadingHTTPServer, with counters of connections and requests), and the base URL (str)
+    """
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileServerHandler)
+    httpd.daemon_threads = True
+    httpd.directory, httpd.latency, httpd.bandwidth = directory, latency, bandwidth
+    httpd.lock, httpd.connections, httpd.requests = threading.Lock(), 0, 0
+    threading.Thread(target = httpd.serve_forever, daemon = True).start()
+    return([httpd, "http://127.0.0.1:" + str(httpd.server_address[1]) + "/"])
+
+
+def per_url_add(database_manager, url, wav_dir):
+    """Function adds a song from a URL the way add_function used to: download it to a WAV with urllib, then read it back and fingerprint it."""
+    filename = urllib.parse.unquote(os.path.basename(url))
+    title, artist, album, date = database_manager.parse_filename(filename)
+    wav_path = os.path.join(wav_dir, filename)
+    urllib.request.urlretrieve(url, wav_path)
+    song = spectral_analysis.fingerprint_file(wav_path)
+    database_manager.write_song(title, artist, album, url, date = date, source = "url", **song)
+
+
+def benchmark_fetch(files = 32, seconds = 30, latency = .1, bandwidth = 8, workers = (1, 4, 8), seed = 0):
+    """
+    Function measures URL ingestion throughput (files/min) from a local stand-in file server which adds latency and caps each
+    connection's bandwidth like a remote server. The old path downloads one URL at a time to a WAV with urllib (a new connection each),
+    then fingerprints it; add_urls is run with different numbers of threads and an empty download cache, then once more over the
+    unchanged files, which are only revalidated (304) and read from the download cache. The fingerprint cache is off, so every run
+    fingerprints every song, and each run has a fresh SQLite database.
+
+    Inputs: files (integer, WAVs served), seconds (integer, length of each)
+            latency (float, seconds before each reply)
+            bandwidth (float, MB per second per connection)
+            workers (list of integers, threads per add_urls run)
+            seed (integer)
+
+    Outputs: Dictionary of files per minute, seconds and server connections of every run
+    """
+    import database_manager
+    import url_fetcher
+    workdir = tempfile.TemporaryDirectory()
+    served = os.path.join(workdir.name, "served")
+    wav_dir = os.path.join(workdir.name, "WAVs")
+    os.mkdir(served)
+    os.mkdir(wav_dir)
+    write_synthetic_wavs(served, files, seconds = seconds, seed = seed)
+    httpd, base_url = serve_directory(served, latency = latency, bandwidth = bandwidth*2**20)
+    urls = [base_url + urllib.parse.quote(name) for name in sorted(os.listdir(served))]
+    previous = [fingerprint_cache.CACHE_ENABLED, url_fetcher.DOWNLOAD_DIR]
+    fingerprint_cache.CACHE_ENABLED = False
+    results = {"files": files, "mb_per_file": sum(os.path.getsize(os.path.join(served, name)) for name in os.listdir(served))/files/2**20}
+
+    def run(name, function):
+        database_manager.set_backend(storage_backends.get_backend("sqlite", path = os.path.join(workdir.name, name + ".db")))
+        connections = httpd.connections
+        elapsed, summary = time_call(function, 1)
+        database_manager.backend.close()
+        results[name] = {"files_per_minute": files/elapsed*60, "seconds": elapsed, "connections": httpd.connections - connections}
+        if summary is not None:
+            results[name]["failed"] = summary["failed"]
+        return(summary)
+
+    def sequential():
+        for url in urls:
+            per_url_add(database_manager, url, wav_dir)
+
+    try:
+        run("sequential_urlretrieve", sequential)
+        for count in workers:
+            url_fetcher.DOWNLOAD_DIR = os.path.join(workdir.name, "downloads" + str(count))
+            run("add_urls_" + str(count) + "_workers", lambda: database_manager.add_urls(urls, workers = count))
+        summary = run("add_urls_" + str(workers[-1]) + "_workers_download_cache", lambda: database_manager.add_urls(urls, workers = workers[-1]))
+        results["download_cache_hits"] = summary["cached"]
+    finally:
+        fingerprint_cache.CACHE_ENABLED, url_fetcher.DOWNLOAD_DIR = previous
+        httpd.shutdown()
+        httpd.server_close()
+        workdir.cleanup()
+    return(results)
+
+
+def print_results(name, results):
+    """Function prints the results of one benchmark."""
+    print(name + ":")
+    for key, value in results.items():
+        print("  " + key + ": " + str(value))
+
+
+parser = argparse.ArgumentParser(description="Benchmarks for Freezam.")
+subcommands = parser.add_subparsers(dest="command_name")
+
+parser_periodogram = subcommands.add_parser("periodogram", help = "Per-window periodogram loop vs the batched FFT engine")
+parser_periodogram.add_argument("--path", type=str, help = "WAV to benchmark (default: synthetic 4-minute track)")
+parser_periodogram.add_argument("--seconds", type=int, default=240, help = "Length of the synthetic track")
+parser_periodogram.add_argument("--repeats", type=int, default=3, help = "Timed runs per variant")
+
+parser_windowing = subcommands.add_parser("windowing", help = "Peak memory of materialized windows vs block-at-a-time fingerprinting")
+parser_windowing.add_argument("--path", type=str, help = "WAV to benchmark (default: synthetic track)")
+parser_windowing.add_argument("--seconds", type=int, default=240, help = "Length of the synthetic track")
+parser_windowing.add_argument("--block_size", type=int, default=16, help = "Windows per block")
+parser_windowing.add_argument("--skip_full", action="store_true", help = "Only run the streaming pipeline (for hour-long tracks)")
+
+parser_distances = subcommands.add_parser("distances", help = "Pandas double loop vs the vectorized distance kernel in match_fingerprints")
+parser_distances.add_argument("--path", type=str, help = "WAV to benchmark (default: synthetic track)")
+parser_distances.add_argument("--seconds", type=int, default=240, help = "Length of the synthetic track")
+parser_distances.add_argument("--method", type=str, default="five", help = "Fingerprint method: one, two or five")
+parser_distances.add_argument("--repeats", type=int, default=3, help = "Timed runs per variant")
+
+parser_knn = subcommands.add_parser("knn", help = "Per-window kNN queries vs one batched query, against a local Postgres")
+parser_knn.add_argument("--dsn", type=str, default="dbname=freezam_bench", help = "Connection string of a throwaway Postgres database (needs the cube extension)")
+parser_knn.add_argument("--songs", type=int, default=500, help = "Synthetic songs in the catalog")
+parser_knn.add_argument("--queries", type=int, default=20, help = "Snippets to time")
+parser_knn.add_argument("--method", type=str, default="five", help = "Fingerprint method: one or five")
+
+parser_ingest = subcommands.add_parser("ingest", help = "Per-row INSERT + commit vs one COPY per song, against a local Postgres")
+parser_ingest.add_argument("--dsn", type=str, default="dbname=freezam_bench", help = "Connection string of a throwaway Postgres database (needs the cube extension)")
+parser_ingest.add_argument("--songs", type=int, default=20, help = "Synthetic songs written with each path")
+
+parser_catalog_scan = subcommands.add_parser("catalog_scan", help = "Per-song slow_search loop vs one pass of score_catalog over an in-memory catalog")
+parser_catalog_scan.add_argument("--songs", type=int, default=2000, help = "Synthetic songs in the catalog")
+parser_catalog_scan.add_argument("--method", type=str, default="five", help = "Fingerprint method: one or five")
+parser_catalog_scan.add_argument("--repeats", type=int, default=3, help = "Timed runs per variant")
+
+parser_index = subcommands.add_parser("index", help = "k-NN latency against catalog size: in-process KD-tree vs brute force (vs SQL with --dsn)")
+parser_index.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help = "Catalog sizes in songs")
+parser_index.add_argument("--method", type=str, default="five", help = "Fingerprint method: one or five")
+parser_index.add_argument("--dsn", type=str, help = "Connection string of a throwaway Postgres database, to include the SQL path")
+
+parser_backends = subcommands.add_parser("backends", help = "Same write/load/search workload on the embedded SQLite backend (and Postgres with --dsn)")
+parser_backends.add_argument("--songs", type=int, default=200, help = "Synthetic songs written to each backend")
+parser_backends.add_argument("--method", type=str, default="five", help = "Fingerprint method: one or five")
+parser_backends.add_argument("--dsn", type=str, help = "Connection string of a throwaway Postgres database, to include the Postgres backend")
+
+parser_constellation = subcommands.add_parser("constellation", help = "Constellation hash lookup latency against catalog size")
+parser_constellation.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help = "Catalog sizes in songs")
+parser_constellation.add_argument("--dsn", type=str, help = "Connection string of a throwaway Postgres database, to include the Postgres backend")
+
+parser_add_dir = subcommands.add_parser("add_dir", help = "Directory ingestion throughput (files/min) against the number of worker processes, on SQLite")
+parser_add_dir.add_argument("--files", type=int, default=32, help = "Synthetic WAVs in the directory")
+parser_add_dir.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()], help = "Worker processes of each run")
+
+parser_recommend = subcommands.add_parser("recommend", help = "Old per-window recommend loop vs the parallel, batched recommend, on SQLite (or Postgres with --dsn)")
+parser_recommend.add_argument("--files", type=int, default=40, help = "Synthetic WAVs in the library")
+parser_recommend.add_argument("--catalog_songs", type=int, default=50, help = "Synthetic songs in the catalog")
+parser_recommend.add_argument("--workers", type=int, help = "Worker processes of the batched recommend (default: every core)")
+parser_recommend.add_argument("--dsn", type=str, help = "Connection string of a throwaway Postgres database, to run against Postgres instead")
+
+parser_cache = subcommands.add_parser("cache", help = "Fingerprinting a corpus with an empty fingerprint cache vs re-running over the unchanged corpus")
+parser_cache.add_argument("--files", type=int, default=32, help = "Synthetic WAVs in the corpus")
+parser_cache.add_argument("--seconds", type=int, default=60, help = "Length of each WAV")
+
+parser_profiling = subcommands.add_parser("profiling", help = "Cost of the profiling instrumentation when it is off, on, and on with memory tracking")
+parser_profiling.add_argument("--path", type=str, help = "WAV to fingerprint (default: synthetic track)")
+parser_profiling.add_argument("--seconds", type=int, default=240, help = "Length of the synthetic track")
+
+parser_serve = subcommands.add_parser("serve", help = "Requests per second and tail latency of the warm search server, vs one freezam.py process per query")
+parser_serve.add_argument("--songs", type=int, default=50, help = "Synthetic songs in the catalog")
+parser_serve.add_argument("--clients", type=int, nargs="+", default=[1, 4], help = "Concurrent clients of each run")
+parser_serve.add_argument("--requests", type=int, default=200, help = "Requests per run")
+parser_serve.add_argument("--method", type=str, default="five", help = "Fingerprint method: one, five or constellation")
+
+parser_startup = subcommands.add_parser("startup", help = "Launch-to-exit time of freezam.py for each kind of subcommand")
+parser_startup.add_argument("--repeats", type=int, default=5, help = "Runs of each command (the median is reported)")
+
+parser_progressive = subcommands.add_parser("progressive", help = "Full vs progressive (early-terminating) fast_search on clean, noisy and not-in-catalog excerpts")
+parser_progressive.add_argument("--songs", type=int, default=20, help = "Synthetic songs in the catalog")
+parser_progressive.add_argument("--snippet_seconds", type=int, default=30, help = "Length of each excerpt")
+parser_progressive.add_argument("--queries", type=int, default=10, help = "Excerpts of each kind")
+parser_progressive.add_argument("--epsilon", type=float, default=10000, help = "Epsilon of method five")
+
+parser_streaming = subcommands.add_parser("streaming", help = "How soon the streaming recognizer answers, vs recording a 15-second snippet then searching it")
+parser_streaming.add_argument("--songs", type=int, default=20, help = "Synthetic songs in the catalog")
+parser_streaming.add_argument("--queries", type=int, default=10, help = "Excerpts streamed")
+parser_streaming.add_argument("--block_seconds", type=float, default=.25, help = "Length of each streamed block")
+
+parser_decimation = subcommands.add_parser("decimation", help = "Fingerprinting at the full sample rate vs from audio decimated to each method's band, for ingest and search")
+parser_decimation.add_argument("--path", type=str, help = "WAV to fingerprint (default: synthetic track)")
+parser_decimation.add_argument("--seconds", type=int, default=240, help = "Length of the synthetic track")
+parser_decimation.add_argument("--repeats", type=int, default=3, help = "Timed runs (best is reported)")
+
+parser_decode = subcommands.add_parser("decode", help = "MP3 ingest through a WAV on disk vs decoding straight into memory (needs ffmpeg)")
+parser_decode.add_argument("--files", type=int, default=8, help = "Synthetic MP3s")
+parser_decode.add_argument("--seconds", type=int, default=240, help = "Length of each MP3")
+
+parser_fetch = subcommands.add_parser("fetch", help = "URL ingestion throughput (files/min): one urllib download at a time vs add_urls' concurrent, cached downloads")
+parser_fetch.add_argument("--files", type=int, default=32, help = "Synthetic WAVs served")
+parser_fetch.add_argument("--seconds", type=int, default=30, help = "Length of each WAV")
+parser_fetch.add_argument("--latency", type=float, default=.1, help = "Seconds the stand-in server waits before each reply")
+parser_fetch.add_argument("--bandwidth", type=float, default=8, help = "MB per second per connection")
+parser_fetch.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help = "Threads per add_urls run")
+
+
+def main():
+    """Function runs the requested benchmark from the command line."""
+    results = parser.parse_args()
+    if results.command_name == "periodogram":
+        print_results("periodogram", benchmark_periodogram(path = results.path, seconds = results.seconds, repeats = results.repeats))
+    if results.command_name == "windowing":
+        print_results("windowing", benchmark_windowing(path = results.path, seconds = results.seconds, block_size = results.block_size, full = not results.skip_full))
+    if results.command_name == "distances":
+        print_results("distances", benchmark_distances(path = results.path, seconds = results.seconds, method = results.method, repeats = results.repeats))
+    if results.command_name == "knn":
+        print_results("knn", benchmark_knn(dsn = results.dsn, songs = results.songs, queries = results.queries, method = results.method))
+    if results.command_name == "ingest":
+        print_results("ingest", benchmark_ingest(dsn = results.dsn, songs = results.songs))
+    if results.command_name == "catalog_scan":
+        print_results("catalog_scan", benchmark_catalog_scan(songs = results.songs, method = results.method, repeats = results.repeats))
+    if results.command_name == "index":
+        print_results("index", benchmark_index(sizes = results.sizes, method = results.method, dsn = results.dsn))
+    if results.command_name == "backends":
+        print_results("backends", benchmark_backends(songs = results.songs, method = results.method, dsn = results.dsn))
+    if results.command_name == "constellation":
+        print_results("constellation", benchmark_constellation(sizes = results.sizes, dsn = results.dsn))
+    if results.command_name == "add_dir":
+        print_results("add_dir", benchmark_add_dir(files = results.files, workers = results.workers))
+    if results.command_name == "recommend":
+        print_results("recommend", benchmark_recommend(catalog_songs = results.catalog_songs, files = results.files, workers = results.workers, dsn = results.dsn))
+    if results.command_name == "cache":
+        print_results("cache", benchmark_cache(files = results.files, seconds = results.seconds))
+    if results.command_name == "profiling":
+        print_results("profiling", benchmark_profiling(path = results.path, seconds = results.seconds))
+    if results.command_name == "serve":
+        print_results("serve", benchmark_serve(songs = results.songs, clients = results.clients, requests = results.requests, method = results.method))
+    if results.command_name == "startup":
+        print_results("startup", benchmark_startup(repeats = results.repeats))
+    if results.command_name == "progressive":
+        print_results("progressive", benchmark_progressive(songs = results.songs, snippet_seconds = results.snippet_seconds, queries = results.queries, epsilon = results.epsilon))
+    if results.command_name == "streaming":
+        print_results("streaming", benchmark_streaming(songs = results.songs, queries = results.queries, block_seconds = results.block_seconds))
+    if results.command_name == "decimation":
+        print_results("decimation", benchmark_decimation(path = results.path, seconds = results.seconds, repeats = results.repeats))
+    if results.command_name == "decode":
+        print_results("decode", benchmark_decode(files = results.files, seconds = results.seconds))
+    if results.command_name == "fetch":
+        print_results("fetch", benchmark_fetch(files = results.files, seconds = results.seconds, latency = results.latency,
+                                               bandwidth = results.bandwidth, workers = results.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,73 +5,84 @@
 #########################################
 
 import os
+import math
+import urllib.parse
+import time
+import queue
+import threading
+import itertools
+import concurrent.futures
 import numpy as np
 import sys
-from audio_processing import convert_to_local_wav
-import pandas
-import spectral_analysis
-import psycopg2
-import credentials
-import random
-import ast
-import matplotlib.pyplot as plt
-
-
-#Connecting to database
-conn = psycopg2.connect(
-    host="sculptor.stat.cmu.edu",
-    database=credentials.DB_USER,
-    user=credentials.DB_USER,
-    password=credentials.DB_PASSWORD
-)
-cur = conn.cursor()
+import logging
+import audio_processing
+import storage_backends
+import profiling
+from storage_backends import FINGERPRINT_COLUMNS, FINGERPRINT_DIMENSIONS
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Songs and fingerprints live in a storage backend: the Postgres server by default, or an embedded SQLite file
+# (set FREEZAM_BACKEND=sqlite, see storage_backends.get_backend). Every function below goes through it.
+# It is only opened when first used, and its tables are created by create_tables (python freezam.py init).
+backend = storage_backends.LazyBackend()
+
+# Method name of the constellation (peak-pair hash) fingerprint, searched through the inverted index instead of by nearest neighbors
+CONSTELLATION_METHOD = "constellation"
+
+# Methods a snippet can be searched with: the fingerprints stored for every song, and the constellation hashes
+SEARCH_METHODS = list(FINGERPRINT_COLUMNS) + [CONSTELLATION_METHOD]
+
+def set_backend(new_backend):
+    """
+    Function swaps the storage backend used by every function in this module, e.g. to search a SQLite file instead of Postgres,
+    and creates its tables if they don't exist.
+    
+    Inputs: new_backend (storage_backends.StorageBackend, or the name of one: postgres or sqlite)
+
+    Outputs: the backend now in use
+    """
+    global backend
+    if isinstance(new_backend, str):
+        new_backend = storage_backends.get_backend(new_backend)
+    backend = new_backend
+    backend.create_tables()
+    return(backend)
 
 # Creating our main tables
 
 def create_tables():
-     """
-    Function takes no arguments but.
+    """
+    Function takes no arguments but creates our tables and their indexes in the current backend.
     
     Inputs: None
 
-    Outputs: Creates two tables in Postgres database
-    """
-cur.execute("""
-CREATE TABLE IF NOT EXISTS songs (
-    song_id SERIAL PRIMARY KEY,
-    title text NOT NULL CHECK (char_length(title) > 0),
-    artist text NOT NULL CHECK (char_length(artist) > 0),
-    album text NOT NULL CHECK (char_length(album) > 0),
-    path text NOT NULL CHECK (char_length(path) > 0),
-    sample_rate numeric NOT NULL CHECK (sample_rate > 0),
-    date text NOT NULL CHECK (char_length(date) > 0),
-    source text NOT NULL CHECK (char_length(source) > 0)
-);
-CREATE TABLE IF NOT EXISTS fingerprints_slow_search (
-    song_id integer NOT NULL CHECK (song_id > 0),
-    fingerprint_id SERIAL NOT NULL,
-    num_fingerprints numeric NOT NULL CHECK (num_fingerprints > 0),
-    fingerprint1 NUMERIC ARRAY NOT NULL,
-    fingerprint5 NUMERIC ARRAY NOT NULL,
-    PRIMARY KEY (song_id, fingerprint_id),
-    FOREIGN KEY (song_id) REFERENCES songs (song_id) MATCH FULL ON DELETE CASCADE
-);
-CREATE TABLE IF NOT EXISTS fingerprints (
-    song_id integer NOT NULL CHECK (song_id > 0),
-    fingerprint_id SERIAL NOT NULL,
-    num_fingerprints numeric NOT NULL CHECK (num_fingerprints > 0),
-    fingerprint1 cube NOT NULL,
-    fingerprint5 cube NOT NULL,
-    PRIMARY KEY (song_id, fingerprint_id),
-    FOREIGN KEY (song_id) REFERENCES songs (song_id) MATCH FULL ON DELETE CASCADE
-);
-    """)
-conn.commit()
-
-
-def add_function(path, title, artist, album, date, source):
+    Outputs: Creates the songs and fingerprints tables (plus their search indexes). Does nothing if these already exist.
+    """
+    backend.create_tables()
+
+
+def maintain_indexes(reindex = False):
+    """
+    Function refreshes the planner statistics for the fingerprints table (and optionally rebuilds its indexes),
+    so the kNN queries keep using the GiST indexes after large loads (in SQLite, the in-process index is rebuilt on the next search).
+    
+    Inputs: reindex (boolean, also rebuild the indexes, e.g. after bulk deletes)
+
+    Outputs: Nothing
+    """
+    backend.maintain_indexes(reindex = reindex)
+
+
+
+@profiling.timed()
+def add_function(path, title, artist, album, date, source, keep_wav = False):
     """
     Function takes one filepath to audio file and adds it to our database.
+    An MP3 (local, or downloaded from a URL) or a WAV from a URL is decoded straight into memory and fingerprinted from there;
+    it is only also written to WAVs/ if keep_wav is set. Downloads are cached and resumed, see url_fetcher.fetch_audio.
     
     Inputs: path (str, path to mp3 or wav file)
             title (str)
@@ -79,57 +90,253 @@ def add_function(path, title, artist, album, date, source):
             album (str)
             date (str)
             source (str, either local or url)
+            keep_wav (boolean, also write the decoded WAV to WAVs/, as earlier versions did)
 
     Outputs: Nothing
     """
-    # First, convert to local wav and get fingerprints
-    convert_to_local_wav(path, source)
+    import spectral_analysis
     filename = os.path.basename(path)
     name,ext = os.path.splitext(filename)
     wav_name = name + ".wav"
     wav_path = os.path.join("WAVs", wav_name)
-    samplerate,series_results = spectral_analysis.analyze_song(wav_path)
-    windows = spectral_analysis.get_window(series = series_results, sample_rate = samplerate, h=5,delta=1)
-    freq,pd = spectral_analysis.get_periodogram(series_results,windows,samplerate,h=5,delta=1)
-    fingerprints1 = spectral_analysis.fingerprint_one(pd,freq)
-    len_fingerprints = int(len(fingerprints1))
-    fingerprints5 = spectral_analysis.fingerprint_five(pd,freq)
+    if source == "url" or ext == ".mp3":
+        if source == "url":
+            import url_fetcher
+            samplerate, series_results, _ = url_fetcher.fetch_audio(path, wav_path = wav_path if keep_wav else None)
+        else:
+            samplerate, series_results = audio_processing.decode_audio(path, wav_path = wav_path if keep_wav else None)
+        song = spectral_analysis.fingerprint_series(series_results, samplerate)
+        del series_results
+    else:
+        # local WAVs are memory-mapped where they are
+        song = spectral_analysis.fingerprint_file(path)
+    len_fingerprints = int(len(song["fingerprints1"]))
 
     # add it to our database
-    cur.execute("INSERT INTO songs (title, artist, album, path, sample_rate, date, source) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s)", (title, artist, album, path, samplerate, date, source))
+    song_id, inserted, rows_per_second = write_song(title, artist, album, path, date = date, source = source, **song)
+    if not inserted:
+        return(print(title + " by " + artist + " was already in the database, its details have been updated."))
+    return(print(title + " by " + artist + " added (" + str(len_fingerprints) + " fingerprints at " + str(round(rows_per_second)) + " rows/s)."))
 
-    cur.execute("DELETE FROM songs a USING songs b WHERE a.song_id > b.song_id AND a.title = b.title AND a.artist = b.artist AND a.album = b.album and a.path = b.path and a.sample_rate = b.sample_rate;")            
-    conn.commit()
 
-    cur.execute("SELECT song_id from songs where title = %s and artist = %s and album = %s", (title,artist,album))
-    song_id = cur.fetchall() 
+@profiling.timed()
+def write_song(title, artist, album, path, samplerate, date, source, fingerprints1, fingerprints5, content_hash, hashes = None, decimated = False):
+    """
+    Function writes a song and all of its fingerprints (and constellation hashes) to our database in a single transaction.
+    Songs are identified by the hash of their decoded audio, so adding the same audio again only updates its details.
+    
+    Inputs: title, artist, album, path, date, source (str, see add_function)
+            samplerate (integer)
+            fingerprints1 (numpy.ndarray, fingerprint one for each window)
+            fingerprints5 (numpy.ndarray, fingerprint five for each window)
+            content_hash (str, from spectral_analysis.content_hash)
+            hashes (hashes, anchor_times from spectral_analysis.constellation_hashes, optional)
+            decimated (boolean, whether fingerprints5 was computed from decimated audio, see check_decimation)
+
+    Outputs: song_id (integer), whether the song is new (boolean) and the write throughput (fingerprint rows per second)
+    """
+    return(backend.write_song(title, artist, album, path, samplerate, date, source, fingerprints1, fingerprints5, content_hash, hashes = hashes,
+                              decimated = decimated))
 
-    for i in range(len(fingerprints1)):
-        cur.execute("INSERT INTO fingerprints (song_id, num_fingerprints, fingerprint1, fingerprint5) "
-                "VALUES (%s, %s, cube(%s), cube(%s))", (song_id[0][0], len_fingerprints, list(fingerprints1[i]), list(fingerprints5[i])))
-        conn.commit()  
+@profiling.timed()
+def write_songs(songs):
+    """
+    Function writes a batch of songs to our database in a single transaction (see write_song).
+    
+    Inputs: songs (list of dictionaries of write_song arguments)
+
+    Outputs: List of [song_id, whether the song is new, write throughput (fingerprint rows per second)], one per song
+    """
+    return(backend.write_songs(songs))
 
-    cur.execute("DELETE FROM fingerprints a USING fingerprints b WHERE a.fingerprint_id > b.fingerprint_id AND a.num_fingerprints = b.num_fingerprints AND a.fingerprint1 = b.fingerprint1 AND a.fingerprint5 = b.fingerprint5;")            
-    conn.commit()
 
-    return(print(title + " by " + artist + " added."))
+def parse_filename(path):
+    """
+    Function reads the details of a song from its filename, which follows the convention title_artist_album_date.wav
+    (e.g. "betty_Taylor Swift_folklore_2020.wav").
+    
+    Inputs: path (str, path to the file)
 
-# wav_files = os.listdir("C:/Users/vinay/Documents/s750/assignments-vbhatia7/shazam/WAVs")
-# for filename in wav_files:
-#     #os.chdir("C:/Users/vinay/Documents/s750/assignments-vbhatia7/shazam/WAVs")
-#     name, ext = os.path.splitext(filename)
-#     path = "WAVs/" + filename
-#     positions = name.split('_')
-#     print(positions)
-#     add_function(path = "WAVs/" + filename,
-#                                   title = positions[0],
-#                                   artist = positions[1],
-#                                   album = positions[2],
-#                                   date = positions[3],
-#                                   source = "local")
+    Outputs: title, artist, album, date (str)
+    """
+    name, ext = os.path.splitext(os.path.basename(path))
+    positions = name.split('_')
+    if len(positions) < 4:
+        raise ValueError(os.path.basename(path) + " does not follow the title_artist_album_date naming convention")
+    return(positions[:4])
 
 
+def write_batches(results_queue, batch_size, summary, flush_seconds = 1):
+    """
+    Function is the single database writer of add_dir: it takes fingerprinted songs off the queue and writes them batch_size
+    songs per transaction until it gets None. A batch which fails is retried one song at a time so one bad song only loses itself.
+    
+    Inputs: results_queue (queue.Queue of write_song argument dictionaries, then None)
+            batch_size (integer, songs per transaction)
+            summary (dictionary of counters, updated in place)
+            flush_seconds (float, how long a partial batch waits for more songs)
+
+    Outputs: Nothing
+    """
+    batch = []
+    done = False
+    while not done:
+        idle = False
+        try:
+            song = results_queue.get(timeout = flush_seconds)
+            if song is None:
+                done = True
+            else:
+                batch.append(song)
+        except queue.Empty:
+            idle = True
+        # write when the batch is full, when no song has come for flush_seconds, or at the end
+        if batch and (done or idle or len(batch) >= batch_size):
+            try:
+                written = write_songs(batch)
+                stored = batch
+            except Exception:
+                logger.exception('Batch of ' + str(len(batch)) + ' songs failed, writing them one at a time')
+                written, stored = [], []
+                for single in batch:
+                    try:
+                        written += write_songs([single])
+                        stored.append(single)
+                    except Exception:
+                        logger.exception('Could not write ' + single["path"])
+                        summary["failed"] += 1
+            summary["added"] += sum([int(inserted) for _, inserted, _ in written])
+            summary["updated"] += sum([int(not inserted) for _, inserted, _ in written])
+            # only songs which were written count towards the fingerprints (and the fingerprints/s of add_dir)
+            summary["fingerprints"] += sum([len(song["fingerprints1"]) for song in stored])
+            batch = []
+
+
+@profiling.timed()
+def add_dir(path_to_data, workers = None, batch_size = 32, queue_size = 64, source = "local"):
+    """
+    Function adds every WAV in a directory to our database. Files are read and fingerprinted by a pool of worker processes
+    and a single writer thread stores them in batches, fed through a bounded queue (so fingerprints never pile up in memory
+    faster than the database takes them). Song details come from the filenames, see parse_filename.
+    
+    Inputs: path_to_data (str, directory of WAVs named title_artist_album_date.wav)
+            workers (integer, number of worker processes, default is every core)
+            batch_size (integer, songs written per transaction)
+            queue_size (integer, most fingerprinted songs waiting for the writer)
+            source (str, source recorded for every song)
+
+    Outputs: Dictionary with the number of files added, updated and failed, the time taken and the throughput
+    """
+    import spectral_analysis
+    paths = []
+    for filename in sorted(os.listdir(path_to_data)):
+        if os.path.splitext(filename)[1].lower() != ".wav":
+            continue
+        try:
+            parse_filename(filename)
+            paths.append(os.path.join(path_to_data, filename))
+        except ValueError as error:
+            logger.warning(str(error) + ', skipping it')
+    summary = {"files": len(paths), "added": 0, "updated": 0, "failed": 0, "fingerprints": 0}
+    results_queue = queue.Queue(maxsize = queue_size)
+    writer = threading.Thread(target = write_batches, args = (results_queue, batch_size, summary))
+    writer.start()
+    start = time.perf_counter()
+    processed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        remaining = iter(paths)
+        pending = {}
+        # keep at most queue_size files in flight, so the pool also waits when the writer falls behind
+        for path in itertools.islice(remaining, queue_size):
+            pending[pool.submit(spectral_analysis.fingerprint_file, path)] = path
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                path = pending.pop(future)
+                processed += 1
+                try:
+                    song = future.result()
+                    title, artist, album, date = parse_filename(path)
+                    song.update({"title": title, "artist": artist, "album": album, "path": path, "date": date, "source": source})
+                    results_queue.put(song)
+                except Exception as error:
+                    logger.warning('Could not fingerprint ' + path + ': ' + repr(error))
+                    summary["failed"] += 1
+                for next_path in itertools.islice(remaining, 1):
+                    pending[pool.submit(spectral_analysis.fingerprint_file, next_path)] = next_path
+                if processed % 10 == 0 or processed == len(paths):
+                    elapsed = time.perf_counter() - start
+                    print("[" + str(processed) + "/" + str(len(paths)) + "] " + str(round(processed/elapsed*60, 1)) + " files/min, "
+                          + str(round(summary["fingerprints"]/elapsed)) + " fingerprints/s written")
+    results_queue.put(None)
+    writer.join()
+    maintain_indexes()
+    summary["seconds"] = time.perf_counter() - start
+    summary["files_per_minute"] = len(paths)/summary["seconds"]*60 if paths else 0.0
+    logger.info('Added directory ' + path_to_data + ': ' + str(summary))
+    return(summary)
+
+
+def add_urls(urls, workers = 8, batch_size = 32, keep_wav = False):
+    """
+    Function adds songs from many URLs to our database. A bounded pool of threads downloads them over keep-alive connections,
+    decoding and fingerprinting each song as it arrives (see url_fetcher), and the single writer of add_dir stores them in batches.
+    Song details come from the filename at the end of each URL, see parse_filename.
+    
+    Inputs: urls (list of str, http or https URLs of MP3s or WAVs named title_artist_album_date)
+            workers (integer, most downloads at once)
+            batch_size (integer, songs written per transaction)
+            keep_wav (boolean, also write each decoded song to WAVs/)
+
+    Outputs: Dictionary with the number of files added, updated and failed, how they were fetched, the time taken and the throughput
+    """
+    import spectral_analysis
+    import url_fetcher
+    named = []
+    for url in urls:
+        filename = urllib.parse.unquote(os.path.basename(urllib.parse.urlsplit(url).path))
+        try:
+            named.append([url, filename] + list(parse_filename(filename)))
+        except ValueError as error:
+            logger.warning(str(error) + ', skipping it')
+    details = {url: [filename, title, artist, album, date] for url, filename, title, artist, album, date in named}
+    summary = {"files": len(details), "added": 0, "updated": 0, "failed": 0, "fingerprints": 0,
+               "downloaded": 0, "resumed": 0, "cached": 0, "bytes": 0}
+    results_queue = queue.Queue(maxsize = 2*workers)
+    writer = threading.Thread(target = write_batches, args = (results_queue, batch_size, summary))
+    writer.start()
+
+    def work(url, pool):
+        wav_path = os.path.join("WAVs", os.path.splitext(details[url][0])[0] + ".wav") if keep_wav else None
+        samplerate, series, fetched = url_fetcher.fetch_audio(url, pool = pool, wav_path = wav_path)
+        return([spectral_analysis.fingerprint_series(series, samplerate), fetched])
+
+    start = time.perf_counter()
+    processed = 0
+    for url, result, error in url_fetcher.fetch_many(details, work, workers = workers):
+        processed += 1
+        if error is not None:
+            logger.warning('Could not add ' + url + ': ' + repr(error))
+            summary["failed"] += 1
+        else:
+            song, fetched = result
+            summary[fetched["status"]] += 1
+            summary["bytes"] += fetched["bytes"]
+            _, title, artist, album, date = details[url]
+            song.update({"title": title, "artist": artist, "album": album, "path": url, "date": date, "source": "url"})
+            results_queue.put(song)
+        if processed % 10 == 0 or processed == len(details):
+            elapsed = time.perf_counter() - start
+            print("[" + str(processed) + "/" + str(len(details)) + "] " + str(round(processed/elapsed*60, 1)) + " files/min, "
+                  + str(round(summary["bytes"]/elapsed/2**20, 1)) + " MB/s downloaded")
+    results_queue.put(None)
+    writer.join()
+    maintain_indexes()
+    summary["seconds"] = time.perf_counter() - start
+    summary["files_per_minute"] = len(details)/summary["seconds"]*60 if details else 0.0
+    logger.info('Added ' + str(len(details)) + ' URLs: ' + str(summary))
+    return(summary)
+
 
 def remove_function(title, artist, album):
     """
@@ -142,8 +349,7 @@ def remove_function(title, artist, album):
     Outputs: Nothing
     """
 
-    cur.execute("DELETE FROM songs where title = %s and artist = %s and album = %s", (title,artist,album))       
-    conn.commit()
+    backend.remove_song(title, artist, album)
     return(print(title + " by " + artist + " removed, if it exists."))
 
 
@@ -162,8 +368,7 @@ def update_album_function(title, artist, new_album):
 
     Outputs: Nothing
     """
-    cur.execute("UPDATE songs set album = %s where title = %s and artist = %s", (new_album, title, artist))
-    conn.commit()
+    backend.update_album(title, artist, new_album)
     return(print(title + " by " + artist + " has been updated with a new album: " + new_album))
 
 
@@ -182,8 +387,7 @@ def update_artist_function(title, new_artist, album):
 
     Outputs: Nothing
     """
-    cur.execute("UPDATE songs set artist = %s where title = %s and album = %s",(new_artist, title, album))
-    conn.commit()
+    backend.update_artist(title, new_artist, album)
     return(print(title + " by " + new_artist + " has been updated to reflect the correct artist."))
 
 
@@ -199,17 +403,57 @@ def list_function():
 
     Outputs: Nothing
     """
-    cur.execute("SELECT * from songs;")
-    df_to_print = cur.fetchall()
+    import pandas
+    df_to_print = backend.list_songs()
     df_to_print = pandas.DataFrame(df_to_print, columns=['song_id','title','artist', "album", "path", "sample_rate", "year", "source"])
     return(print(df_to_print))    
 
 # list_function()
 
+@profiling.timed(rows = lambda catalog: len(catalog[0]))
+def load_catalog(method):
+    """
+    Function loads every fingerprint of one method into one contiguous matrix (a binary COPY in Postgres,
+    one blob per song in SQLite), with rows grouped by song and in window order.
+    
+    Inputs: method (str, one or five)
+
+    Outputs: song_ids (numpy.ndarray, song of each row)
+             fingerprint_ids (numpy.ndarray, fingerprint_id of each row)
+             fingerprints (2-D numpy.ndarray, one fingerprint per row)
+    """
+    return(backend.load_catalog(method))
+
+
+def check_decimation(method, settings = None):
+    """
+    Function refuses to search a method whose fingerprints were stored with a different decimation setting than the snippet's
+    (spectral_analysis.DECIMATE), since decimated and full-rate fingerprints don't match each other. Method one is never decimated.
+
+    Inputs: method (str, one or five)
+            settings (set of booleans, the settings the catalog was fingerprinted with, default from the database)
+
+    Outputs: None, raises a ValueError if no stored song matches the setting (and warns if only some do)
+    """
+    import spectral_analysis
+    if spectral_analysis.method_band(method) is None:
+        return
+    if settings is None:
+        settings = backend.catalog_decimation()
+    if settings and spectral_analysis.DECIMATE not in settings:
+        stored = "with" if True in settings else "without"
+        raise ValueError("The catalog was fingerprinted " + stored + " decimation, search it " + stored + " --decimate (FREEZAM_DECIMATE)")
+    if len(settings) > 1:
+        logger.warning("The catalog mixes decimated and full-rate songs, only the " + ("decimated" if spectral_analysis.DECIMATE else "full-rate")
+                       + " ones can match method " + method)
+
+
 ## this is my slowSearch function
+@profiling.timed()
 def slow_search(path, source, epsilon, method):
     """
-    Function implements a slow search over our database
+    Function implements a slow (exhaustive) search over our database: the whole catalog is loaded into memory and
+    every song is scored against the snippet in one pass.
     
     Inputs: path (string, path to snippet)
             source (string, local, recording, or url)
@@ -218,113 +462,387 @@ def slow_search(path, source, epsilon, method):
 
     Outputs: Either match found and the match or no match found.
     """
-    samplerate,series_results = spectral_analysis.analyze_song(path)
-    windows = spectral_analysis.get_window(series = series_results, sample_rate = samplerate, h=5,delta=1)
-    freq,pd = spectral_analysis.get_periodogram(series_results,windows,samplerate,h=5,delta=1)
-    if method == "one":
-        fingerprints = spectral_analysis.fingerprint_one(pd,freq)
-    if method == "five":
-        fingerprints = spectral_analysis.fingerprint_five(pd,freq)
-    cur.execute("SELECT songs.title,songs.artist,fingerprints.* from songs, fingerprints where fingerprints.song_id = songs.song_id;")
-    finger_df = cur.fetchall()
-    finger_df = pandas.DataFrame(finger_df, columns=['title', 'artist', 'song_id', 'finger_id','num_fingerprints','finger1', 'finger5']) 
-    for index_row in finger_df.song_id.unique():
-        if method == "one":
-            finger_song_mat = finger_df[finger_df['song_id']==index_row] 
-            finger_mat=list()
-            for i in range(len(finger_song_mat.finger1)):
-                finger_mat.append(list(ast.literal_eval(finger_song_mat.finger1.iloc[i])))
-            df_dist = spectral_analysis.match_fingerprints(snip_fingerprint = fingerprints,
-                                    song_fingerprint = np.array(finger_mat))                                  
-            if spectral_analysis.return_match(df_dist,epsilon) == "Match!":
-                return("Match Found!: " + str(finger_song_mat['title'].iloc[0]) + " by " + str(finger_song_mat['artist'].iloc[0])  + ".") 
-            else:
-                next
-        if method == "five":
-            finger_song_mat = finger_df[finger_df['song_id']==index_row] 
-            finger_mat=list()
-            for i in range(len(finger_song_mat.finger5)):
-                finger_mat.append(list(ast.literal_eval(finger_song_mat.finger5.iloc[i])))
-            df_dist = spectral_analysis.match_fingerprints(snip_fingerprint = fingerprints,
-                                    song_fingerprint = np.array(finger_mat))  
-            if spectral_analysis.return_match(df_dist,epsilon) == "Match!":
-                return("Match Found!: " + str(finger_song_mat['title'].iloc[0]) + " by " + str(finger_song_mat['artist'].iloc[0])  + ".") 
-            else:
-                next
+    import spectral_analysis
+    if method == CONSTELLATION_METHOD:
+        return(constellation_search(source, path = path))
+    check_decimation(method)
+    fingerprints = spectral_analysis.fingerprint_wav(path, methods = (method,))[method]
+    song_ids, _, catalog = load_catalog(method)
+    songs, song_starts = np.unique(song_ids, return_index = True)
+    best_offset, score, hit_ratio = spectral_analysis.score_catalog(fingerprints, catalog, song_starts, epsilon)
+    # rank every song that passes the 5% threshold instead of stopping at the first one
+    passing = hit_ratio >= .05
+    if passing.any():
+        best_song = int(songs[np.argmax(np.where(passing, hit_ratio, -1))])
+        title, artist = backend.song_details()[best_song]
+        return("Match Found!: " + str(title) + " by " + str(artist)  + ".") 
     #If no songs are returned            
     return("Freezam could not find accurate match.")  
 
 
-def fast_search(source, epsilon, method, path = ""):
+@profiling.timed()
+def build_index(method):
+    """
+    Function builds an in-process nearest-neighbor index (KD-tree) over every fingerprint of one method in our database.
+    Build it once and pass it to fast_search to skip the database on every search.
+    
+    Inputs: method (str, one or five)
+
+    Outputs: index (dictionary, see fingerprint_index.build_index, plus the decimation settings of the catalog)
+    """
+    import fingerprint_index
+    song_ids, fingerprint_ids, fingerprints = load_catalog(method)
+    index = fingerprint_index.build_index(song_ids, fingerprint_ids, fingerprints, backend.song_details())
+    index["decimated"] = backend.catalog_decimation()
+    return(index)
+
+
+@profiling.timed(rows = len)
+def nearest_fingerprints(fingerprints, method, index = None):
+    """
+    Function finds the closest fingerprint in our database for every snippet window, in a single round trip
+    (one LATERAL kNN lookup per window in Postgres, a KD-tree over the stored blobs in SQLite), or in-process if an index is given.
+    The catalog must have been fingerprinted with the same decimation setting (see check_decimation).
+    
+    Inputs: fingerprints (numpy.ndarray, one snippet fingerprint per row)
+            method (str, which fingerprint column to search, one or five)
+            index (dictionary from build_index for the same method, optional)
+
+    Outputs: List of (window_id, song_id, fingerprint_id, title, artist, distance), one per snippet window
+    """
+    import fingerprint_index
+    if index is not None:
+        check_decimation(method, index.get("decimated", set()))
+        return(fingerprint_index.nearest_matches(index, fingerprints))
+    check_decimation(method)
+    return(backend.nearest_fingerprints(fingerprints, method))
+
+
+@profiling.timed()
+def fast_search(source, epsilon, method, path = "", index = None, progressive = False):
     """
     Function implements a fast search over our database using hashing (cube function from Postgres)
     
     Inputs: path (string, path to snippet)
-            source (string, local, recording, or url)
+            source (string, local, recording, stream (listens until the answer is decisive, or streams path in real time), or url)
             epsilon (integer, what threshold level is acceptable to you)
             method (str, which fingerprint you'd like to use! probably a better way to do this. ideally allow users to input their own fingerprint)
+            index (dictionary from build_index for the same method, optional: searches in-process instead of in Postgres)
+            progressive (boolean, search the snippet a few windows at a time and stop once the answer is decisive, see progressive_identify)
 
     Outputs: Either match found and the match or no match found.
     """
+    import spectral_analysis
+    if method == CONSTELLATION_METHOD:
+        return(constellation_search(source, path = path))
+    if source == "stream":
+        import streaming
+        if path:
+            samplerate,series_results = spectral_analysis.analyze_song(path)
+            stream = streaming.array_source(series_results, samplerate, realtime = True)
+        else:
+            samplerate,stream = 44100, streaming.microphone_source(samplerate = 44100)
+        result = streaming.recognize_stream(stream, samplerate, method, epsilon, index = index)
+        return(describe_match(result) + " (after " + str(round(result["audio_seconds"], 1)) + "s of audio)")
+    if progressive:
+        if source == "local":
+            samplerate,series_results = spectral_analysis.analyze_song(path)
+        if source == "recording":
+            samplerate,series_results = spectral_analysis.record_song() 
+        result = progressive_identify(series_results, samplerate, method, epsilon, index = index)
+        return(describe_match(result) + " (used " + str(result["windows"]) + " of " + str(result["windows_total"]) + " windows)")
     if source == "local":
-        samplerate,series_results = spectral_analysis.analyze_song(path)
+        fingerprints = spectral_analysis.fingerprint_wav(path, methods = (method,))[method]
     if source == "recording":
         samplerate,series_results = spectral_analysis.record_song() 
-    windows = spectral_analysis.get_window(series = series_results, sample_rate = samplerate, h=5,delta=1)
-    freq,pd = spectral_analysis.get_periodogram(series_results,windows,samplerate,h=5,delta=1)
-    cur.execute("SELECT songs.title,songs.artist,fingerprints.* from songs, fingerprints where fingerprints.song_id = songs.song_id;")
-    finger_df = pandas.DataFrame(columns=['song_id', 'f_id', 'title', 'artist', 'distance'])     
-    if method == "one":
-        fingerprints = spectral_analysis.fingerprint_one(pd,freq)
-        for index_row in range(int(len(fingerprints))):
-            cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist,fingerprint1 <-> cube(%s) as euclidean FROM fingerprints,songs where fingerprints.song_id = songs.song_id ORDER BY fingerprint1 <-> cube(%s) LIMIT 1;", (list(fingerprints[index_row]), list(fingerprints[index_row])))
-            matches_df_records = cur.fetchall()
-            matches_df = pandas.DataFrame(matches_df_records, columns=['song_id', 'f_id', 'title', 'artist','distance']) 
-            finger_df = finger_df.append(matches_df)
-    if method == "five":
-        fingerprints = spectral_analysis.fingerprint_five(pd,freq)
-        for index_row in range(int(len(fingerprints))):
-            cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist,fingerprint5 <-> cube(%s) as euclidean FROM fingerprints,songs where fingerprints.song_id = songs.song_id ORDER BY fingerprint5 <-> cube(%s) LIMIT 1;", (list(fingerprints[index_row]), list(fingerprints[index_row])))
-            matches_df_records = cur.fetchall()
-            matches_df = pandas.DataFrame(matches_df_records, columns=['song_id', 'f_id', 'title', 'artist','distance']) 
-            finger_df = finger_df.append(matches_df)
+        fingerprints = spectral_analysis.compute_fingerprints(series_results, samplerate, methods = (method,), h=5, delta=1)[method]
+    return(describe_match(identify_matches(nearest_fingerprints(fingerprints, method, index = index), len(fingerprints), epsilon)))
+
+
+@profiling.timed()
+def identify_matches(matches, windows, epsilon, threshold = .05):
+    """
+    Function decides which song a snippet matches from the closest catalog fingerprint of each of its windows:
+    the song with the most windows closer than epsilon matches if more than threshold of the windows voted for it.
+    
+    Inputs: matches (list of (window_id, song_id, fingerprint_id, title, artist, distance), from nearest_fingerprints)
+            windows (integer, number of windows in the snippet)
+            epsilon (float, what threshold level is acceptable to you)
+            threshold (float, share of the windows which must vote for the song)
+
+    Outputs: Dictionary with match (boolean), song_id, title and artist (of the match, or else of the closest song),
+             votes (windows closer than epsilon to that song) and windows
+    """
+    import pandas
+    result = {"match": False, "song_id": None, "title": None, "artist": None, "votes": 0, "windows": int(windows)}
+    finger_df = pandas.DataFrame(matches, columns=['window_id', 'song_id', 'f_id', 'title', 'artist', 'distance'])
+    if finger_df.empty:
+        return(result)
     less_than_ep = (finger_df[finger_df['distance'] < epsilon].groupby(['song_id','title'])['distance'].count()).sort_values(ascending=False)
-    if not less_than_ep.empty:
-        finger_song_mat = finger_df[finger_df['song_id']==less_than_ep.index[0][0]]
-        if less_than_ep.iloc[0] > .05*len(fingerprints):
-            return("Match Found!: " + str(finger_song_mat['title'].iloc[0]) + " by " + str(finger_song_mat['artist'].iloc[0]) + ".")
-    notmatch = (finger_df.groupby(['song_id','title'])['distance'].count()).sort_values(ascending=False)
-    finger_song_mat = finger_df[finger_df['song_id']==notmatch.index[0][0]]
-    return("Freezam could not find accurate match. The closest song is " + str(finger_song_mat['title'].iloc[0]) + " by " + str(finger_song_mat['artist'].iloc[0]) + ".")  
+    if not less_than_ep.empty and less_than_ep.iloc[0] > threshold*windows:
+        result["match"] = True
+        song_id = less_than_ep.index[0][0]
+    else:
+        song_id = (finger_df.groupby(['song_id','title'])['distance'].count()).sort_values(ascending=False).index[0][0]
+    finger_song_mat = finger_df[finger_df['song_id']==song_id]
+    result.update({"song_id": int(song_id), "title": str(finger_song_mat['title'].iloc[0]), "artist": str(finger_song_mat['artist'].iloc[0]),
+                   "votes": int((finger_song_mat['distance'] < epsilon).sum())})
+    return(result)
+
+
+def lead_p_value(leader, runner_up):
+    """
+    Function measures how decisive a lead is: the chance that the leading song would get at least this many of the two
+    top songs' votes if both were equally likely to get each vote (a one-sided binomial sign test).
+    
+    Inputs: leader, runner_up (integers, votes of the two top songs)
+
+    Outputs: p-value (float, small when the lead is decisive)
+    """
+    trials = leader + runner_up
+    if trials == 0:
+        return(1.0)
+    return(sum([math.comb(trials, k) for k in range(leader, trials + 1)])/2**trials)
+
+
+@profiling.timed()
+def progressive_identify(series, samplerate, method, epsilon, index = None, block_size = 4, alpha = .01, threshold = .05):
+    """
+    Function identifies a snippet a block of windows at a time, keeping running vote counts per song (a window votes for the song
+    of its closest fingerprint if it is closer than epsilon). It stops fingerprinting and searching as soon as the leader's lead over
+    the runner-up is significant (lead_p_value below alpha) and passes the usual threshold, so clean audio is answered from its
+    first few windows and only ambiguous audio is searched in full.
+    
+    Inputs: series (numpy.ndarray), samplerate (integer)
+            method (str, one or five)
+            epsilon (float, what threshold level is acceptable to you)
+            index (dictionary from build_index for the same method, optional)
+            block_size (integer, windows fingerprinted and looked up at a time)
+            alpha (float, significance level of the lead)
+            threshold (float, share of the windows used which must vote for the song)
+
+    Outputs: Dictionary as from identify_matches, plus windows_total (windows in the snippet), p_value and stopped_early
+    """
+    import spectral_analysis
+    windows_total = max(0, (len(series) - 5*samplerate)//samplerate + 1)
+    if spectral_analysis.DECIMATE:
+        samplerate, series = spectral_analysis.decimate_series(series, samplerate, spectral_analysis.decimation_factor(samplerate, method))
+    tally = new_tally()
+    for _, freq, power_densities in spectral_analysis.iter_periodograms(series, samplerate, h=5, delta=1, block_size = block_size):
+        fingerprints = np.asarray(spectral_analysis.FINGERPRINT_METHODS[method](power_densities, freq), dtype = np.float64)[:windows_total - tally["windows"]]
+        if count_votes(tally, nearest_fingerprints(fingerprints, method, index = index), epsilon, alpha = alpha, threshold = threshold):
+            break
+    result = tally_result(tally, threshold = threshold)
+    result.update({"windows_total": windows_total, "stopped_early": tally["windows"] < windows_total})
+    logger.info('Progressive search used ' + str(tally["windows"]) + ' of ' + str(windows_total) + ' windows')
+    return(result)
+
+
+def new_tally():
+    """
+    Function starts the running vote counts of a progressive search (see count_votes).
+
+    Inputs: None
+
+    Outputs: tally (dictionary of votes and nearest windows per song_id, the title and artist of each song, and the windows counted)
+    """
+    return({"votes": {}, "nearest": {}, "details": {}, "windows": 0, "p_value": 1.0})
+
+
+def count_votes(tally, matches, epsilon, alpha = .01, threshold = .05):
+    """
+    Function adds the closest catalog fingerprints of some more windows to a tally and checks whether the answer is decisive:
+    the leader's lead over the runner-up is significant (lead_p_value below alpha) and more than threshold of the windows voted for it.
+
+    Inputs: tally (dictionary, from new_tally, updated in place)
+            matches (list of (window_id, song_id, fingerprint_id, title, artist, distance), from nearest_fingerprints)
+            epsilon (float), alpha (float), threshold (float)
+
+    Outputs: decisive (boolean)
+    """
+    for _, song_id, _, title, artist, distance in matches:
+        tally["details"][song_id] = (title, artist)
+        tally["nearest"][song_id] = tally["nearest"].get(song_id, 0) + 1
+        if distance < epsilon:
+            tally["votes"][song_id] = tally["votes"].get(song_id, 0) + 1
+    tally["windows"] += len(matches)
+    top = sorted(tally["votes"].values(), reverse = True) + [0, 0]
+    tally["p_value"] = lead_p_value(top[0], top[1])
+    return(tally["p_value"] < alpha and top[0] > threshold*tally["windows"])
+
+
+def tally_result(tally, threshold = .05):
+    """
+    Function decides the match of a tally with the rule of identify_matches: the song with the most votes matches if more than
+    threshold of the windows counted voted for it, otherwise the song nearest to the most windows is reported as the closest.
+
+    Inputs: tally (dictionary, from count_votes)
+            threshold (float)
+
+    Outputs: Dictionary as from identify_matches, plus the p_value of the lead
+    """
+    votes, nearest = tally["votes"], tally["nearest"]
+    result = {"match": False, "song_id": None, "title": None, "artist": None, "votes": 0, "windows": tally["windows"], "p_value": tally["p_value"]}
+    if votes and max(votes.values()) > threshold*tally["windows"]:
+        result["match"] = True
+        song_id = max(votes, key = votes.get)
+    elif nearest:
+        song_id = max(nearest, key = nearest.get)
+    else:
+        return(result)
+    result.update({"song_id": int(song_id), "title": str(tally["details"][song_id][0]), "artist": str(tally["details"][song_id][1]), "votes": votes.get(song_id, 0)})
+    return(result)
+
+
+def describe_match(result):
+    """
+    Function turns the result of identify_matches or identify_hashes into the message the searches print.
+    
+    Inputs: result (dictionary, from identify_matches or identify_hashes)
+
+    Outputs: Either match found and the match or no match found.
+    """
+    if result["match"]:
+        return("Match Found!: " + str(result["title"]) + " by " + str(result["artist"]) + ".")
+    if result["title"] is None:
+        return("Freezam could not find accurate match.")
+    return("Freezam could not find accurate match. The closest song is " + str(result["title"]) + " by " + str(result["artist"]) + ".")
+
+
+@profiling.timed()
+def identify(series, samplerate, method, epsilon = None, index = None):
+    """
+    Function identifies a snippet that is already in memory and returns a structured result instead of a message.
+    
+    Inputs: series (numpy.ndarray), samplerate (integer)
+            method (str, one, five or constellation)
+            epsilon (float, what threshold level is acceptable to you, not used by constellation)
+            index (dictionary from build_index for the same method, optional)
+
+    Outputs: Dictionary, see identify_matches and identify_hashes
+    """
+    import spectral_analysis
+    if method == CONSTELLATION_METHOD:
+        hashes, anchor_times = spectral_analysis.constellation_hashes(series)
+        return(identify_hashes(hashes, anchor_times))
+    fingerprints = spectral_analysis.compute_fingerprints(series, samplerate, methods = (method,), h=5, delta=1)[method]
+    return(identify_matches(nearest_fingerprints(fingerprints, method, index = index), len(fingerprints), epsilon))
+
+
+@profiling.timed()
+def constellation_search(source, path = "", threshold = .01, min_votes = 20):
+    """
+    Function identifies a snippet with the constellation method: its peak-pair hashes are looked up exactly in the inverted
+    index and each song is scored by how many of its matching hashes agree on one time offset. The cost grows with the number
+    of hashes in the snippet, not with the size of the catalog, and no epsilon is needed.
+    
+    Inputs: source (string, local or recording)
+            path (string, path to snippet)
+            threshold (float, share of the snippet's hashes which must agree on an offset)
+            min_votes (integer, fewest agreeing hashes accepted as a match)
+
+    Outputs: Either match found and the match or no match found.
+    """
+    import spectral_analysis
+    if source == "local":
+        samplerate,series_results = spectral_analysis.analyze_song(path)
+    if source == "recording":
+        samplerate,series_results = spectral_analysis.record_song() 
+    hashes, anchor_times = spectral_analysis.constellation_hashes(series_results)
+    return(describe_match(identify_hashes(hashes, anchor_times, threshold = threshold, min_votes = min_votes)))
+
+
+@profiling.timed()
+def identify_hashes(hashes, anchor_times, threshold = .01, min_votes = 20):
+    """
+    Function decides which song a snippet matches from its constellation hashes: they are looked up in the inverted index
+    and the song whose matching hashes agree most on one time offset matches if enough of them do.
+    
+    Inputs: hashes, anchor_times (numpy.ndarrays, from spectral_analysis.constellation_hashes)
+            threshold (float, share of the snippet's hashes which must agree on an offset)
+            min_votes (integer, fewest agreeing hashes accepted as a match)
+
+    Outputs: Dictionary with match (boolean), song_id, title and artist (of the match, or else of the closest song),
+             votes (hashes agreeing on the best offset) and hashes
+    """
+    import spectral_analysis
+    result = {"match": False, "song_id": None, "title": None, "artist": None, "votes": 0, "hashes": int(len(hashes))}
+    with profiling.span("database_manager.lookup_hashes") as stage:
+        match_hashes, match_song_ids, match_times = backend.lookup_hashes(hashes)
+        stage.rows = len(match_hashes)
+    songs, _, score = spectral_analysis.score_hashes(hashes, anchor_times, match_hashes, match_song_ids, match_times)
+    if len(songs) == 0:
+        return(result)
+    best = int(np.argmax(score))
+    title, artist = backend.song_details()[int(songs[best])]
+    result.update({"match": bool(score[best] >= max(min_votes, threshold*len(hashes))), "song_id": int(songs[best]),
+                   "title": str(title), "artist": str(artist), "votes": int(score[best])})
+    return(result)
+
+
+@profiling.timed()
+def nearest_in_batches(fingerprints, method, index = None, batch_size = 4096):
+    """
+    Function finds the closest fingerprint in our database for every row of a large fingerprint matrix,
+    batch_size windows per lookup (see nearest_fingerprints).
+    
+    Inputs: fingerprints (numpy.ndarray, one fingerprint per row)
+            method (str, one or five)
+            index (dictionary from build_index for the same method, optional)
+            batch_size (integer, windows per lookup)
+
+    Outputs: song_ids, distances (numpy.ndarrays, closest song and its distance for every row)
+    """
+    song_ids = np.zeros(len(fingerprints), dtype = np.int64)
+    distances = np.full(len(fingerprints), np.inf)
+    for start in range(0, len(fingerprints), batch_size):
+        for window_id, song_id, _, _, _, distance in nearest_fingerprints(fingerprints[start:start + batch_size], method, index = index):
+            song_ids[start + window_id] = song_id
+            distances[start + window_id] = distance
+    return([song_ids, distances])
+
 
-def recommend(path_to_data):
+@profiling.timed()
+def recommend(path_to_data, workers = None, index = None, batch_size = 4096):
     """
-    Function allows a user to input a directory of songs and outputs a list of songs/artists that the user may like
+    Function allows a user to input a directory of songs and outputs a list of songs/artists that the user may like.
+    Files are fingerprinted in parallel, every window is looked up in batches, and each file votes for the songs holding
+    its closest window. The working directory is never changed, so it is safe to call from a server.
     
-    Inputs: path (string, path to database)
+    Inputs: path_to_data (string, path to a directory of WAVs)
+            workers (integer, number of worker processes, default is every core, 1 fingerprints in this process)
+            index (dictionary from build_index for method one, optional: searches in-process)
+            batch_size (integer, windows per kNN lookup)
 
     Outputs: Provides a list of the 10 closest songs and 10 closest artists to the given directory.
     """
-    wav_files = os.listdir(path_to_data)
-    owd = os.getcwd()
-    os.chdir(path_to_data)
-    ultimate_df = pandas.DataFrame(columns=['song_id', 'f_id', 'title', 'artist', 'distance'])
-    for filename in wav_files:
-        samplerate,series_results = spectral_analysis.analyze_song(filename)
-        windows = spectral_analysis.get_window(series = series_results, sample_rate = samplerate, h=5,delta=1)
-        freq,pd = spectral_analysis.get_periodogram(series_results,windows,samplerate,h=5,delta=1)
-        cur.execute("SELECT songs.title,songs.artist,fingerprints.* from songs, fingerprints where fingerprints.song_id = songs.song_id;")
-        finger_df = pandas.DataFrame(columns=['song_id', 'f_id', 'title', 'artist', 'distance'])
-        fingerprints = spectral_analysis.fingerprint_one(pd,freq)
-        for index_row in range(int(len(fingerprints))):
-            cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist,fingerprint1 <-> cube(%s) as euclidean FROM fingerprints,songs where fingerprints.song_id = songs.song_id ORDER BY fingerprint1 <-> cube(%s) LIMIT 1;", (list(fingerprints[index_row]), list(fingerprints[index_row])))
-            matches_df_records = cur.fetchall()
-            matches_df = pandas.DataFrame(matches_df_records, columns=['song_id', 'f_id', 'title', 'artist','distance'])
-            finger_df = finger_df.append(matches_df)      
-        min_dist_df = finger_df[finger_df['distance'] == finger_df['distance'].min()]
-        ultimate_df = ultimate_df.append(min_dist_df)  
-    closest_songs = ultimate_df.groupby(['title'])['distance'].count().sort_values(ascending=False).head(10)
-    closest_artists =  ultimate_df.groupby(['artist'])['distance'].count().sort_values(ascending=False).head(10)
-    os.chdir(owd)    
+    import pandas
+    import spectral_analysis
+    paths = [os.path.join(path_to_data, filename) for filename in sorted(os.listdir(path_to_data)) if os.path.splitext(filename)[1].lower() == ".wav"]
+    if workers == 1:
+        file_fingerprints = [spectral_analysis.fingerprint_wav(path)["one"] for path in paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+            file_fingerprints = [fingerprints["one"] for fingerprints in pool.map(spectral_analysis.fingerprint_wav, paths)]
+    # every window of every file in one matrix, with the file each row came from
+    file_fingerprints = [fingerprints for fingerprints in file_fingerprints if len(fingerprints)]
+    song_details = backend.song_details()
+    if not file_fingerprints:
+        return(pandas.Series(dtype = np.int64), pandas.Series(dtype = np.int64))
+    lengths = np.array([len(fingerprints) for fingerprints in file_fingerprints])
+    file_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    song_ids, distances = nearest_in_batches(np.concatenate(file_fingerprints), "one", index = index, batch_size = batch_size)
+
+    # each file votes for the song(s) of its closest window(s)
+    closest = distances == np.repeat(np.minimum.reduceat(distances, file_starts), lengths)
+    known_songs = np.array(sorted(song_details), dtype = np.int64)
+    voters = song_ids[closest]
+    voters = voters[np.isin(voters, known_songs)]
+    votes = np.bincount(np.searchsorted(known_songs, voters), minlength = len(known_songs))
+    voted = votes > 0
+    song_votes = pandas.DataFrame({"title": [song_details[song_id][0] for song_id in known_songs[voted]],
+                                   "artist": [song_details[song_id][1] for song_id in known_songs[voted]],
+                                   "votes": votes[voted]})
+    closest_songs = song_votes.groupby(['title'])['votes'].sum().sort_values(ascending=False).head(10)
+    closest_artists = song_votes.groupby(['artist'])['votes'].sum().sort_values(ascending=False).head(10)
     return(closest_songs,closest_artists)
-    
\ No newline at end of file
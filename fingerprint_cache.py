@@ -0,0 +1,217 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 18, 2020
+### Use: On-disk cache of fingerprints, keyed by audio content hash and analysis parameters
+#########################################
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import profiling
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Where the cache lives and how big it may grow (FREEZAM_CACHE=off turns it off)
+CACHE_DIR = os.environ.get("FREEZAM_CACHE_DIR", "fingerprint_cache")
+CACHE_MB = float(os.environ.get("FREEZAM_CACHE_MB", 2048))
+CACHE_ENABLED = os.environ.get("FREEZAM_CACHE", "on").lower() not in ("0", "off", "false", "no")
+
+# Bump when a fingerprint algorithm changes, so stale entries are never read back
+CACHE_VERSION = 1
+
+# Running size of the cache in bytes (per process, recounted from disk whenever it is evicted)
+_cache_bytes = None
+
+
+def cache_key(content_hash, method, **params):
+    """
+    Function turns a content hash, a method and its analysis parameters into the name of a cache entry.
+
+    Inputs: content_hash (string, from spectral_analysis.content_hash)
+            method (string, e.g. "one", "five" or "constellation")
+            params (keyword arguments, the analysis parameters such as h and delta)
+
+    Outputs: key (string, sha1 hex digest)
+    """
+    description = json.dumps([CACHE_VERSION, content_hash, method, sorted(params.items())])
+    return(hashlib.sha1(description.encode()).hexdigest())
+
+
+def _entry_path(key, ext = ".npz"):
+    return(os.path.join(CACHE_DIR, key[:2], key + ext))
+
+
+def _touch(path):
+    # The modification time doubles as the last-used time for LRU eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _write(path, write):
+    # Write to a temporary file then rename, so a reader (or another worker) never sees half an entry
+    global _cache_bytes
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as f:
+        write(f)
+    os.replace(temp_path, path)
+    if _cache_bytes is None:
+        _cache_bytes = cache_size()
+    else:
+        _cache_bytes += os.path.getsize(path)
+    if _cache_bytes > CACHE_MB * 2**20:
+        evict()
+
+
+@profiling.timed()
+def load(content_hash, method, **params):
+    """
+    Function reads the cached arrays of a song, if there are any.
+
+    Inputs: content_hash (string), method (string), params (keyword arguments), see cache_key
+
+    Outputs: Dictionary of name -> numpy.ndarray, or None if the entry isn't cached
+    """
+    if not CACHE_ENABLED or content_hash is None:
+        return(None)
+    path = _entry_path(cache_key(content_hash, method, **params))
+    try:
+        with np.load(path) as entry:
+            arrays = {name: entry[name] for name in entry.files}
+    except (OSError, ValueError, EOFError):
+        return(None)
+    _touch(path)
+    return(arrays)
+
+
+@profiling.timed()
+def store(content_hash, method, arrays, **params):
+    """
+    Function writes the arrays of a song to the cache, evicting the least recently used entries if the cache grows past its cap.
+
+    Inputs: content_hash (string), method (string), params (keyword arguments), see cache_key
+            arrays (dictionary of name -> numpy.ndarray)
+
+    Outputs: None
+    """
+    if not CACHE_ENABLED or content_hash is None:
+        return(None)
+    try:
+        _write(_entry_path(cache_key(content_hash, method, **params)), lambda f: np.savez(f, **arrays))
+    except OSError as error:
+        logger.warning('Could not write to the fingerprint cache: ' + repr(error))
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return(cache_key(os.path.abspath(path), "file", size = stat.st_size, mtime = stat.st_mtime_ns))
+
+
+@profiling.timed()
+def lookup_file(path):
+    """
+    Function finds the content hash of a file that was analysed before and hasn't changed since (same path, size and modification time),
+    so a cached song doesn't even have to be decoded.
+
+    Inputs: path (string, path to a WAV file)
+
+    Outputs: [content_hash (string), samplerate (integer)], or None if the file is unknown
+    """
+    if not CACHE_ENABLED:
+        return(None)
+    try:
+        entry_path = _entry_path(_file_key(path), ext = ".json")
+        with open(entry_path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return(None)
+    _touch(entry_path)
+    return([entry["content_hash"], entry["samplerate"]])
+
+
+def remember_file(path, content_hash, samplerate):
+    """
+    Function records the content hash of a file, see lookup_file.
+
+    Inputs: path (string, path to a WAV file)
+            content_hash (string)
+            samplerate (integer)
+
+    Outputs: None
+    """
+    if not CACHE_ENABLED:
+        return(None)
+    entry = json.dumps({"content_hash": content_hash, "samplerate": int(samplerate)}).encode()
+    try:
+        _write(_entry_path(_file_key(path), ext = ".json"), lambda f: f.write(entry))
+    except OSError as error:
+        logger.warning('Could not write to the fingerprint cache: ' + repr(error))
+
+
+def _entries():
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+    return(entries)
+
+
+def cache_size():
+    """
+    Function adds up the size of every entry in the cache.
+
+    Inputs: None
+
+    Outputs: size (integer, bytes)
+    """
+    return(sum(size for _, size, _ in _entries()))
+
+
+def evict(max_mb = None):
+    """
+    Function removes the least recently used entries until the cache is under 90% of its cap.
+
+    Inputs: max_mb (float, cap in megabytes, default FREEZAM_CACHE_MB)
+
+    Outputs: number of entries removed (integer)
+    """
+    global _cache_bytes
+    max_mb = CACHE_MB if max_mb is None else max_mb
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    target = .9 * max_mb * 2**20
+    removed = 0
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    _cache_bytes = total
+    logger.info('Evicted ' + str(removed) + ' entries from the fingerprint cache')
+    return(removed)
+
+
+def clear():
+    """
+    Function empties the cache.
+
+    Inputs: None
+
+    Outputs: number of entries removed (integer)
+    """
+    return(evict(max_mb = 0))
@@ -0,0 +1,74 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 17, 2020
+### Use: In-process nearest-neighbor index over catalog fingerprints
+#########################################
+
+import logging
+import numpy as np
+from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def build_index(song_ids, fingerprint_ids, fingerprints, song_details = None, leafsize = 32):
+    """
+    Function builds a KD-tree over every fingerprint of one method, so nearest neighbors can be found without the database.
+
+    Inputs: song_ids (numpy.ndarray, song of each fingerprint)
+            fingerprint_ids (numpy.ndarray, fingerprint_id of each fingerprint)
+            fingerprints (2-D numpy.ndarray, one fingerprint per row, e.g. from database_manager.load_catalog)
+            song_details (dictionary of song_id -> (title, artist), optional)
+            leafsize (integer, number of points per leaf of the tree)
+
+    Outputs: index (dictionary holding the tree and the ids of each row)
+    """
+    fingerprints = np.ascontiguousarray(fingerprints, dtype = np.float64)
+    index = {
+        "tree": cKDTree(fingerprints, leafsize = leafsize),
+        "song_ids": np.asarray(song_ids),
+        "fingerprint_ids": np.asarray(fingerprint_ids),
+        "song_details": song_details if song_details is not None else {},
+    }
+    logger.info('Built index over ' + str(len(fingerprints)) + ' fingerprints')
+    return(index)
+
+
+def query_index(index, fingerprints, k = 1, workers = -1):
+    """
+    Function finds the k nearest catalog fingerprints of every snippet window in one call.
+
+    Inputs: index (dictionary, from build_index)
+            fingerprints (2-D numpy.ndarray, one snippet fingerprint per row)
+            k (integer, neighbors per window)
+            workers (integer, number of threads, -1 uses every core)
+
+    Outputs: song_ids, fingerprint_ids, distances (numpy.ndarrays, windows x k)
+    """
+    fingerprints = np.atleast_2d(np.asarray(fingerprints, dtype = np.float64))
+    if index["tree"].n == 0 or len(fingerprints) == 0:
+        empty = np.zeros((len(fingerprints), 0))
+        return([empty.astype(np.int64), empty.astype(np.int64), empty])
+    distances, rows = index["tree"].query(fingerprints, k = [i + 1 for i in range(k)], workers = workers)
+    return([index["song_ids"][rows], index["fingerprint_ids"][rows], distances])
+
+
+def nearest_matches(index, fingerprints):
+    """
+    Function finds the closest catalog fingerprint of every snippet window, in the same row format as database_manager.nearest_fingerprints.
+
+    Inputs: index (dictionary, from build_index)
+            fingerprints (2-D numpy.ndarray, one snippet fingerprint per row)
+
+    Outputs: List of (window_id, song_id, fingerprint_id, title, artist, distance), one per snippet window
+    """
+    song_ids, fingerprint_ids, distances = query_index(index, fingerprints, k = 1)
+    matches = []
+    if song_ids.shape[1] == 0:
+        return(matches)
+    for window_id in range(len(song_ids)):
+        song_id = int(song_ids[window_id, 0])
+        title, artist = index["song_details"].get(song_id, (None, None))
+        matches.append((window_id, song_id, int(fingerprint_ids[window_id, 0]), title, artist, float(distances[window_id, 0])))
+    return(matches)
@@ -9,18 +9,25 @@ import os
 import argparse
 import logging
 
-#import my functions
-import audio_processing
-import database_manager
-import spectral_analysis
+#import my functions (the heavy ones, database_manager and server, are imported by the subcommands that need them)
+import profiling
 
 ## NOTE: To run, use: (example queries)
+#  python freezam.py init
 #  python freezam.py slow_search --path="snippets/jarofhearts_snippet.wav" --source="local" --epsilon=50000 --method="five"
 #  python freezam.py update_album --title="betty" --new_album="folklore" --artist="Taylor Swift"
 #  python freezam.py update_artist --title="betty" --album="folklore" --new_artist="Taylor Swift"
 #  python freezam.py list
+#  python freezam.py add_dir --path_to_data="WAVs" --workers=8
+#  python freezam.py add_urls --urls_file="urls.txt" --workers=8
 #  python freezam.py fast_search --path="snippets/jarofhearts_snippet.wav" --source="local" --epsilon=50000 --method="five"
+#  python freezam.py fast_search --path="snippets/jarofhearts_snippet.wav" --source="local" --method="constellation"
+#  python freezam.py fast_search --path="snippets/jarofhearts_snippet.wav" --source="local" --epsilon=50000 --method="five" --progressive
+#  python freezam.py fast_search --source="stream" --epsilon=50000 --method="five"
 #  python freezam.py recommend --path_to_data="C:/snippets"
+#  python freezam.py serve --port=8080 --methods five constellation
+#  python freezam.py --decimate add_dir --path_to_data="WAVs"
+#  python freezam.py --profile="trace.json" fast_search --path="snippets/jarofhearts_snippet.wav" --source="local" --epsilon=50000 --method="five"
 
 
 logger = logging.getLogger(__name__)
@@ -29,10 +36,16 @@ logger.info('Started')
 
 parser = argparse.ArgumentParser(description="Function which reads in and matches songs.")
 parser.add_argument("-v", "--version", action = "version", version = "Freezam 0.1")
+parser.add_argument("--profile", metavar = "FILE", help = "Time every stage (calls, wall time, rows fetched, peak memory), print a summary and write it to FILE as JSON / Chrome trace")
+parser.add_argument("--profile_time_only", action = "store_true", help = "With --profile, skip memory tracking (which slows the program down)")
+parser.add_argument("--decimate", action = "store_true", help = "Compute fingerprints two and five from audio decimated to the band they read (smaller FFTs); use it for adding and searching alike")
 
 #adding subcommands - add, remove, identify, list
 subcommands = parser.add_subparsers(dest="command_name")
 
+#init
+parser_init = subcommands.add_parser("init", help = "Create the database tables (and their indexes), run once before adding songs")
+
 #add
 parser_add = subcommands.add_parser("add", help = "Adding a song to the database")
 parser_add.add_argument("--path", help = "File path to song")
@@ -41,6 +54,20 @@ parser_add.add_argument("--artist", help = "Artist of song")
 parser_add.add_argument("--album", help = "Album of song")
 parser_add.add_argument("--date", help = "Date of song")
 parser_add.add_argument("--source", help = "Local or URL?")
+parser_add.add_argument("--keep_wav", action = "store_true", help = "Also write the decoded MP3 to WAVs/ (it is fingerprinted in memory either way)")
+
+#add a whole directory
+parser_add_dir = subcommands.add_parser("add_dir", help = "Adding every WAV in a directory (named title_artist_album_date.wav) to the database, using every core")
+parser_add_dir.add_argument("--path_to_data", type=str, help = "Path to folder with wavs")
+parser_add_dir.add_argument("--workers", type=int, help = "Number of worker processes (default: every core)")
+parser_add_dir.add_argument("--batch_size", type=int, default=32, help = "Songs written per transaction")
+
+#add songs from many URLs
+parser_add_urls = subcommands.add_parser("add_urls", help = "Adding songs from many URLs (each ending in title_artist_album_date.mp3 or .wav), downloaded concurrently")
+parser_add_urls.add_argument("--urls_file", type=str, help = "File listing one URL per line")
+parser_add_urls.add_argument("--workers", type=int, default=8, help = "Most downloads at once")
+parser_add_urls.add_argument("--batch_size", type=int, default=32, help = "Songs written per transaction")
+parser_add_urls.add_argument("--keep_wav", action = "store_true", help = "Also write each decoded song to WAVs/")
 
 #remove (same syntax as add? -- could update in future)
 parser_remove = subcommands.add_parser("remove", help = "Removing a song from the database")
@@ -66,29 +93,81 @@ parser_slow_search = subcommands.add_parser("slow_search", help = "Identify a so
 parser_slow_search.add_argument("--path", type=str, help = "File path to song")
 parser_slow_search.add_argument("--source", type=str, help = "Local or URL?")
 parser_slow_search.add_argument("--epsilon", type=float, help = "Tolerance level?")
-parser_slow_search.add_argument("--method", help = "Which fingerprint, one or five?")
+parser_slow_search.add_argument("--method", help = "Which fingerprint, one, five or constellation (exact hash lookup, no epsilon needed)?")
 
 #fastsearch
 parser_slow_search = subcommands.add_parser("fast_search", help = "Identify a song, but quickly! Great if you're in a rush.")
 parser_slow_search.add_argument("--path", type=str, help = "File path to song")
-parser_slow_search.add_argument("--source", type=str, help = "Local, recording, or URL?")
+parser_slow_search.add_argument("--source", type=str, help = "Local, recording, stream (identify while listening; with --path, streams the file in real time), or URL?")
 parser_slow_search.add_argument("--epsilon", type=float, help = "Tolerance level?")
-parser_slow_search.add_argument("--method", help = "Which fingerprint, one or five?")
+parser_slow_search.add_argument("--method", help = "Which fingerprint, one, five or constellation (exact hash lookup, no epsilon needed)?")
+parser_slow_search.add_argument("--index", choices = ["sql", "memory"], default = "sql", help = "Search in Postgres (sql) or in an in-process KD-tree built from the catalog (memory)")
+parser_slow_search.add_argument("--progressive", action = "store_true", help = "Search a few windows at a time and stop as soon as one song's lead is decisive (reports the windows used)")
 
 
 #recommend
 parser_slow_search = subcommands.add_parser("recommend", help = "Recommend some songs/artists. Just input a path to a directly")
-parser_slow_search.add_argument("--path_to_data", type=str, help = "Path to folder with mp3s/wavs")
+parser_slow_search.add_argument("--path_to_data", type=str, help = "Path to folder with wavs")
+parser_slow_search.add_argument("--workers", type=int, help = "Number of worker processes fingerprinting the files (default: every core)")
 
 #list
 parser_list = subcommands.add_parser("list", help = "List all the songs in the database")
 
+#serve
+parser_serve = subcommands.add_parser("serve", help = "Run a local HTTP server which keeps everything warm and answers identify, add and list requests concurrently (see server.py)")
+parser_serve.add_argument("--host", type=str, default="127.0.0.1", help = "Address to listen on")
+parser_serve.add_argument("--port", type=int, default=8080, help = "Port to listen on")
+parser_serve.add_argument("--methods", nargs="+", choices = ["one", "five", "constellation"], default=["five"], help = "Methods to warm up (and index in memory): one, five and/or constellation")
+parser_serve.add_argument("--index", choices = ["sql", "memory"], default = "memory", help = "Search in the database (sql) or in in-process KD-trees kept warm (memory)")
+
 results = parser.parse_args()
 
 def main():
-    """Function allows all our functions to work from the command line."""
+    """Function allows all our functions to work from the command line, profiled if --profile is given."""
+    try:
+        if not results.profile:
+            return(run_command())
+        profiling.enable(memory = not results.profile_time_only)
+        try:
+            with profiling.span("freezam." + str(results.command_name)):
+                run_command()
+        finally:
+            profiling.disable()
+            print(profiling.format_summary())
+            profiling.export(results.profile)
+            print("Profile written to " + results.profile)
+    except Exception as error:
+        import storage_backends
+        if not storage_backends.is_schema_error(error):
+            raise
+        print("The database is missing Freezam's tables (" + str(error).strip() + "): run python freezam.py init")
+        sys.exit(1)
+
+
+def run_command():
+    """Function runs the subcommand given on the command line. Modules are imported here so each subcommand only loads what it uses."""
+    if results.command_name is None:
+        return(parser.print_help())
+    if results.decimate:
+        # Set before spectral_analysis is imported, and inherited by the worker processes of add_dir and recommend
+        os.environ["FREEZAM_DECIMATE"] = "on"
+    if results.command_name == "serve":
+        import server
+        return(server.serve(host = results.host, port = results.port, methods = results.methods, index = results.index))
+    import database_manager
+    if results.command_name == "init":
+        database_manager.create_tables()
+        print("Created the tables.")
     if results.command_name == "add":
-        database_manager.add_function(results.path, results.title, results.artist, results.album, results.date, results.source)
+        database_manager.add_function(results.path, results.title, results.artist, results.album, results.date, results.source, keep_wav = results.keep_wav)
+    if results.command_name == "add_dir":
+        summary = database_manager.add_dir(results.path_to_data, workers = results.workers, batch_size = results.batch_size)
+        print("Added " + str(summary["added"]) + ", updated " + str(summary["updated"]) + " and failed " + str(summary["failed"]) + " of " + str(summary["files"]) + " files in " + str(round(summary["seconds"], 1)) + "s (" + str(round(summary["files_per_minute"], 1)) + " files/min).")
+    if results.command_name == "add_urls":
+        with open(results.urls_file) as f:
+            urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        summary = database_manager.add_urls(urls, workers = results.workers, batch_size = results.batch_size, keep_wav = results.keep_wav)
+        print("Added " + str(summary["added"]) + ", updated " + str(summary["updated"]) + " and failed " + str(summary["failed"]) + " of " + str(summary["files"]) + " URLs in " + str(round(summary["seconds"], 1)) + "s (" + str(round(summary["files_per_minute"], 1)) + " files/min; " + str(summary["downloaded"]) + " downloaded, " + str(summary["resumed"]) + " resumed, " + str(summary["cached"]) + " from the download cache).")
     if results.command_name == "remove":
         database_manager.remove_function(results.title, results.artist, results.album)
     if results.command_name == "update_artist":
@@ -101,12 +180,13 @@ def main():
         print(pr_result)
     if results.command_name == "fast_search":
         logger.info('Trying to identify a match...')
-        pr_result = database_manager.fast_search(path = results.path, source =  results.source, epsilon = results.epsilon, method = results.method)
+        index = database_manager.build_index(results.method) if results.index == "memory" and results.method != database_manager.CONSTELLATION_METHOD else None
+        pr_result = database_manager.fast_search(path = results.path, source =  results.source, epsilon = results.epsilon, method = results.method, index = index, progressive = results.progressive)
         print(pr_result)    
     if results.command_name == "list":
         print(database_manager.list_function())
     if results.command_name == "recommend":
-        songs,artists = database_manager.recommend(path_to_data = results.path_to_data)
+        songs,artists = database_manager.recommend(path_to_data = results.path_to_data, workers = results.workers)
         print("10 Closest Songs:")
         print(songs)
         print("10 Closest Artists:")
@@ -0,0 +1,229 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 18, 2020
+### Use: Per-stage timing and memory instrumentation (python freezam.py --profile=trace.json ...)
+#########################################
+
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Off by default: a disabled span or timed function costs one global lookup
+ENABLED = False
+MEMORY = False
+
+# Finished spans (name, start, duration, thread, rows, peak bytes), in the order they finished
+_events = []
+# Open spans of each thread, innermost last, so a stage's peak memory includes the stages inside it
+_stacks = threading.local()
+_origin = time.perf_counter()
+
+
+class _Span(object):
+    """
+    One timed stage: use it as a context manager and set rows on it for the rows the stage fetched.
+    """
+    __slots__ = ("name", "rows", "start", "peak", "base")
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        if not ENABLED:
+            return(self)
+        stack = _stack()
+        if MEMORY and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.base = self.peak = current
+        stack.append(self)
+        self.start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, *exc_info):
+        if not ENABLED:
+            return(False)
+        end = time.perf_counter()
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        peak_bytes = None
+        if MEMORY and tracemalloc.is_tracing() and hasattr(self, "base"):
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            peak_bytes = self.peak - self.base
+        _events.append((self.name, self.start - _origin, end - self.start, threading.get_ident(), self.rows, peak_bytes))
+        return(False)
+
+
+class _NullSpan(object):
+    """
+    The span handed out while profiling is off: it does nothing and ignores rows.
+    """
+    __slots__ = ("rows",)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc_info):
+        return(False)
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _stack():
+    stack = getattr(_stacks, "spans", None)
+    if stack is None:
+        stack = _stacks.spans = []
+    return(stack)
+
+
+def span(name):
+    """
+    Function times a block of code as one stage: with profiling.span("lookup_hashes") as stage: ... (stage.rows = rows fetched).
+
+    Inputs: name (str, name of the stage)
+
+    Outputs: context manager (a no-op if profiling is off)
+    """
+    if not ENABLED:
+        return(_NULL_SPAN)
+    return(_Span(name))
+
+
+def timed(name = None, rows = None):
+    """
+    Function makes a decorator which times every call of a function as a stage.
+
+    Inputs: name (str, name of the stage, default module.function)
+            rows (callable, turns the function's result into the number of rows it fetched, optional)
+
+    Outputs: decorator
+    """
+    def decorator(function):
+        stage = name or function.__module__ + "." + function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return(function(*args, **kwargs))
+            with _Span(stage) as current:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    current.rows = rows(result)
+            return(result)
+        return(wrapper)
+    return(decorator)
+
+
+def enable(memory = True):
+    """
+    Function switches profiling on and forgets earlier spans. Tracking memory (tracemalloc) slows the program down noticeably,
+    so turn it off when only the timings matter.
+
+    Inputs: memory (boolean, record the peak allocated memory of each stage)
+
+    Outputs: None
+    """
+    global ENABLED, MEMORY, _origin
+    del _events[:]
+    _stacks.spans = []
+    MEMORY = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _origin = time.perf_counter()
+    ENABLED = True
+
+
+def disable():
+    """
+    Function switches profiling off (spans recorded so far are kept for summary and export).
+
+    Inputs: None
+
+    Outputs: None
+    """
+    global ENABLED
+    ENABLED = False
+    if MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def summary():
+    """
+    Function adds up the spans of each stage.
+
+    Inputs: None
+
+    Outputs: Dictionary of stage -> calls, seconds (total wall time), rows (total, or None) and peak_bytes (largest, or None),
+             slowest stage first
+    """
+    stages = {}
+    for name, _, duration, _, rows, peak_bytes in list(_events):
+        stage = stages.setdefault(name, {"calls": 0, "seconds": 0.0, "rows": None, "peak_bytes": None})
+        stage["calls"] += 1
+        stage["seconds"] += duration
+        if rows is not None:
+            stage["rows"] = (stage["rows"] or 0) + int(rows)
+        if peak_bytes is not None:
+            stage["peak_bytes"] = max(stage["peak_bytes"] or 0, int(peak_bytes))
+    return(dict(sorted(stages.items(), key = lambda item: -item[1]["seconds"])))
+
+
+def chrome_trace():
+    """
+    Function turns the recorded spans into Chrome trace events (complete "X" events, microseconds), which chrome://tracing and Perfetto open.
+
+    Inputs: None
+
+    Outputs: List of trace events (dictionaries)
+    """
+    events = []
+    for name, start, duration, thread, rows, peak_bytes in list(_events):
+        args = {key: value for key, value in (("rows", rows), ("peak_bytes", peak_bytes)) if value is not None}
+        events.append({"name": name, "cat": name.split(".")[0], "ph": "X", "ts": start*1e6, "dur": duration*1e6,
+                       "pid": os.getpid(), "tid": thread, "args": args})
+    return(events)
+
+
+def export(path):
+    """
+    Function writes the profile to a JSON file: the per-stage summary under "stages" and every span under "traceEvents",
+    so the same file can be read as JSON or opened as a Chrome trace.
+
+    Inputs: path (str)
+
+    Outputs: None
+    """
+    with open(path, "w") as f:
+        json.dump({"stages": summary(), "traceEvents": chrome_trace(), "displayTimeUnit": "ms"}, f, indent = 1)
+    logger.info('Wrote profile of ' + str(len(_events)) + ' spans to ' + path)
+
+
+def format_summary(stages = None):
+    """
+    Function formats the per-stage summary as a table for the terminal.
+
+    Inputs: stages (dictionary, from summary, default the current profile)
+
+    Outputs: table (str)
+    """
+    stages = summary() if stages is None else stages
+    lines = ["{:<45} {:>7} {:>11} {:>10} {:>12}".format("stage", "calls", "seconds", "rows", "peak MB")]
+    for name, stage in stages.items():
+        peak = "" if stage["peak_bytes"] is None else "{:.1f}".format(stage["peak_bytes"]/2**20)
+        lines.append("{:<45} {:>7} {:>11.4f} {:>10} {:>12}".format(name, stage["calls"], stage["seconds"], "" if stage["rows"] is None else stage["rows"], peak))
+    return("\n".join(lines))
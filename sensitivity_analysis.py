@@ -1,131 +1,270 @@
 #########################################
 ### Author: Vinni Bhatia
-### Last Edited: Dec 7, 2020
-### Use: Tests sensitivity of our algorithm
+### Last Edited: Dec 18, 2020
+### Use: Tests sensitivity of our algorithm: a seeded accuracy/latency benchmark of identification
 #########################################
 
+## NOTE: To run, use: (example queries)
+#  python sensitivity_analysis.py --seed=0 --trials=50 --methods one five --epsilons one=1e-06 five=10000
+#  python sensitivity_analysis.py --backend=sqlite --sqlite_path=bench.db --ingest --in_database WAVs --not_in_database Songs_not_in_database/WAVs --methods five constellation --lengths 10 15 24
+## Results (precision/recall and latency percentiles for every method, epsilon and excerpt length) are written to --output as JSON.
 
 import os
+import json
+import time
+import random
+import argparse
+import logging
 import numpy as np
-import sys
-from audio_processing import convert_to_local_wav
-import pandas
 import spectral_analysis
-import psycopg2
-import credentials
-import random
-import time
+import storage_backends
 
-#Connecting to database
-conn = psycopg2.connect(
-    host="sculptor.stat.cmu.edu",
-    database=credentials.DB_USER,
-    user=credentials.DB_USER,
-    password=credentials.DB_PASSWORD
-)
-cur = conn.cursor()
-
-# Songs that are in database (fast search)
-def test_songs_in_database(N, method, epsilon, source):
-    start = time.time()
-    correct = 0
-    incorrect = 0
-    for _ in range(N):
-        filename = random.choice(os.listdir("WAVs"))
-        print(filename)
-        path = "WAVs/" + filename
-        samplerate,series_results = spectral_analysis.analyze_song(path)
-        random_length = random.randrange(10,24)
-        random_start = random.randrange(0,len(series_results) - random_length*samplerate)
-        new_series = series_results[random_start:(random_start + random_length*samplerate - 1)]
-        windows = spectral_analysis.get_window(series = new_series, sample_rate = samplerate, h=5,delta=1)
-        freq,pd = spectral_analysis.get_periodogram(new_series,windows,samplerate,h=5,delta=1)
-        cur.execute("SELECT songs.title,songs.artist,fingerprints.* from songs, fingerprints where fingerprints.song_id = songs.song_id;")
-        finger_df = pandas.DataFrame(columns=['song_id', 'f_id', 'title', 'artist', 'distance'])     
-        if method == "one":
-            fingerprints = spectral_analysis.fingerprint_one(pd,freq)
-            for index_row in range(int(len(fingerprints))):
-                cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist,fingerprint1 <-> cube(%s) as euclidean FROM fingerprints,songs where fingerprints.song_id = songs.song_id ORDER BY fingerprint1 <-> cube(%s) LIMIT 1;", (list(fingerprints[index_row]), list(fingerprints[index_row])))
-                matches_df_records = cur.fetchall()
-                matches_df = pandas.DataFrame(matches_df_records, columns=['song_id', 'f_id', 'title', 'artist','distance']) 
-                finger_df = finger_df.append(matches_df)
-        if method == "five":
-            fingerprints = spectral_analysis.fingerprint_five(pd,freq)
-            for index_row in range(int(len(fingerprints))):
-                cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist,fingerprint5 <-> cube(%s) as euclidean FROM fingerprints,songs where fingerprints.song_id = songs.song_id ORDER BY fingerprint5 <-> cube(%s) LIMIT 1;", (list(fingerprints[index_row]), list(fingerprints[index_row])))
-                matches_df_records = cur.fetchall()
-                matches_df = pandas.DataFrame(matches_df_records, columns=['song_id', 'f_id', 'title', 'artist','distance']) 
-                finger_df = finger_df.append(matches_df)
-        less_than_ep = (finger_df[finger_df['distance'] < epsilon].groupby(['song_id','title'])['distance'].count()).sort_values(ascending=False)
-        positions = filename.split('_')
-        print(less_than_ep)
-        if not less_than_ep.empty:
-            finger_song_mat = finger_df[finger_df['song_id']==less_than_ep.index[0][0]]
-            if less_than_ep[0] > .05*len(fingerprints) and str(finger_song_mat['title'].iloc[0]) == positions[0]:
-                correct += 1
-            else:
-                incorrect += 1
-        else:
-            incorrect += 1
-    end = time.time()        
-    print("# Correct (fast search): " + str(correct))
-    print("# Num Incorrect (fast search): " + str(incorrect))    
-    print("Time taken (fast search): " + str(end - start))
-
-
-# Songs that are in database (fast search)
-def test_songs_not_in_database(N, method, epsilon, source):
-    start = time.time()
-    correct = 0
-    incorrect = 0
-    for _ in range(N):
-        filename = random.choice(os.listdir("Songs_not_in_database/WAVs"))
-        print(filename)
-        path = "Songs_not_in_database/WAVs/" + filename
-        samplerate,series_results = spectral_analysis.analyze_song(path)
-        random_length = random.randrange(10,24)
-        random_start = random.randrange(0,len(series_results) - random_length*samplerate)
-        new_series = series_results[random_start:(random_start + random_length*samplerate - 1)]
-        windows = spectral_analysis.get_window(series = new_series, sample_rate = samplerate, h=5,delta=1)
-        freq,pd = spectral_analysis.get_periodogram(new_series,windows,samplerate,h=5,delta=1)
-        cur.execute("SELECT songs.title,songs.artist,fingerprints.* from songs, fingerprints where fingerprints.song_id = songs.song_id;")
-        finger_df = pandas.DataFrame(columns=['song_id', 'f_id', 'title', 'artist', 'distance'])     
-        if method == "one":
-            fingerprints = spectral_analysis.fingerprint_one(pd,freq)
-            for index_row in range(int(len(fingerprints))):
-                cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist,fingerprint1 <-> cube(%s) as euclidean FROM fingerprints,songs where fingerprints.song_id = songs.song_id ORDER BY fingerprint1 <-> cube(%s) LIMIT 1;", (list(fingerprints[index_row]), list(fingerprints[index_row])))
-                matches_df_records = cur.fetchall()
-                matches_df = pandas.DataFrame(matches_df_records, columns=['song_id', 'f_id', 'title', 'artist','distance']) 
-                finger_df = finger_df.append(matches_df)
-        if method == "five":
-            fingerprints = spectral_analysis.fingerprint_five(pd,freq)
-            for index_row in range(int(len(fingerprints))):
-                cur.execute("SELECT songs.song_id,fingerprint_id,songs.title,songs.artist,fingerprint5 <-> cube(%s) as euclidean FROM fingerprints,songs where fingerprints.song_id = songs.song_id ORDER BY fingerprint5 <-> cube(%s) LIMIT 1;", (list(fingerprints[index_row]), list(fingerprints[index_row])))
-                matches_df_records = cur.fetchall()
-                matches_df = pandas.DataFrame(matches_df_records, columns=['song_id', 'f_id', 'title', 'artist','distance']) 
-                finger_df = finger_df.append(matches_df)
-        less_than_ep = (finger_df[finger_df['distance'] < epsilon].groupby(['song_id','title'])['distance'].count()).sort_values(ascending=False)
-        print(less_than_ep)
-        if not less_than_ep.empty:
-            #if no match - great! otherwise bad
-            if less_than_ep[0] < .05*len(fingerprints):
-                correct += 1
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Epsilons used when none are given for a method (see README: method one needs a far smaller epsilon than method five)
+DEFAULT_EPSILONS = {"one": [1e-06], "five": [10000]}
+
+# Methods the benchmark can search: those stored for every song (see storage_backends.FINGERPRINT_COLUMNS), and the constellation hashes
+METHODS = list(storage_backends.FINGERPRINT_COLUMNS) + ["constellation"]
+
+
+def use_backend(name = None, path = None, dsn = None):
+    """
+    Function points database_manager at the chosen storage backend (creating its tables if they don't exist, as the harness
+    is often run on a new database file) and imports it.
+
+    Inputs: name (str, postgres or sqlite, default FREEZAM_BACKEND)
+            path (str, SQLite file, optional)
+            dsn (str, Postgres connection string, optional)
+
+    Outputs: The database_manager module
+    """
+    if name is not None:
+        os.environ["FREEZAM_BACKEND"] = name
+    if path is not None:
+        os.environ["FREEZAM_SQLITE_PATH"] = path
+    if dsn is not None:
+        os.environ["FREEZAM_DSN"] = dsn
+    import database_manager
+    import storage_backends
+    database_manager.set_backend(storage_backends.get_backend())
+    return(database_manager)
+
+
+def corpus_files(directories):
+    """
+    Function lists the WAVs of some directories in a fixed (sorted) order, so a seed always draws the same files.
+
+    Inputs: directories (list of str)
+
+    Outputs: List of paths
+    """
+    paths = []
+    for directory in directories:
+        paths.extend(os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if os.path.splitext(filename)[1].lower() == ".wav")
+    return(paths)
+
+
+def draw_excerpts(paths, lengths, trials, rng):
+    """
+    Function draws random excerpts (a song and a start) of every length.
+
+    Inputs: paths (list of str, WAVs to draw from)
+            lengths (list of integers, excerpt lengths in seconds)
+            trials (integer, excerpts per length)
+            rng (random.Random, seeded)
+
+    Outputs: List of dictionaries with the path, offset (sample), samples and length (seconds) of each excerpt
+    """
+    excerpts = []
+    if not paths:
+        return(excerpts)
+    for seconds in lengths:
+        for _ in range(trials):
+            path = rng.choice(paths)
+            samplerate, song_length = spectral_analysis.song_info(path)
+            length = min(int(seconds*samplerate), song_length)
+            excerpts.append({"path": path, "offset": rng.randrange(0, song_length - length + 1), "samples": length, "length": seconds})
+    return(excerpts)
+
+
+def run_trials(database_manager, excerpts, in_database, methods, epsilons, index = None):
+    """
+    Function identifies every excerpt with every method and epsilon. The fingerprints and nearest neighbors of an excerpt are
+    computed once per method and shared by its epsilons, and each query's latency counts fingerprinting, lookup and voting.
+
+    Inputs: database_manager (module, from use_backend)
+            excerpts (list of dictionaries, from draw_excerpts)
+            in_database (boolean, whether the excerpts' songs are in the database)
+            methods (list of str, one, five or constellation)
+            epsilons (dictionary of method -> list of epsilons)
+            index (dictionary of method -> index from database_manager.build_index, optional)
+
+    Outputs: List of trial records (method, epsilon, length, in_database, expected, predicted, match, correct, latency)
+    """
+    records = []
+    for excerpt in excerpts:
+        samplerate, series = spectral_analysis.analyze_song(excerpt["path"], offset = excerpt["offset"], length = excerpt["samples"])
+        expected = database_manager.parse_filename(excerpt["path"])[0] if in_database else None
+        for method in methods:
+            start = time.perf_counter()
+            if method == database_manager.CONSTELLATION_METHOD:
+                hashes, anchor_times = spectral_analysis.constellation_hashes(series)
+                results = [(None, database_manager.identify_hashes(hashes, anchor_times), time.perf_counter() - start)]
             else:
-                incorrect += 1
-        else:
-            correct += 1
-    end = time.time()         
-    print("# Correct (fast search): " + str(correct))
-    print("# Num Incorrect (fast search): " + str(incorrect))    
-    print("Time taken (fast search): " + str(end - start))           
+                fingerprints = spectral_analysis.compute_fingerprints(series, samplerate, methods = (method,), h=5, delta=1)[method]
+                matches = database_manager.nearest_fingerprints(fingerprints, method, index = (index or {}).get(method))
+                shared = time.perf_counter() - start
+                results = []
+                for epsilon in epsilons[method]:
+                    start = time.perf_counter()
+                    result = database_manager.identify_matches(matches, len(fingerprints), epsilon)
+                    results.append((epsilon, result, shared + time.perf_counter() - start))
+            for epsilon, result, latency in results:
+                records.append({"method": method, "epsilon": epsilon, "length": excerpt["length"], "in_database": in_database,
+                                "expected": expected, "predicted": result["title"], "match": result["match"],
+                                "correct": result["match"] == in_database and (not in_database or result["title"] == expected),
+                                "latency": latency})
+    return(records)
+
+
+def latency_percentiles(latencies):
+    """
+    Function summarizes query latencies.
+
+    Inputs: latencies (list of floats, seconds)
+
+    Outputs: Dictionary with the p50, p95, p99 and mean latency in milliseconds
+    """
+    if not latencies:
+        return({"p50": None, "p95": None, "p99": None, "mean": None})
+    milliseconds = 1000*np.asarray(latencies)
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return({"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(milliseconds.mean())})
+
+
+def summarize(records):
+    """
+    Function scores the trials of one configuration. A match to the right song is a true positive, a match to the wrong song
+    or to a song that isn't in the database is a false positive, and an in-database excerpt without the right match is a false negative.
+
+    Inputs: records (list of trial records, from run_trials)
+
+    Outputs: Dictionary with the counts, precision, recall, accuracy and latency percentiles
+    """
+    true_positives = sum(1 for record in records if record["in_database"] and record["correct"])
+    false_positives = sum(1 for record in records if record["match"] and not record["correct"])
+    false_negatives = sum(1 for record in records if record["in_database"] and not record["correct"])
+    in_database = sum(1 for record in records if record["in_database"])
+    summary = {
+        "trials_in_database": in_database,
+        "trials_not_in_database": len(records) - in_database,
+        "true_positives": true_positives,
+        "false_positives": false_positives,
+        "false_negatives": false_negatives,
+        "precision": true_positives/(true_positives + false_positives) if true_positives + false_positives else None,
+        "recall": true_positives/in_database if in_database else None,
+        "accuracy": sum(1 for record in records if record["correct"])/len(records) if records else None,
+        "latency_ms": latency_percentiles([record["latency"] for record in records]),
+    }
+    return(summary)
+
+
+def run_benchmark(database_manager, in_database_dirs, not_in_database_dirs, methods, epsilons, lengths, trials, seed = 0, index = None):
+    """
+    Function runs the whole benchmark: the same seeded excerpts are identified with every method, epsilon and excerpt length.
+
+    Inputs: database_manager (module, from use_backend)
+            in_database_dirs, not_in_database_dirs (lists of str, corpus directories of songs in / not in the database)
+            methods (list of str), epsilons (dictionary of method -> list of epsilons)
+            lengths (list of integers, excerpt lengths in seconds)
+            trials (integer, excerpts per length and corpus)
+            seed (integer)
+            index (dictionary of method -> index from database_manager.build_index, optional)
+
+    Outputs: Dictionary with the settings and one result per method, epsilon and length
+    """
+    unknown = [method for method in methods if method not in METHODS]
+    if unknown:
+        raise ValueError("Cannot benchmark " + ", ".join(unknown) + ": the database only stores methods " + ", ".join(METHODS))
+    rng = random.Random(seed)
+    epsilons = {method: epsilons.get(method, DEFAULT_EPSILONS.get(method, [None])) for method in methods}
+    in_excerpts = draw_excerpts(corpus_files(in_database_dirs), lengths, trials, rng)
+    out_excerpts = draw_excerpts(corpus_files(not_in_database_dirs), lengths, trials, rng)
+    start = time.perf_counter()
+    records = run_trials(database_manager, in_excerpts, True, methods, epsilons, index = index)
+    records += run_trials(database_manager, out_excerpts, False, methods, epsilons, index = index)
+    seconds = time.perf_counter() - start
+    results = []
+    for method in methods:
+        for epsilon in (epsilons[method] if method != database_manager.CONSTELLATION_METHOD else [None]):
+            for length in lengths:
+                selected = [record for record in records if record["method"] == method and record["epsilon"] == epsilon and record["length"] == length]
+                results.append(dict({"method": method, "epsilon": epsilon, "length": length}, **summarize(selected)))
+    report = {
+        "settings": {"seed": seed, "in_database": list(in_database_dirs), "not_in_database": list(not_in_database_dirs), "methods": list(methods),
+                     "epsilons": epsilons, "lengths": list(lengths), "trials": trials, "backend": database_manager.backend.name,
+                     "index": sorted(index) if index else "sql"},
+        "seconds": seconds,
+        "results": results,
+    }
+    logger.info('Ran ' + str(len(records)) + ' trials in ' + str(round(seconds, 1)) + 's')
+    return(report)
+
+
+def parse_epsilons(specs):
+    """
+    Function reads epsilons given as method=value (e.g. five=10000), repeating a method to try several epsilons.
+
+    Inputs: specs (list of str)
+
+    Outputs: Dictionary of method -> list of epsilons
+    """
+    epsilons = {}
+    for spec in specs:
+        method, _, value = spec.partition("=")
+        if not value:
+            raise ValueError("Epsilons must be given as method=value, not " + spec)
+        epsilons.setdefault(method, []).append(float(value))
+    return(epsilons)
+
 
-# epsilon_one = 1e-06
+parser = argparse.ArgumentParser(description="Seeded accuracy and latency benchmark of song identification.")
+parser.add_argument("--seed", type=int, default=0, help = "Seed of the excerpts drawn")
+parser.add_argument("--in_database", nargs="+", default=["WAVs"], help = "Directories of songs that are in the database")
+parser.add_argument("--not_in_database", nargs="*", default=["Songs_not_in_database/WAVs"], help = "Directories of songs that are not in the database")
+parser.add_argument("--methods", nargs="+", choices = METHODS, default=["one", "five"], help = "Fingerprint methods: one, five and/or constellation")
+parser.add_argument("--epsilons", nargs="*", default=[], help = "Epsilons as method=value, e.g. one=1e-06 five=10000 five=25000")
+parser.add_argument("--lengths", type=int, nargs="+", default=[10, 15, 24], help = "Excerpt lengths in seconds")
+parser.add_argument("--trials", type=int, default=50, help = "Excerpts per length and corpus")
+parser.add_argument("--backend", choices = ["postgres", "sqlite"], help = "Storage backend (default: FREEZAM_BACKEND)")
+parser.add_argument("--sqlite_path", type=str, help = "SQLite file of the sqlite backend")
+parser.add_argument("--dsn", type=str, help = "Connection string of the postgres backend")
+parser.add_argument("--ingest", action="store_true", help = "Add the in-database directories to the backend first (add_dir)")
+parser.add_argument("--index", choices = ["sql", "memory"], default = "sql", help = "Search in the backend (sql) or in an in-process KD-tree (memory)")
+parser.add_argument("--output", type=str, default="sensitivity_results.json", help = "JSON file the results are written to")
 
-# print(test_songs_in_database(N = 50,method = "one", epsilon = epsilon_one, source = "local"))
-# print(test_songs_not_in_database(N = 50,method = "one", epsilon = epsilon_one, source = "local"))
 
+def main():
+    """Function runs the benchmark from the command line and writes its results."""
+    results = parser.parse_args()
+    database_manager = use_backend(results.backend, path = results.sqlite_path, dsn = results.dsn)
+    if results.ingest:
+        for directory in results.in_database:
+            database_manager.add_dir(directory)
+    index = None
+    if results.index == "memory":
+        index = {method: database_manager.build_index(method) for method in results.methods if method != database_manager.CONSTELLATION_METHOD}
+    report = run_benchmark(database_manager, results.in_database, results.not_in_database, results.methods, parse_epsilons(results.epsilons),
+                           results.lengths, results.trials, seed = results.seed, index = index)
+    with open(results.output, "w") as f:
+        json.dump(report, f, indent = 2)
+    for result in report["results"]:
+        print(result["method"] + " (epsilon " + str(result["epsilon"]) + ", " + str(result["length"]) + "s): precision " + str(result["precision"]) +
+              ", recall " + str(result["recall"]) + ", p50 " + str(result["latency_ms"]["p50"]) + "ms, p99 " + str(result["latency_ms"]["p99"]) + "ms")
+    print("Results written to " + results.output)
 
-epsilon_five = 10000
 
-print(test_songs_in_database(N = 50,method = "five", epsilon = epsilon_five, source = "local"))
-print(test_songs_not_in_database(N = 50,method = "five", epsilon = epsilon_five, source = "local"))
+if __name__ == '__main__':
+    main()
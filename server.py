@@ -0,0 +1,281 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 18, 2020
+### Use: Long-running search server which keeps imports, the database connection and the catalog indexes warm
+#########################################
+
+## NOTE: To run, use: python freezam.py serve --port=8080 --methods five constellation
+## Then, for example:
+#  curl http://127.0.0.1:8080/list
+#  curl -X POST --data-binary @snippets/jarofhearts_snippet.wav -H "Content-Type: audio/wav" "http://127.0.0.1:8080/identify?method=five&epsilon=50000"
+#  curl -X POST -d '{"path": "snippets/jarofhearts_snippet.wav", "method": "constellation"}' http://127.0.0.1:8080/identify
+#  curl -X POST -d '{"path": "WAVs/betty_Taylor Swift_folklore_2020.wav", "title": "betty", "artist": "Taylor Swift", "album": "folklore", "date": "2020"}' http://127.0.0.1:8080/add
+
+import io
+import json
+import time
+import threading
+import logging
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from scipy.io import wavfile
+
+import spectral_analysis
+import database_manager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def warm_up(methods):
+    """
+    Function runs every method once on a few seconds of noise, so imports, FFT plans and caches are ready before the first request.
+
+    Inputs: methods (iterable of str, one, five or constellation)
+
+    Outputs: None
+    """
+    samplerate = 44100
+    series = np.random.RandomState(0).randn(samplerate*6).astype(np.float32)
+    fingerprint_methods = tuple(method for method in methods if method != database_manager.CONSTELLATION_METHOD)
+    if fingerprint_methods:
+        spectral_analysis.compute_fingerprints(series, samplerate, methods = fingerprint_methods)
+    if database_manager.CONSTELLATION_METHOD in methods:
+        spectral_analysis.constellation_hashes(series)
+    logger.info('Warmed up ' + str(list(methods)))
+
+
+def make_state(methods = ("five",), index = "memory"):
+    """
+    Function sets up what the server keeps between requests: the lock serializing database calls
+    (one connection is shared by every request) and, with index="memory", a KD-tree per fingerprint method.
+
+    Inputs: methods (iterable of str, methods to warm up and index)
+            index (str, memory or sql)
+
+    Outputs: state (dictionary)
+    """
+    for method in methods:
+        check_method(method)
+    warm_up(methods)
+    state = {
+        "lock": threading.Lock(),
+        "index_methods": [method for method in methods if index == "memory" and method != database_manager.CONSTELLATION_METHOD],
+        "indexes": {},
+        "started": time.time(),
+        "requests": 0,
+    }
+    for method in state["index_methods"]:
+        index_for(state, method)
+    return(state)
+
+
+def index_for(state, method):
+    """
+    Function returns the in-memory index of a method, building it if there is none (at startup, or after songs were added).
+
+    Inputs: state (dictionary, from make_state)
+            method (str)
+
+    Outputs: index (dictionary from database_manager.build_index), or None if the method isn't indexed in memory
+    """
+    if method not in state["index_methods"]:
+        return(None)
+    index = state["indexes"].get(method)
+    if index is None:
+        with state["lock"]:
+            index = state["indexes"].get(method)
+            if index is None:
+                index = state["indexes"][method] = database_manager.build_index(method)
+    return(index)
+
+
+def check_method(method):
+    """
+    Function refuses a method the database can't be searched with (only the stored fingerprints and the constellation hashes can).
+
+    Inputs: method (str)
+
+    Outputs: None, raises a ValueError (a 400 reply) for any other method
+    """
+    if method not in database_manager.SEARCH_METHODS:
+        raise ValueError("Unknown method " + str(method) + ", use one of " + ", ".join(database_manager.SEARCH_METHODS))
+
+
+def read_audio(body):
+    """
+    Function decodes the WAV sent in a request body.
+
+    Inputs: body (bytes)
+
+    Outputs: samplerate (integer) and series (numpy.ndarray, mono float32)
+    """
+    samplerate, data = wavfile.read(io.BytesIO(body))
+    return([samplerate, spectral_analysis.to_mono(data)])
+
+
+def identify_series(state, series, samplerate, method, epsilon = None):
+    """
+    Function identifies a snippet. Fingerprinting and in-memory index lookups run concurrently; only database calls take the lock.
+
+    Inputs: state (dictionary, from make_state)
+            series (numpy.ndarray), samplerate (integer)
+            method (str, one, five or constellation)
+            epsilon (float, needed by every method but constellation)
+
+    Outputs: Dictionary, see database_manager.identify_matches and identify_hashes
+    """
+    check_method(method)
+    if method == database_manager.CONSTELLATION_METHOD:
+        hashes, anchor_times = spectral_analysis.constellation_hashes(series)
+        with state["lock"]:
+            return(database_manager.identify_hashes(hashes, anchor_times))
+    if epsilon is None:
+        raise ValueError("epsilon is required for method " + method)
+    fingerprints = spectral_analysis.compute_fingerprints(series, samplerate, methods = (method,))[method]
+    index = index_for(state, method)
+    if index is not None:
+        matches = database_manager.nearest_fingerprints(fingerprints, method, index = index)
+    else:
+        with state["lock"]:
+            matches = database_manager.nearest_fingerprints(fingerprints, method)
+    return(database_manager.identify_matches(matches, len(fingerprints), float(epsilon)))
+
+
+def add_song(state, request):
+    """
+    Function adds a song (a local WAV) to the database. The song is fingerprinted outside the lock, and the in-memory indexes
+    are rebuilt on their next use.
+
+    Inputs: state (dictionary, from make_state)
+            request (dictionary with path, title, artist, album, date and optionally source)
+
+    Outputs: Dictionary with the song_id and whether it was inserted (rather than updated)
+    """
+    # a missing detail is a bad request (400), not a database error after the song was fingerprinted
+    missing = [field for field in ["path", "title", "artist", "album", "date"] if not request.get(field)]
+    if missing:
+        raise ValueError("Adding a song needs " + ", ".join(missing))
+    song = spectral_analysis.fingerprint_file(request["path"])
+    with state["lock"]:
+        song_id, inserted, _ = database_manager.write_song(request["title"], request["artist"], request["album"], request["path"],
+                                                           date = request["date"], source = request.get("source", "local"), **song)
+        state["indexes"].clear()
+    return({"song_id": int(song_id), "inserted": bool(inserted), "fingerprints": int(len(song["fingerprints1"]))})
+
+
+def list_songs(state):
+    """
+    Function lists every song in the database.
+
+    Inputs: state (dictionary, from make_state)
+
+    Outputs: List of dictionaries (song_id, title, artist, album, path, sample_rate, date, source)
+    """
+    columns = ["song_id", "title", "artist", "album", "path", "sample_rate", "date", "source"]
+    with state["lock"]:
+        songs = database_manager.backend.list_songs()
+    return([dict(zip(columns, [value if isinstance(value, (int, float, str, type(None))) else str(value) for value in song])) for song in songs])
+
+
+class FreezamHandler(BaseHTTPRequestHandler):
+    """
+    Request handler: GET /list and /health, POST /identify and /add. Replies are JSON, and connections are kept alive.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def handle_request(self, handler):
+        start = time.perf_counter()
+        url = urllib.parse.urlparse(self.path)
+        try:
+            status, payload = handler(url.path, dict(urllib.parse.parse_qsl(url.query)))
+        except (ValueError, KeyError, OSError, AssertionError) as error:
+            status, payload = 400, {"error": repr(error)}
+        except Exception as error:
+            logger.exception('Request ' + self.path + ' failed')
+            status, payload = 500, {"error": repr(error)}
+        if isinstance(payload, dict):
+            payload["seconds"] = time.perf_counter() - start
+        # handlers run on their own threads, so the count is only changed under the lock
+        with self.server.state["lock"]:
+            self.server.state["requests"] += 1
+        self.send_json(status, payload)
+
+    def do_GET(self):
+        self.handle_request(self.get)
+
+    def do_POST(self):
+        self.handle_request(self.post)
+
+    def get(self, path, query):
+        state = self.server.state
+        if path == "/list":
+            return([200, {"songs": list_songs(state)}])
+        if path == "/health":
+            return([200, {"uptime": time.time() - state["started"], "requests": state["requests"], "indexes": sorted(state["indexes"])}])
+        return([404, {"error": "Unknown path " + path}])
+
+    def post(self, path, query):
+        state = self.server.state
+        body = self.read_body()
+        if path == "/identify":
+            if self.headers.get("Content-Type", "").startswith("audio/"):
+                samplerate, series = read_audio(body)
+            else:
+                query = dict(query, **json.loads(body or b"{}"))
+                samplerate, series = spectral_analysis.analyze_song(query["path"])
+            result = identify_series(state, series, samplerate, query.get("method", "five"), query.get("epsilon"))
+            result["message"] = database_manager.describe_match(result)
+            return([200, result])
+        if path == "/add":
+            return([200, add_song(state, json.loads(body or b"{}"))])
+        return([404, {"error": "Unknown path " + path}])
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def make_server(host = "127.0.0.1", port = 8080, methods = ("five",), index = "memory"):
+    """
+    Function creates the server (one thread per connection) with its warm state. Use port 0 to pick a free port.
+
+    Inputs: host (str), port (integer)
+            methods (iterable of str, methods to warm up and index)
+            index (str, memory or sql)
+
+    Outputs: server (ThreadingHTTPServer, see server.server_address for the port)
+    """
+    httpd = ThreadingHTTPServer((host, port), FreezamHandler)
+    httpd.daemon_threads = True
+    httpd.state = make_state(methods = methods, index = index)
+    return(httpd)
+
+
+def serve(host = "127.0.0.1", port = 8080, methods = ("five",), index = "memory"):
+    """
+    Function runs the server until it is interrupted (Ctrl+C).
+
+    Inputs: see make_server
+
+    Outputs: None
+    """
+    httpd = make_server(host = host, port = port, methods = methods, index = index)
+    print("Freezam is listening on http://" + str(httpd.server_address[0]) + ":" + str(httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
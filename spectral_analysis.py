@@ -5,49 +5,124 @@
 #########################################
 
 import os
-import wave
-from pydub import AudioSegment
-from scipy import signal
+import hashlib
+from scipy import fft
+from scipy import ndimage
 from scipy.io import wavfile
-import matplotlib.pyplot as plt
-import matplotlib
 import numpy as np
 import sys
 import logging
-from skimage import util
 from scipy.spatial import distance
-from pandas import DataFrame
-from pandas import Series
-from sklearn import preprocessing
-import sounddevice as sd
 import time
+import fingerprint_cache
+import profiling
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 logger.info('Started')
 
+# Decimate each method's audio to the lowest rate that still holds the band its fingerprint reads (FREEZAM_DECIMATE=on or freezam.py --decimate)
+DECIMATE = os.environ.get("FREEZAM_DECIMATE", "off").lower() in ("1", "on", "true", "yes")
+
+
+def _read_wav(path):
+    """
+    Function memory-maps a WAV so samples are only read from disk when they are sliced.
+
+    Inputs: Path to WAV file (string)
+
+    Outputs: The samplerate (integer) and the raw samples (numpy.ndarray or numpy.memmap, frames x channels)
+    """
+    name,ext = os.path.splitext(path)
+    assert ext == ".wav", "Must input a .wav!"
+    try:
+        return(wavfile.read(path, mmap = True))
+    except ValueError:
+        # scipy can't memory-map every WAV flavour (e.g. 24-bit PCM), read those in full
+        return(wavfile.read(path))
+
+
+def to_mono(data, dtype = np.float32, block_size = 2**20):
+    """
+    Function downmixes samples to mono by averaging the channels, a block of frames at a time, so the
+    only full-length array created is the mono output.
+
+    Inputs: data (numpy.ndarray, frames or frames x channels)
+            dtype (numpy dtype of the output, float32 is exact for 16-bit stereo)
+            block_size (integer, number of frames downmixed at once)
+
+    Outputs: series data (numpy.ndarray)
+    """
+    if len(data.shape) == 1:
+        return(np.array(data, dtype = dtype))
+    series_results = np.empty(data.shape[0], dtype = dtype)
+    # Sums of 8- and 16-bit samples are exact, so adding up the channels one at a time gives np.mean's result, several times faster
+    exact_sum = data.dtype.kind in "iu" and data.dtype.itemsize <= 2
+    for start in range(0, data.shape[0], block_size):
+        block, out = data[start:start + block_size], series_results[start:start + block_size]
+        if not exact_sum:
+            np.mean(block, axis = 1, dtype = dtype, out = out)
+            continue
+        out[...] = block[:, 0]
+        for channel in range(1, data.shape[1]):
+            out += block[:, channel]
+        np.true_divide(out, data.shape[1], out = out)
+    return(series_results)
+
+
+@profiling.timed()
+def song_info(path):
+    """
+    Function returns the samplerate and length of a WAV without decoding its samples.
+
+    Inputs: Path to WAV file (string)
+
+    Outputs: The samplerate (integer) and the number of samples (integer)
+    """
+    samplerate, data = _read_wav(path)
+    return([samplerate, int(data.shape[0])])
+
 
 #Function which reads in WAV and returns time series
-def analyze_song(path):
+@profiling.timed()
+def analyze_song(path, offset = 0, length = None, dtype = np.float32):
     """
     Function reads in a WAV, processes it, and returns a series.
+    The WAV is memory-mapped, so reading an excerpt only touches the samples in that excerpt.
 
     Inputs: Path to WAV file (string)
+            offset (integer, first sample to read, default is the start of the song)
+            length (integer, number of samples to read, default is the rest of the song)
+            dtype (numpy dtype of the series, default float32)
 
     Outputs: The samplerate (integer) and series data (numpy.ndarray) of the WAV file
     """
-    name,ext = os.path.splitext(path)
-    assert ext == ".wav", "Must input a .wav!"
-    samplerate, data = wavfile.read(path)
+    samplerate, data = _read_wav(path)
+    end = data.shape[0] if length is None else min(offset + length, data.shape[0])
     #Convert to mono
-    if len(data.shape) > 1:
-        series_results = np.mean(data,axis=1) 
-    else:
-        series_results = np.array(data)      
+    series_results = to_mono(data[offset:end], dtype = dtype)
+    del data
     logger.info('Read in WAV, returned series') 
     return([samplerate, series_results])
 
 
+@profiling.timed()
+def content_hash(series, samplerate):
+    """
+    Function computes the identity of a song from its decoded audio, so the same audio gets the same hash whatever the file is called.
+
+    Inputs: series data (numpy.ndarray, from analyze_song, or the frames x channels samples of a WAV, which are downmixed a block at a time)
+            samplerate (integer)
+
+    Outputs: sha256 hex digest (string)
+    """
+    digest = hashlib.sha256(str(int(samplerate)).encode())
+    # hashed a block at a time, which gives the digest of the whole mono float32 series
+    for start in range(0, len(series), 2**20):
+        digest.update(to_mono(series[start:start + 2**20]).data)
+    return(digest.hexdigest())
+
+
 def record_song(length = 15):
     """
     Function allows user to record audio for specified time period (> 5 seconds, < 23 seconds!)
@@ -57,6 +132,8 @@ def record_song(length = 15):
     Outputs: The samplerate (integer) and series data (numpy.ndarray) of the WAV recording
     """
     #assert length > 10 and length < 30, "Length cannot be too short or too long!"
+    # sounddevice loads the audio drivers, so it is only imported when recording
+    import sounddevice as sd
     samplerate = 44100  
     seconds = length
     logger.info("Starting recording now!") 
@@ -72,17 +149,37 @@ def record_song(length = 15):
     sd.wait()
     logger.info("Just finished recording!") 
     wavfile.write("temp/output.wav", samplerate, data)
-    if len(data.shape) > 1:
-        series_results = np.mean(data,axis=1) 
-    else:
-        series_results = np.array(data)      
-    series_results_final = series_results
+    series_results_final = to_mono(data)
     logger.info('Recorded audio, returned series') 
     return([samplerate, series_results_final])
 
 
    
 
+# Weights of the cosine windows used for spectral analysis (w = alpha - (1 - alpha)*cos)
+WINDOW_ALPHAS = {"hamming": .54, "hann": .5}
+
+
+def periodic_window(name, length):
+    """
+    Function returns a periodic Hamming or Hann window, the same values as scipy.signal.get_window(name, length),
+    computed with numpy so scipy.signal (slow to import) isn't needed.
+
+    Inputs: name (str, hamming or hann)
+            length (integer, samples)
+
+    Outputs: window (numpy.ndarray, float64)
+    """
+    alpha = WINDOW_ALPHAS[name]
+    # scipy builds the symmetric window one sample longer and drops its last sample, in this order of operations
+    fac = np.linspace(-np.pi, np.pi, length + 1)
+    window = np.zeros(length + 1)
+    window += alpha*np.cos(0*fac)
+    window += (1 - alpha)*np.cos(fac)
+    return(window[:-1])
+
+
+@profiling.timed()
 def get_window(series, sample_rate, h = 5, delta = 1):
     """
     Function reads in a series (from analyze_song), and returns the windowing of the function.
@@ -97,13 +194,190 @@ def get_window(series, sample_rate, h = 5, delta = 1):
 
     #song_in_seconds = len(series)/sample_rate
     #window_centers = np.arange(start=0, stop=song_in_seconds,step=1)
-    hamming_window = signal.get_window("hamming", h*sample_rate)
-    window_signals = util.view_as_windows(series, window_shape=(h*sample_rate,), step=delta*sample_rate)
+    hamming_window = periodic_window("hamming", h*sample_rate)
+    window_signals = np.lib.stride_tricks.sliding_window_view(series, h*sample_rate)[::delta*sample_rate]
     windowed_results = np.multiply(hamming_window, window_signals)
     logger.info('Got windows of series')
     return(windowed_results)
 
 
+def _frames(series, length, hop, start, stop):
+    """
+    Function returns frames start to stop of a series (length samples every hop samples) as a strided view. Samples with channels
+    (e.g. a memory-mapped WAV) are downmixed to mono (see to_mono) for just the samples these frames cover.
+
+    Inputs: series (numpy.ndarray, mono, or frames x channels)
+            length, hop (integers, samples)
+            start, stop (integers, first frame and one past the last frame)
+
+    Outputs: frames (2-D numpy.ndarray, one frame per row)
+    """
+    samples = series[start*hop:(stop - 1)*hop + length]
+    if samples.ndim > 1:
+        samples = to_mono(samples)
+    return(np.lib.stride_tricks.sliding_window_view(samples, length)[::hop])
+
+
+def iter_windows(series, sample_rate, h = 5, delta = 1, block_size = 16, dtype = np.float64):
+    """
+    Function yields the Hamming-weighted windows of a series a block at a time, so only block_size windows exist in memory at once.
+    A WAV's samples can be given as they are (frames x channels, e.g. memory-mapped): each block is downmixed on its own,
+    so the whole song is never held as one mono array.
+
+    Inputs: Series of WAV file (numpy.ndarray, mono, or frames x channels), 
+            Sample_rate (integer), 
+            h (integer meant to represent window length, default is 5s), 
+            delta (integer meant to represent window size, default is 1s)
+            block_size (integer, number of windows per block)
+            dtype (numpy dtype of the weighted windows)
+
+    Outputs: Generator of (index of the first window in the block (integer), weighted windows (2-D numpy.ndarray))
+    """
+    hamming_window = periodic_window("hamming", h*sample_rate).astype(dtype)
+    windows = max(0, (len(series) - h*sample_rate)//(delta*sample_rate) + 1)
+    # _frames only builds a strided view, the copy happens per block below
+    for start in range(0, windows, block_size):
+        window_signals = _frames(series, h*sample_rate, delta*sample_rate, start, min(start + block_size, windows))
+        yield(start, np.multiply(hamming_window, window_signals, dtype = dtype))
+
+
+def iter_periodograms(series, sample_rate, h = 5, delta = 1, block_size = 16, dtype = np.float64):
+    """
+    Function yields the periodograms of a series a block of windows at a time (see iter_windows).
+
+    Inputs: Series of WAV file (numpy.ndarray), 
+            Sample_rate (integer), 
+            h (integer meant to represent window length, default is 5s), 
+            delta (integer meant to represent window size, default is 1s)
+            block_size (integer, number of windows per block)
+            dtype (numpy.float64 or numpy.float32)
+
+    Outputs: Generator of (index of the first window in the block (integer), frequencies (numpy.ndarray), power_densities (2-D numpy.ndarray))
+    """
+    for start, windows in iter_windows(series, sample_rate, h = h, delta = delta, block_size = block_size, dtype = dtype):
+        freq, power_densities = get_periodogram_batch(windows, sample_rate, dtype = dtype)
+        del windows
+        yield(start, freq, power_densities)
+
+
+def method_band(method, h = 5):
+    """
+    Function returns the highest frequency a fingerprint method reads: fingerprint_two keeps the bins up to 2 kHz, and
+    fingerprint_five the octave bands, which end at bin 2500 (500 Hz for 5-second windows). Method one divides by the highest
+    peak of the whole spectrum, so it needs every frequency.
+
+    Inputs: method (str, one, two or five)
+            h (integer, window length in seconds, which sets the width of a bin)
+
+    Outputs: frequency in Hz (float), or None if the method needs the whole spectrum
+    """
+    if method == "two":
+        return(2000.0)
+    if method == "five":
+        return(min(5000.0, octave_bands()[-1][1]/h))
+    return(None)
+
+
+def decimation_factor(sample_rate, method, h = 5, margin = 1.25):
+    """
+    Function picks how much a method's audio can be decimated: the largest integer factor of the sample rate which keeps the
+    new Nyquist frequency margin times above the method's band, so the band stays clear of the anti-aliasing filter's roll-off.
+
+    Inputs: sample_rate (integer)
+            method (str, one, two or five)
+            h (integer, window length in seconds)
+            margin (float, Nyquist frequency over band)
+
+    Outputs: factor (integer, 1 means no decimation)
+    """
+    band = method_band(method, h = h)
+    if band is None:
+        return(1)
+    factor = max(1, int(sample_rate/(2*margin*band)))
+    while sample_rate % factor:
+        factor -= 1
+    return(factor)
+
+
+@profiling.timed()
+def decimate_series(series, sample_rate, factor):
+    """
+    Function downsamples a series by an integer factor with a polyphase anti-aliasing filter (scipy.signal.resample_poly).
+    Amplitudes are kept, so the periodogram of a window (which is normalised by its length) keeps its power in the band left.
+
+    Inputs: series (numpy.ndarray), sample_rate (integer)
+            factor (integer, from decimation_factor)
+
+    Outputs: The new samplerate (integer) and series (numpy.ndarray, same dtype)
+    """
+    if factor == 1:
+        return([sample_rate, series])
+    # scipy.signal is slow to import, so it is only imported when decimating
+    from scipy import signal
+    return([sample_rate//factor, signal.resample_poly(series, 1, factor).astype(series.dtype, copy = False)])
+
+
+def _fingerprint_params(method, sample_rate, h, delta, decimate):
+    # Decimated fingerprints are cached apart from full-rate ones, and full-rate entries keep their old keys
+    factor = decimation_factor(sample_rate, method, h = h) if decimate else 1
+    if factor == 1:
+        return([factor, {"h": h, "delta": delta}])
+    return([factor, {"h": h, "delta": delta, "rate": sample_rate//factor}])
+
+
+@profiling.timed()
+def compute_fingerprints(series, sample_rate, methods = ("one", "five"), h = 5, delta = 1, block_size = 16, song_hash = None, decimate = None):
+    """
+    Function computes the fingerprints of a series with bounded memory: windows and periodograms are produced
+    block_size windows at a time and only the (small) fingerprints are kept.
+    If the content hash of the series is given, fingerprints are read from (and written to) the fingerprint cache.
+    With decimation, methods two and five are computed from the series downsampled to the lowest rate that holds their band
+    (see decimation_factor), so their windows and FFTs are many times smaller; method one always uses the full rate.
+
+    Inputs: Series of WAV file (numpy.ndarray, mono, or frames x channels, see iter_windows), 
+            Sample_rate (integer), 
+            methods (iterable of fingerprint methods, any of "one", "two" or "five")
+            h (integer meant to represent window length, default is 5s), 
+            delta (integer meant to represent window size, default is 1s)
+            block_size (integer, number of windows per block)
+            song_hash (string, content_hash of the series, optional)
+            decimate (boolean, default FREEZAM_DECIMATE)
+
+    Outputs: Dictionary of method -> fingerprints (numpy.ndarray, one row per window)
+    """
+    decimate = DECIMATE if decimate is None else decimate
+    fingerprints = {}
+    groups = {}
+    for method in methods:
+        factor, params = _fingerprint_params(method, sample_rate, h, delta, decimate)
+        cached = fingerprint_cache.load(song_hash, method, **params)
+        if cached is not None:
+            fingerprints[method] = cached["fingerprints"]
+        else:
+            groups.setdefault(factor, []).append(method)
+    if not groups:
+        logger.info('Read fingerprints from the cache')
+        return(fingerprints)
+    # Decimation can round the length up by a sample, which must not add a window
+    windows = (len(series) - h*sample_rate)//(delta*sample_rate) + 1
+    for factor, missing in groups.items():
+        # resample_poly needs the whole series, so a WAV's samples are only downmixed in full to be decimated
+        mono = to_mono(series) if factor > 1 and (np.ndim(series) > 1 or series.dtype.kind in "iu") else series
+        rate, rate_series = decimate_series(mono, sample_rate, factor)
+        del mono
+        blocks = {method: [] for method in missing}
+        for _, freq, power_densities in iter_periodograms(rate_series, rate, h = h, delta = delta, block_size = block_size):
+            for method in missing:
+                blocks[method].append(np.asarray(FINGERPRINT_METHODS[method](power_densities, freq), dtype = np.float64))
+        del rate_series
+        for method in missing:
+            fingerprints[method] = np.concatenate(blocks[method])[:windows]
+            fingerprint_cache.store(song_hash, method, {"fingerprints": fingerprints[method]}, **_fingerprint_params(method, sample_rate, h, delta, decimate)[1])
+    logger.info('Computed fingerprints in blocks of ' + str(block_size) + ' windows')
+    return({method: fingerprints[method] for method in methods})
+
+
+@profiling.timed()
 def get_periodogram(series,windows,sampling_rate,h,delta):
     """
     Function reads in a window (from get_window), windows the function, and returns the periodogram.
@@ -113,18 +387,46 @@ def get_periodogram(series,windows,sampling_rate,h,delta):
             h (integer meant to represent window length, default is 5s), 
             delta (integer meant to represent window size, default is 1s)
 
-    Outputs: frequencies (list of frequencies for each window)
-             power_densities (list of power_densities for each window)
-    """
-    # Analyze each window piece
-    frequencies =[]
-    power_densities =[]
-    for window in windows:
-        sample_freq, power_density = signal.periodogram(x = window, fs = sampling_rate, scaling="spectrum")
-        frequencies.append(sample_freq)
-        power_densities.append(power_density)
-    logger.info('Computed periodogram of series')    
+    Outputs: frequencies (frequencies for each window, a read-only view of the shared frequency vector)
+             power_densities (power_densities for each window, 2-D numpy.ndarray)
+    """
+    freq, power_densities = get_periodogram_batch(windows, sampling_rate)
+    frequencies = np.broadcast_to(freq, power_densities.shape)
     return(frequencies,power_densities)
+
+
+@profiling.timed()
+def get_periodogram_batch(windows, sampling_rate, dtype = np.float64, workers = -1):
+    """
+    Function computes the periodogram of every window at once with a multi-threaded real FFT.
+    Gives the same numbers as signal.periodogram(window, fs, scaling="spectrum") applied to each window.
+
+    Inputs: windows (2-D numpy.ndarray, one window per row, from get_window)
+            sampling_rate (integer)
+            dtype (numpy.float64 or numpy.float32, precision of the FFT and of the output)
+            workers (integer, number of FFT threads, -1 uses every core)
+
+    Outputs: freq (numpy.ndarray, frequencies shared by every window)
+             power_densities (2-D numpy.ndarray, one periodogram per row)
+    """
+    windows = np.atleast_2d(np.asarray(windows, dtype = dtype))
+    n = windows.shape[1]
+    # periodogram() detrends each window by its mean before the FFT
+    detrended = windows - windows.mean(axis = 1, keepdims = True)
+    spectrum = fft.rfft(detrended, axis = 1, workers = workers)
+    del detrended
+    power_densities = np.square(spectrum.real, dtype = dtype)
+    power_densities += np.square(spectrum.imag, dtype = dtype)
+    del spectrum
+    power_densities /= np.asarray(n, dtype = dtype)**2
+    # one-sided spectrum: double everything except DC (and Nyquist when n is even)
+    if n % 2 == 0:
+        power_densities[:, 1:-1] *= 2
+    else:
+        power_densities[:, 1:] *= 2
+    freq = fft.rfftfreq(n, d = 1.0/sampling_rate)
+    logger.info('Computed periodogram of series')
+    return(freq, power_densities)
  
 
 def plot_spectrogram(series,sampling_rate):
@@ -136,6 +438,7 @@ def plot_spectrogram(series,sampling_rate):
             
     Outputs: Plot of a spectrogram
     """
+    import matplotlib.pyplot as plt
     plt.specgram(series, Fs=sampling_rate, cmap="gist_rainbow")
     plt.xlabel("Time [s]")
     plt.ylabel("Frequency [Hz]")
@@ -152,6 +455,7 @@ def plot_spectrogram_file(filepath):
             
     Outputs: Plot of a spectrogram
     """
+    import matplotlib.pyplot as plt
     sampling_rate,series = analyze_song(filepath)
     plt.specgram(x = series, Fs=sampling_rate, cmap="gist_rainbow")
     plt.xlabel("Time [s]")
@@ -161,116 +465,487 @@ def plot_spectrogram_file(filepath):
     logger.info('Plotted spectrogram of series')    
 
 
+def shared_frequencies(freq):
+    """
+    Function returns the one frequency vector shared by every window.
+
+    Inputs: freq (frequencies, either one vector or one row/list per window)
+
+    Outputs: frequencies (1-D numpy.ndarray)
+    """
+    freq = np.asarray(freq)
+    if freq.ndim > 1:
+        freq = freq[0]
+    return(freq)
+
+
+def octave_bands(num_octaves = 8):
+    """
+    Function returns the index ranges of the octaves used by fingerprint_five.
+
+    Inputs: num_octaves (integer)
+
+    Outputs: List of (start index, end index) for each octave
+    """
+    bands = []
+    for octave_iter in range(num_octaves):
+        start_freq = round(2**(-(num_octaves - octave_iter))*5000/2)
+        end_freq = round(2**(-(num_octaves - octave_iter)+1)*5000/2)
+        bands.append((start_freq, end_freq))
+    return(bands)
+
+
+def find_peaks_matrix(power_density):
+    """
+    Function finds the peaks of every window at once. Gives the same peaks as signal.find_peaks run on each window.
+
+    Inputs: power_density (2-D numpy.ndarray, one window per row)
+
+    Outputs: is_peak (2-D boolean numpy.ndarray, True where a window has a peak)
+    """
+    is_peak = np.zeros(power_density.shape, dtype = bool)
+    middle = power_density[:, 1:-1]
+    is_peak[:, 1:-1] = (middle > power_density[:, :-2]) & (middle > power_density[:, 2:])
+    # find_peaks also reports the middle of flat peaks, so windows with equal neighbouring values are handed to it
+    for index1 in np.flatnonzero(np.any(power_density[:, 1:] == power_density[:, :-1], axis = 1)):
+        from scipy import signal
+        is_peak[index1] = False
+        is_peak[index1, signal.find_peaks(power_density[index1])[0]] = True
+    return(is_peak)
+
+
+@profiling.timed()
 def fingerprint_one(power_density,freq):
     """
     Function computes the fingerprints of an audio file using technique 4 in Shazam.pdf (frequencies which periodogram has peak)
     
-    Inputs: power_density (list of power_densities for each window)
-            freq (list of frequencies for each window)
-
-    Outputs: finger1 (list of fingerprints for each window)
-    """
-    finger1 = []
-    for index1 in range(int(len(power_density))):
-        freq2 = np.array(freq[index1])
-        peaks,_ = signal.find_peaks(power_density[index1])
-        if len(peaks >= 3):
-            freq_peaks = freq2[peaks]
-            max100 = np.argpartition(power_density[index1][peaks], -3)[-3:]
-            f1 = freq_peaks[max100]
-            max_f1 = max(freq_peaks)
-            f2 = np.true_divide(f1, max_f1)
-            finger1.append(f2)
-        else: 
-            f2 = (0,0,0)
-            finger1.append(f2)
+    Inputs: power_density (2-D numpy.ndarray or list of power_densities for each window)
+            freq (frequencies, shared or for each window)
+
+    Outputs: finger1 (numpy.ndarray, one fingerprint per row; the 3 highest peaks in increasing power, divided by the highest peak frequency)
+    """
+    power_density = np.atleast_2d(np.asarray(power_density))
+    freq = shared_frequencies(freq)
+    is_peak = find_peaks_matrix(power_density)
+    has_peaks = is_peak.sum(axis = 1) >= 3
+    finger1 = np.zeros((len(power_density), 3))
+    if has_peaks.any():
+        is_peak = is_peak[has_peaks]
+        peak_power = np.where(is_peak, power_density[has_peaks], -np.inf)
+        rows = np.arange(len(peak_power))
+        # three argmax passes are much cheaper than partitioning rows that are mostly -inf
+        max100 = np.empty((len(peak_power), 3), dtype = np.intp)
+        for rank in (2, 1, 0):
+            max100[:, rank] = np.argmax(peak_power, axis = 1)
+            peak_power[rows, max100[:, rank]] = -np.inf
+        last_peak = is_peak.shape[1] - 1 - np.argmax(is_peak[:, ::-1], axis = 1)
+        finger1[has_peaks] = np.true_divide(freq[max100], freq[last_peak][:, None])
     logger.info('Computed fingerprint method 1')    
     return(finger1) 
 
 
+@profiling.timed()
 def fingerprint_two(power_density,freq):
     """
     Function computes the fingerprints of an audio file using roughly technique 1 in Shazam.pdf (local periodograms, but truncates them and to 0.35 power)
     
-    Inputs: power_density (list of power_densities for each window)
-            freq (list of frequencies for each window)
+    Inputs: power_density (2-D numpy.ndarray or list of power_densities for each window)
+            freq (frequencies, shared or for each window)
 
-    Outputs: finger2 (list of fingerprints for each window)
+    Outputs: finger2 (numpy.ndarray, one fingerprint per row)
     """
-    finger2 = []
-    for index1 in range(int(len(power_density))):
-        pd_short = [j for (i,j) in zip(freq[index1],power_density[index1]) if i <= 2000]
-        pd_mod = [x**0.35 for x in pd_short]
-        finger2.append(pd_mod)
+    power_density = np.atleast_2d(np.asarray(power_density))
+    freq = shared_frequencies(freq)
+    finger2 = np.power(power_density[:, freq <= 2000], 0.35)
     logger.info('Computed fingerprint method 2')     
     return(finger2)   
 
 
+@profiling.timed()
 def fingerprint_five(power_density,freq):
     """
     Function computes the fingerprints of an audio file using roughly technique 5 in Shazam.pdf (max at octaves)
     
-    Inputs: power_density (list of power_densities for each window)
-            freq (list of frequencies for each window)
-
-    Outputs: finger5 (list of fingerprints for each window)
-    """
-    finger5 = []
-    num_octaves = 8
-    samplerate = len(power_density[1])
-    for index1 in range(int(len(power_density))):
-        pd_short = [j for (i,j) in zip(freq[index1],power_density[index1]) if i <= 5000]
-        #pd_short = power_density[index1]
-        finger5_octave = []
-        for octave_iter in range(num_octaves):
-            start_freq = round(2**(-(num_octaves - octave_iter))*5000/2)
-            end_freq = round(2**(-(num_octaves - octave_iter)+1)*5000/2)
-            pd_mod = pd_short[start_freq:end_freq]
-            max_pd_octave = max(pd_mod)
-            finger5_octave.append(max_pd_octave)
-        finger5.append(finger5_octave)    
+    Inputs: power_density (2-D numpy.ndarray or list of power_densities for each window)
+            freq (frequencies, shared or for each window)
+
+    Outputs: finger5 (numpy.ndarray, one fingerprint per row)
+    """
+    power_density = np.atleast_2d(np.asarray(power_density))
+    freq = shared_frequencies(freq)
+    pd_short = power_density[:, freq <= 5000]
+    bands = octave_bands(num_octaves = 8)
+    finger5 = np.empty((len(power_density), len(bands)), dtype = power_density.dtype)
+    for octave_iter, (start_freq, end_freq) in enumerate(bands):
+        finger5[:, octave_iter] = pd_short[:, start_freq:end_freq].max(axis = 1)
     logger.info('Computed fingerprint method 5')     
     return(finger5)         
 
 
-def match_fingerprints(snip_fingerprint,song_fingerprint):
+FINGERPRINT_METHODS = {"one": fingerprint_one, "two": fingerprint_two, "five": fingerprint_five}
+
+# Hashes pack (anchor frequency bin, target frequency bin, time delta in frames) into 10 + 10 + 6 bits
+HASH_FREQUENCY_BITS = 10
+HASH_DELTA_BITS = 6
+
+
+def constellation_peaks(series, frame_size = 2048, hop = 512, neighborhood = (15, 15), peaks_per_frame = 5, block_size = 1024):
+    """
+    Function finds the spectral peaks (the "constellation") of a series on a short-time spectrogram: the points which are the
+    largest in their time-frequency neighborhood and at least 10 dB above the median of the spectrogram.
+    The spectrogram is computed block_size frames at a time (with enough overlap for the neighborhood), so memory stays bounded.
+
+    Inputs: Series of WAV file (numpy.ndarray, mono, or frames x channels, which are downmixed a block at a time), 
+            frame_size (integer, samples per short-time frame, 2048 gives 1024 frequency bins)
+            hop (integer, samples between frames, small enough that a snippet cut anywhere still lines up with the song's frames)
+            neighborhood (tuple of integers, frames x frequency bins a peak must dominate)
+            peaks_per_frame (integer, strongest peaks kept in each frame)
+            block_size (integer, number of frames per block)
+
+    Outputs: times (numpy.ndarray, frame of each peak)
+             bins (numpy.ndarray, frequency bin of each peak), both sorted by time and then by decreasing power
+    """
+    series = np.asarray(series)
+    n_bins = 2**HASH_FREQUENCY_BITS
+    if len(series) < frame_size:
+        return([np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)])
+    hann_window = periodic_window("hann", frame_size)
+    num_frames = (len(series) - frame_size)//hop + 1
+    pad = neighborhood[0]//2
+    times, bins, powers = [], [], []
+    for start in range(0, num_frames, block_size):
+        low, high = max(start - pad, 0), min(start + block_size + pad, num_frames)
+        _, power_densities = get_periodogram_batch(_frames(series, frame_size, hop, low, high)*hann_window, 1, dtype = np.float32)
+        log_power = np.log10(power_densities[:, :n_bins] + 1e-10)
+        is_peak = (log_power == ndimage.maximum_filter(log_power, size = neighborhood, mode = "constant", cval = -np.inf))
+        is_peak &= log_power > np.median(log_power) + 1
+        # only keep the peaks of this block's own frames, the padding belongs to its neighbors
+        is_peak[:start - low] = False
+        is_peak[start - low + block_size:] = False
+        frame_index, bin_index = np.nonzero(is_peak)
+        times.append(frame_index + low)
+        bins.append(bin_index)
+        powers.append(log_power[frame_index, bin_index])
+    times, bins, powers = np.concatenate(times), np.concatenate(bins), np.concatenate(powers)
+    order = np.lexsort((-powers, times))
+    times, bins = times[order], bins[order]
+    # rank of each peak within its frame
+    frame_starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+    rank = np.arange(len(times)) - np.repeat(frame_starts, np.diff(np.r_[frame_starts, len(times)]))
+    keep = rank < peaks_per_frame
+    logger.info('Found ' + str(int(keep.sum())) + ' constellation peaks')
+    return([times[keep].astype(np.int64), bins[keep].astype(np.int64)])
+
+
+@profiling.timed()
+def constellation_hashes(series, fan_out = 10, frame_size = 2048, hop = 512, block_size = 1024):
+    """
+    Function computes the constellation fingerprint of a series: every peak (the anchor) is paired with the next fan_out peaks
+    after it, and each pair becomes one integer hash of (anchor frequency, target frequency, time delta). Hashes are matched
+    exactly, so a song can be found with an index lookup instead of a nearest-neighbor search.
+
+    Inputs: Series of WAV file (numpy.ndarray), 
+            fan_out (integer, targets paired with each anchor)
+            frame_size, hop, block_size (integers, see constellation_peaks)
+
+    Outputs: hashes (numpy.ndarray of int32)
+             anchor_times (numpy.ndarray of int32, frame of the anchor of each hash)
+    """
+    times, bins = constellation_peaks(series, frame_size = frame_size, hop = hop, block_size = block_size)
+    max_delta = 2**HASH_DELTA_BITS - 1
+    hashes, anchor_times = [], []
+    for k in range(1, fan_out + 1):
+        anchors = np.arange(len(times) - k)
+        delta = times[anchors + k] - times[anchors]
+        # peaks in the same frame carry no timing information, and deltas must fit in their bits
+        valid = (delta >= 1) & (delta <= max_delta)
+        anchors = anchors[valid]
+        hashes.append((bins[anchors] << (HASH_FREQUENCY_BITS + HASH_DELTA_BITS)) | (bins[anchors + k] << HASH_DELTA_BITS) | delta[valid])
+        anchor_times.append(times[anchors])
+    hashes, anchor_times = np.concatenate(hashes).astype(np.int32), np.concatenate(anchor_times).astype(np.int32)
+    order = np.argsort(anchor_times, kind = "stable")
+    logger.info('Computed ' + str(len(hashes)) + ' constellation hashes')
+    return([hashes[order], anchor_times[order]])
+
+
+@profiling.timed()
+def cached_analysis(path, methods = ("one",), hashes = False, h = 5, delta = 1):
+    """
+    Function computes the fingerprints (and optionally the constellation hashes) of a WAV, going through the fingerprint cache.
+    A file that was analysed before and hasn't changed is recognised by its path, size and modification time, so it isn't even decoded;
+    any other file is memory-mapped and looked up by its content hash, and its samples are downmixed a block at a time as they are used.
+
+    Inputs: path (str, path to a WAV file)
+            methods (iterable of fingerprint methods, see compute_fingerprints)
+            hashes (boolean, also return the constellation hashes)
+            h, delta (integers, window length and step in seconds)
+
+    Outputs: samplerate (integer), content hash (string), dictionary of method -> fingerprints
+             and [hashes, anchor_times] (or None if hashes is False)
+    """
+    known = fingerprint_cache.lookup_file(path)
+    if known is not None:
+        song_hash, samplerate = known
+        fingerprints = {}
+        for method in methods:
+            cached = fingerprint_cache.load(song_hash, method, **_fingerprint_params(method, samplerate, h, delta, DECIMATE)[1])
+            if cached is not None:
+                fingerprints[method] = cached["fingerprints"]
+        cached_hashes = fingerprint_cache.load(song_hash, "constellation") if hashes else None
+        if len(fingerprints) == len(methods) and (cached_hashes is not None or not hashes):
+            logger.info('Read ' + path + ' from the fingerprint cache')
+            peak_hashes = [cached_hashes["hashes"], cached_hashes["anchor_times"]] if hashes else None
+            return([samplerate, song_hash, fingerprints, peak_hashes])
+    samplerate, data = _read_wav(path)
+    song_hash, fingerprints, peak_hashes = analyze_series(data, samplerate, methods = methods, hashes = hashes, h = h, delta = delta)
+    del data
+    fingerprint_cache.remember_file(path, song_hash, samplerate)
+    return([samplerate, song_hash, fingerprints, peak_hashes])
+
+
+def analyze_series(series, samplerate, methods = ("one",), hashes = False, h = 5, delta = 1):
+    """
+    Function computes the content hash and fingerprints (and optionally the constellation hashes) of a decoded series,
+    going through the fingerprint cache by content hash (see cached_analysis for files).
+
+    Inputs: series (numpy.ndarray, mono, or the frames x channels samples of a WAV), samplerate (integer)
+            methods, hashes, h, delta (see cached_analysis)
+
+    Outputs: content hash (string), dictionary of method -> fingerprints and [hashes, anchor_times] (or None if hashes is False)
+    """
+    song_hash = content_hash(series, samplerate)
+    fingerprints = compute_fingerprints(series, samplerate, methods = methods, h = h, delta = delta, song_hash = song_hash)
+    peak_hashes = None
+    if hashes:
+        cached_hashes = fingerprint_cache.load(song_hash, "constellation")
+        if cached_hashes is not None:
+            peak_hashes = [cached_hashes["hashes"], cached_hashes["anchor_times"]]
+        else:
+            peak_hashes = constellation_hashes(series)
+            fingerprint_cache.store(song_hash, "constellation", {"hashes": peak_hashes[0], "anchor_times": peak_hashes[1]})
+    return([song_hash, fingerprints, peak_hashes])
+
+
+def fingerprint_series(series, samplerate):
+    """
+    Function does the per-song work of fingerprint_file for audio that is already decoded (e.g. by audio_processing.decode_audio),
+    so a song never has to be written to or read from a WAV.
+
+    Inputs: series (numpy.ndarray), samplerate (integer)
+
+    Outputs: Dictionary with the samplerate, fingerprints1, fingerprints5, content_hash, hashes and decimation setting of the song
+    """
+    song_hash, fingerprints, peak_hashes = analyze_series(series, samplerate, methods = ("one", "five"), hashes = True)
+    return(_song(samplerate, song_hash, fingerprints, peak_hashes))
+
+
+def fingerprint_file(path):
+    """
+    Function does all the per-song work of adding a WAV to the database: reads it, computes fingerprints one and five,
+    its constellation hashes and its content hash. It touches no database, so it can run in a worker process.
+    Songs already in the fingerprint cache are not recomputed.
+
+    Inputs: path (str, path to a WAV file)
+
+    Outputs: Dictionary with the samplerate, fingerprints1, fingerprints5, content_hash, hashes and decimation setting of the song
+    """
+    samplerate, song_hash, fingerprints, peak_hashes = cached_analysis(path, methods = ("one", "five"), hashes = True)
+    return(_song(samplerate, song_hash, fingerprints, peak_hashes))
+
+
+def _song(samplerate, song_hash, fingerprints, peak_hashes):
+    song = {
+        "samplerate": samplerate,
+        "fingerprints1": fingerprints["one"],
+        "fingerprints5": fingerprints["five"],
+        "content_hash": song_hash,
+        "hashes": peak_hashes,
+        "decimated": DECIMATE,
+    }
+    return(song)
+
+
+def fingerprint_wav(path, methods = ("one",)):
+    """
+    Function reads a WAV and computes its fingerprints, going through the fingerprint cache. It touches no database, so it can run in a worker process.
+
+    Inputs: path (str, path to a WAV file)
+            methods (iterable of fingerprint methods, see compute_fingerprints)
+
+    Outputs: Dictionary of method -> fingerprints (numpy.ndarray, one row per window)
+    """
+    return(cached_analysis(path, methods = methods)[2])
+
+
+def iter_distances(snip_fingerprint, song_fingerprint, chunk_size = 4096, dtype = np.float64, squared = False):
+    """
+    Function yields the distances between every snippet fingerprint and a block of song fingerprints at a time,
+    so memory stays bounded however long the song (or catalog) is.
+
+    Inputs: snip_fingerprints (numpy.ndarray or list of fingerprints for snippet)
+            song_fingerprints (numpy.ndarray or list of fingerprints for song)
+            chunk_size (integer, number of song windows per block)
+            dtype (numpy.float64 or numpy.float32, dtype of the distances)
+            squared (boolean, return squared euclidean distances)
+
+    Outputs: Generator of (index of the first song window in the block (integer), distances (2-D numpy.ndarray, song windows x snippet windows))
+    """
+    snip_fingerprint = np.atleast_2d(np.asarray(snip_fingerprint, dtype = dtype))
+    song_fingerprint = np.atleast_2d(np.asarray(song_fingerprint, dtype = dtype))
+    metric = "sqeuclidean" if squared else "euclidean"
+    for start in range(0, len(song_fingerprint), chunk_size):
+        block = distance.cdist(song_fingerprint[start:start + chunk_size], snip_fingerprint, metric)
+        yield(start, block.astype(dtype, copy = False))
+
+
+@profiling.timed()
+def match_fingerprints(snip_fingerprint, song_fingerprint, chunk_size = 4096, dtype = np.float64, squared = False):
     """
     Function computes the "distance" between two fingerprints for each window.
     
-    Inputs: snip_fingerprints (list of fingerprints for snippet)
-            song_fingerprints (list of fingerprints for song)
-
-    Outputs: dist (pandas DataFrame)
-    """
-    df1 = DataFrame(snip_fingerprint).T
-    df2 = DataFrame(song_fingerprint).T
-    dist = np.empty([int(len(df2.columns)), int(len(df1.columns))])
-    for index1 in range(int(len(df1.columns))):
-        array_dist = []
-        for index2 in range(int(len(df2.columns))):
-            distance_pd = distance.euclidean(df1[index1], df2[index2])
-            array_dist.append(distance_pd)
-        dist[:, index1] = array_dist 
-    df_dist = DataFrame(dist)
+    Inputs: snip_fingerprints (numpy.ndarray or list of fingerprints for snippet)
+            song_fingerprints (numpy.ndarray or list of fingerprints for song)
+            chunk_size (integer, number of song windows compared at once)
+            dtype (numpy.float64 or numpy.float32, dtype of the distances)
+            squared (boolean, return squared euclidean distances)
+
+    Outputs: dist (numpy.ndarray, one row per song window and one column per snippet window)
+    """
+    song_fingerprint = np.atleast_2d(np.asarray(song_fingerprint, dtype = dtype))
+    dist = np.empty((len(song_fingerprint), len(snip_fingerprint)), dtype = dtype)
+    for start, block in iter_distances(snip_fingerprint, song_fingerprint, chunk_size = chunk_size, dtype = dtype, squared = squared):
+        dist[start:start + len(block)] = block
     logger.info('Computed distance between fingerprints') 
-    return(df_dist) 
+    return(dist) 
+
+
+def score_alignment(dist, epsilon, threshold = .05, early_stop = False, block_size = 256):
+    """
+    Function scores every alignment of a snippet against a song in one pass. Each window pair closer than epsilon
+    votes for its offset (song window - snippet window), which is the same as counting the hits on each diagonal
+    of the distance matrix.
+
+    Inputs: dist (numpy.ndarray of distances between song fingerprints and snippet fingerprints, from match_fingerprints)
+            epsilon (integer meant to represent acceptable tolerance between two fingerprints)
+            threshold (float, share of matching windows needed for a match, default 5%)
+            early_stop (boolean, stop as soon as some offset reaches the threshold instead of finding the best one)
+            block_size (integer, number of song windows scanned at once)
+
+    Outputs: best_offset (integer, song window lined up with the first snippet window)
+             score (integer, number of matching windows at that offset)
+             hit_ratio (float, score divided by the number of windows compared at that offset)
+    """
+    dist = np.asarray(dist)
+    n_song, n_snip = dist.shape
+    # only offsets where the shorter of the two lies fully inside the longer one are scored
+    lowest = min(0, n_song - n_snip)
+    overlap = min(n_song, n_snip)
+    counts = np.zeros(abs(n_song - n_snip) + 1, dtype = np.int64)
+    if overlap == 0:
+        return([0, 0, 0.0])
+    for start in range(0, n_song, block_size):
+        song_index, snip_index = np.nonzero(dist[start:start + block_size] < epsilon)
+        offsets = song_index + start - snip_index - lowest
+        offsets = offsets[(offsets >= 0) & (offsets < len(counts))]
+        counts += np.bincount(offsets, minlength = len(counts))
+        if early_stop and counts.max() >= threshold*overlap:
+            break
+    best = int(np.argmax(counts))
+    return([best + lowest, int(counts[best]), counts[best]/overlap])
+
+
+@profiling.timed()
+def score_catalog(snip_fingerprint, catalog_fingerprints, song_starts, epsilon, chunk_size = 65536):
+    """
+    Function scores a snippet against every song of a catalog in one pass over one contiguous fingerprint matrix.
+    Gives, for each song, the same result as score_alignment on that song's distance matrix.
+
+    Inputs: snip_fingerprint (numpy.ndarray, fingerprints of the snippet)
+            catalog_fingerprints (2-D numpy.ndarray, fingerprints of every song, each song's windows in order and contiguous)
+            song_starts (numpy.ndarray, row where each song starts, increasing)
+            epsilon (integer meant to represent acceptable tolerance between two fingerprints)
+            chunk_size (integer, number of catalog rows compared with the snippet at once)
+
+    Outputs: best_offset, score, hit_ratio (numpy.ndarrays with one entry per song, see score_alignment)
+    """
+    snip_fingerprint = np.atleast_2d(np.asarray(snip_fingerprint, dtype = np.float64))
+    song_starts = np.asarray(song_starts, dtype = np.int64)
+    n_snip = len(snip_fingerprint)
+    lengths = np.diff(np.append(song_starts, len(catalog_fingerprints)))
+    lowest = np.minimum(0, lengths - n_snip)
+    n_offsets = np.abs(lengths - n_snip) + 1
+    # every (song, offset) pair gets one slot in a single flat vote array
+    base = np.concatenate([[0], np.cumsum(n_offsets)[:-1]]).astype(np.int64)
+    counts = np.zeros(int(n_offsets.sum()), dtype = np.int64)
+    if len(song_starts) == 0 or n_snip == 0:
+        return([np.zeros(len(song_starts), dtype = np.int64), np.zeros(len(song_starts), dtype = np.int64), np.zeros(len(song_starts))])
+    for start, block in iter_distances(snip_fingerprint, catalog_fingerprints, chunk_size = chunk_size, squared = True):
+        row, col = np.nonzero(block < epsilon**2)
+        row += start
+        song = np.searchsorted(song_starts, row, side = "right") - 1
+        offsets = row - song_starts[song] - col - lowest[song]
+        valid = (offsets >= 0) & (offsets < n_offsets[song])
+        counts += np.bincount(base[song[valid]] + offsets[valid], minlength = len(counts))
+    score = np.maximum.reduceat(counts, base)
+    # first offset reaching each song's best score
+    best_slots = np.flatnonzero(counts == np.repeat(score, n_offsets))
+    slot_song = np.repeat(np.arange(len(song_starts)), n_offsets)[best_slots]
+    best_offset = best_slots[np.unique(slot_song, return_index = True)[1]] - base + lowest
+    hit_ratio = score/np.maximum(np.minimum(lengths, n_snip), 1)
+    logger.info('Scored snippet against ' + str(len(song_starts)) + ' songs')
+    return([best_offset, score, hit_ratio])
+
+
+@profiling.timed()
+def score_hashes(query_hashes, query_times, match_hashes, match_song_ids, match_times):
+    """
+    Function scores songs against a snippet from exact hash matches: every (snippet hash, catalog hash) pair with the same value
+    votes for its time offset (catalog anchor time - snippet anchor time), and a song's score is the height of its tallest
+    offset histogram bar. The cost depends on the number of matches, not on the size of the catalog.
+
+    Inputs: query_hashes, query_times (numpy.ndarrays, from constellation_hashes of the snippet)
+            match_hashes, match_song_ids, match_times (numpy.ndarrays, catalog rows whose hash is one of the query_hashes)
+
+    Outputs: songs (numpy.ndarray, every song with at least one matching hash)
+             best_offset (numpy.ndarray, frame of each song lined up with the start of the snippet)
+             score (numpy.ndarray, number of hashes agreeing on that offset)
+    """
+    query_hashes, query_times = np.asarray(query_hashes, dtype = np.int64), np.asarray(query_times, dtype = np.int64)
+    match_hashes, match_song_ids, match_times = [np.asarray(x, dtype = np.int64) for x in (match_hashes, match_song_ids, match_times)]
+    order = np.argsort(query_hashes, kind = "stable")
+    sorted_hashes = query_hashes[order]
+    left = np.searchsorted(sorted_hashes, match_hashes, side = "left")
+    counts = np.searchsorted(sorted_hashes, match_hashes, side = "right") - left
+    # one (catalog row, snippet row) pair for every equal hash
+    catalog_rows = np.repeat(np.arange(len(match_hashes)), counts)
+    within = np.arange(len(catalog_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    query_rows = order[np.repeat(left, counts) + within]
+    offsets = match_times[catalog_rows] - query_times[query_rows]
+    pair_songs = match_song_ids[catalog_rows]
+    if len(pair_songs) == 0:
+        return([np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)])
+    # one histogram over every (song, offset) pair at once
+    keys, votes = np.unique(np.stack([pair_songs, offsets], axis = 1), axis = 0, return_counts = True)
+    order = np.lexsort((-votes, keys[:, 0]))
+    keys, votes = keys[order], votes[order]
+    first = np.flatnonzero(np.r_[True, keys[1:, 0] != keys[:-1, 0]])
+    logger.info('Scored ' + str(len(first)) + ' songs from ' + str(len(pair_songs)) + ' hash matches')
+    return([keys[first, 0], keys[first, 1], votes[first]])
 
 
 def return_match(dist,epsilon):
     """
     Function returns whether a song and snippet are matched based on a prespecified epsilon value and the distance list between them
     
-    Inputs: dist (pandas DataFrame of distances between snippet fingerprints and song fingerprints)
+    Inputs: dist (numpy.ndarray of distances between song fingerprints and snippet fingerprints, from match_fingerprints)
             epsilon (integer meant to represent acceptable tolerance between two fingerprints)
 
     Outputs: Either match or no match (string)
     """
-    tf_matrix = ((dist < epsilon))
     logger.info('Computing distance between two fingerprints') 
-    for index1 in range(int(-abs(len(dist.index) - len(dist.columns))),0):
-        ind_tf = np.diag(tf_matrix,index1)
-        if (all(ind_tf) or sum(ind_tf) >= .05*len(ind_tf)):
-            return("Match!")
+    _, _, hit_ratio = score_alignment(dist, epsilon, early_stop = True)
+    if hit_ratio >= .05:
+        return("Match!")
     return("Not a match.")        
 
 ## EPSILON VALUES
@@ -0,0 +1,663 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 17, 2020
+### Use: Storage backends (Postgres server, or an embedded SQLite file) behind database_manager
+#########################################
+
+import os
+import io
+import time
+import hashlib
+import logging
+import sqlite3
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Fingerprint methods stored for every song, the cube column holding each one in Postgres, and their number of dimensions
+FINGERPRINT_COLUMNS = {"one": "fingerprint1", "five": "fingerprint5"}
+FINGERPRINT_DIMENSIONS = {"one": 3, "five": 8}
+
+
+def fingerprint_row_hashes(fingerprints1, fingerprints5):
+    """
+    Function computes the identity of each fingerprint row from the position of its window in the song and its values,
+    so a window which repeats (silence, a looped bar) is still a row of its own.
+
+    Inputs: fingerprints1 (numpy.ndarray, fingerprint one for each window)
+            fingerprints5 (numpy.ndarray, fingerprint five for each window)
+
+    Outputs: List of sha1 hex digests (str), one per window
+    """
+    positions = np.arange(len(fingerprints1), dtype = np.float64)[:, None]
+    rows = np.hstack([positions, np.asarray(fingerprints1, dtype = np.float64), np.asarray(fingerprints5, dtype = np.float64)])
+    return([hashlib.sha1(row.tobytes()).hexdigest() for row in rows])
+
+
+def unique_hashes(hashes):
+    """
+    Function returns the distinct constellation hashes of a snippet as plain integers, ready to send to a database.
+
+    Inputs: hashes (numpy.ndarray, from spectral_analysis.constellation_hashes)
+
+    Outputs: List of integers
+    """
+    return(np.unique(np.asarray(hashes, dtype = np.int64)).tolist())
+
+
+def hash_rows(rows):
+    """
+    Function turns (hash, song_id, anchor_time) rows from a lookup into numpy arrays.
+
+    Inputs: rows (list of tuples of integers)
+
+    Outputs: hashes, song_ids, anchor_times (numpy.ndarrays)
+    """
+    rows = np.asarray(rows, dtype = np.int64).reshape(-1, 3)
+    return([rows[:, 0], rows[:, 1], rows[:, 2]])
+
+
+def cube_text(fingerprint):
+    """
+    Function formats one fingerprint as a cube literal for COPY, e.g. (0.1, 0.5, 1.0).
+
+    Inputs: fingerprint (numpy.ndarray or list of floats)
+
+    Outputs: cube literal (str)
+    """
+    return("(" + ", ".join([repr(float(x)) for x in fingerprint]) + ")")
+
+
+class StorageBackend:
+    """
+    Interface every storage backend implements. database_manager only talks to its backend through these methods.
+    """
+    name = "base"
+
+    def create_tables(self):
+        """Function creates the tables and indexes. Does nothing if these already exist."""
+        raise NotImplementedError
+
+    def missing_schema(self):
+        """
+        Function lists the tables, columns and indexes create_tables makes which the database doesn't have
+        (a new database, or one made by an older version of Freezam).
+
+        Outputs: List of names (str), empty if the schema is complete
+        """
+        raise NotImplementedError
+
+    def maintain_indexes(self, reindex = False):
+        """Function refreshes (and optionally rebuilds) the search indexes after large loads."""
+        raise NotImplementedError
+
+    def insert_song(self, title, artist, album, path, samplerate, date, source, fingerprints1, fingerprints5, content_hash, hashes = None, decimated = False):
+        """
+        Function writes a song and all of its fingerprints (and its constellation hashes, if given) without committing.
+        Songs are identified by content_hash, so writing the same audio again only updates its details.
+        decimated records whether fingerprint five was computed from decimated audio (see catalog_decimation).
+
+        Outputs: song_id (integer), whether the song is new (boolean) and the number of fingerprint rows written
+        """
+        raise NotImplementedError
+
+    def write_songs(self, songs):
+        """
+        Function writes a batch of songs (see insert_song) in a single transaction: either all of them are written or none.
+
+        Inputs: songs (list of dictionaries of insert_song arguments)
+
+        Outputs: List of [song_id, whether the song is new, write throughput of the batch (fingerprint rows per second)], one per song
+        """
+        start = time.perf_counter()
+        try:
+            written = [self.insert_song(**song) for song in songs]
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        rows = sum([row[2] for row in written])
+        rows_per_second = rows/max(time.perf_counter() - start, 1e-9)
+        logger.info('Wrote ' + str(rows) + ' fingerprints for ' + str(len(songs)) + ' songs at ' + str(round(rows_per_second)) + ' rows/s')
+        return([[song_id, inserted, rows_per_second] for song_id, inserted, _ in written])
+
+    def write_song(self, title, artist, album, path, samplerate, date, source, fingerprints1, fingerprints5, content_hash, hashes = None, decimated = False):
+        """
+        Function writes a song and all of its fingerprints (and its constellation hashes, if given) in a single transaction.
+
+        Outputs: song_id (integer), whether the song is new (boolean) and the write throughput (fingerprint rows per second)
+        """
+        return(self.write_songs([{"title": title, "artist": artist, "album": album, "path": path, "samplerate": samplerate, "date": date,
+                                  "source": source, "fingerprints1": fingerprints1, "fingerprints5": fingerprints5,
+                                  "content_hash": content_hash, "hashes": hashes, "decimated": decimated}])[0])
+
+    def remove_song(self, title, artist, album):
+        """Function removes a song (and its fingerprints) if it exists."""
+        raise NotImplementedError
+
+    def update_album(self, title, artist, new_album):
+        """Function replaces the album of a song."""
+        raise NotImplementedError
+
+    def update_artist(self, title, new_artist, album):
+        """Function replaces the artist of a song."""
+        raise NotImplementedError
+
+    def list_songs(self):
+        """
+        Function lists every song.
+
+        Outputs: List of (song_id, title, artist, album, path, sample_rate, date, source)
+        """
+        raise NotImplementedError
+
+    def song_details(self):
+        """
+        Function returns the title and artist of every song.
+
+        Outputs: Dictionary of song_id -> (title, artist)
+        """
+        return({row[0]: (row[1], row[2]) for row in self.list_songs()})
+
+    def catalog_decimation(self):
+        """
+        Function lists the decimation settings the stored songs were fingerprinted with.
+
+        Outputs: Set of booleans (empty if there are no songs)
+        """
+        raise NotImplementedError
+
+    def load_catalog(self, method):
+        """
+        Function loads every fingerprint of one method into one contiguous matrix, grouped by song and in window order (slow search).
+
+        Outputs: song_ids (numpy.ndarray), fingerprint_ids (numpy.ndarray), fingerprints (2-D numpy.ndarray)
+        """
+        raise NotImplementedError
+
+    def nearest_fingerprints(self, fingerprints, method):
+        """
+        Function finds the closest stored fingerprint for every snippet window (fast search).
+
+        Outputs: List of (window_id, song_id, fingerprint_id, title, artist, distance), one per snippet window
+        """
+        raise NotImplementedError
+
+    def lookup_hashes(self, hashes):
+        """
+        Function looks up constellation hashes in the inverted index (constellation search).
+
+        Outputs: hashes, song_ids, anchor_times (numpy.ndarrays, one entry per stored hash equal to one of the given hashes)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Function closes the connection."""
+        raise NotImplementedError
+
+
+def connect_postgres(dsn = None):
+    """
+    Function opens a connection to our Postgres database.
+    Pass a dsn or set the FREEZAM_DSN environment variable (e.g. "dbname=freezam host=localhost") to use another server, such as a local stand-in for benchmarks.
+
+    Inputs: dsn (string, libpq connection string, optional)
+
+    Outputs: psycopg2 connection
+    """
+    import psycopg2
+    dsn = dsn or os.environ.get("FREEZAM_DSN")
+    if dsn:
+        return(psycopg2.connect(dsn))
+    import credentials
+    return(psycopg2.connect(
+        host="sculptor.stat.cmu.edu",
+        database=credentials.DB_USER,
+        user=credentials.DB_USER,
+        password=credentials.DB_PASSWORD
+    ))
+
+
+class PostgresBackend(StorageBackend):
+    """
+    Postgres backend: fingerprints are cubes, fast search is a GiST-indexed kNN query.
+    """
+    name = "postgres"
+
+    def __init__(self, dsn = None):
+        self.conn = connect_postgres(dsn)
+        self.cur = self.conn.cursor()
+
+    def create_tables(self):
+        self.cur.execute("""
+        CREATE TABLE IF NOT EXISTS songs (
+            song_id SERIAL PRIMARY KEY,
+            title text NOT NULL CHECK (char_length(title) > 0),
+            artist text NOT NULL CHECK (char_length(artist) > 0),
+            album text NOT NULL CHECK (char_length(album) > 0),
+            path text NOT NULL CHECK (char_length(path) > 0),
+            sample_rate numeric NOT NULL CHECK (sample_rate > 0),
+            date text NOT NULL CHECK (char_length(date) > 0),
+            source text NOT NULL CHECK (char_length(source) > 0)
+        );
+        CREATE TABLE IF NOT EXISTS fingerprints_slow_search (
+            song_id integer NOT NULL CHECK (song_id > 0),
+            fingerprint_id SERIAL NOT NULL,
+            num_fingerprints numeric NOT NULL CHECK (num_fingerprints > 0),
+            fingerprint1 NUMERIC ARRAY NOT NULL,
+            fingerprint5 NUMERIC ARRAY NOT NULL,
+            PRIMARY KEY (song_id, fingerprint_id),
+            FOREIGN KEY (song_id) REFERENCES songs (song_id) MATCH FULL ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            song_id integer NOT NULL CHECK (song_id > 0),
+            fingerprint_id SERIAL NOT NULL,
+            num_fingerprints numeric NOT NULL CHECK (num_fingerprints > 0),
+            fingerprint1 cube NOT NULL,
+            fingerprint5 cube NOT NULL,
+            PRIMARY KEY (song_id, fingerprint_id),
+            FOREIGN KEY (song_id) REFERENCES songs (song_id) MATCH FULL ON DELETE CASCADE
+        );
+        -- GiST indexes let ORDER BY fingerprint <-> cube(...) LIMIT k walk the index instead of scanning the table
+        CREATE INDEX IF NOT EXISTS fingerprints_fingerprint1_gist ON fingerprints USING gist (fingerprint1);
+        CREATE INDEX IF NOT EXISTS fingerprints_fingerprint5_gist ON fingerprints USING gist (fingerprint5);
+        -- content-hash identity: a song is its decoded audio, a fingerprint row is its values within a song
+        ALTER TABLE songs ADD COLUMN IF NOT EXISTS content_hash text;
+        CREATE UNIQUE INDEX IF NOT EXISTS songs_content_hash_key ON songs (content_hash);
+        -- whether fingerprint five was computed from decimated audio, which a search must match
+        ALTER TABLE songs ADD COLUMN IF NOT EXISTS decimated boolean NOT NULL DEFAULT false;
+        CREATE INDEX IF NOT EXISTS songs_title_artist_album ON songs (title, artist, album);
+        ALTER TABLE fingerprints ADD COLUMN IF NOT EXISTS fingerprint_hash text;
+        CREATE UNIQUE INDEX IF NOT EXISTS fingerprints_song_hash_key ON fingerprints (song_id, fingerprint_hash);
+        -- inverted index of constellation hashes: a lookup costs one index probe per snippet hash
+        CREATE TABLE IF NOT EXISTS fingerprint_hashes (
+            hash integer NOT NULL,
+            song_id integer NOT NULL REFERENCES songs (song_id) ON DELETE CASCADE,
+            anchor_time integer NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS fingerprint_hashes_hash ON fingerprint_hashes (hash);
+        CREATE INDEX IF NOT EXISTS fingerprint_hashes_song_id ON fingerprint_hashes (song_id);
+        """)
+        self.conn.commit()
+        self.maintain_indexes()
+
+    def missing_schema(self):
+        self.cur.execute("SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema();")
+        columns = set(self.cur.fetchall())
+        self.cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema();")
+        indexes = set(row[0] for row in self.cur.fetchall())
+        missing = [table + "." + column for table, column in [("songs", "content_hash"), ("songs", "decimated"), ("fingerprints", "fingerprint1"), ("fingerprints", "fingerprint_hash"),
+                                                              ("fingerprint_hashes", "hash")] if (table, column) not in columns]
+        missing += ["index " + index for index in ["fingerprints_fingerprint1_gist", "fingerprints_fingerprint5_gist", "songs_content_hash_key",
+                                                   "fingerprints_song_hash_key", "fingerprint_hashes_hash"] if index not in indexes]
+        return(missing)
+
+    def maintain_indexes(self, reindex = False):
+        # ANALYZE keeps the planner using the GiST indexes for the kNN queries after large loads
+        if reindex:
+            self.cur.execute("REINDEX TABLE fingerprints;")
+            self.cur.execute("REINDEX TABLE fingerprint_hashes;")
+        self.cur.execute("ANALYZE fingerprints;")
+        self.cur.execute("ANALYZE fingerprint_hashes;")
+        self.conn.commit()
+
+    def copy_fingerprints(self, song_id, fingerprints1, fingerprints5):
+        """
+        Function streams all of a song's fingerprints into the fingerprints table with a single COPY, unless the song already has them.
+        Every window is kept, in order, so fingerprint_id follows the window's position in the song (offset scoring relies on it).
+        Rows go through a staging table so they can be upserted on (song_id, fingerprint_hash).
+        Does not commit, so it can share a transaction with the songs row.
+
+        Inputs: song_id (integer)
+                fingerprints1 (numpy.ndarray, fingerprint one for each window)
+                fingerprints5 (numpy.ndarray, fingerprint five for each window)
+
+        Outputs: Number of new rows written (integer)
+        """
+        self.cur.execute("SELECT 1 FROM fingerprints WHERE song_id = %s LIMIT 1", (song_id,))
+        if self.cur.fetchone() is not None:
+            return(0)
+        len_fingerprints = int(len(fingerprints1))
+        row_hashes = fingerprint_row_hashes(fingerprints1, fingerprints5)
+        buffer = io.StringIO()
+        for i in range(len_fingerprints):
+            buffer.write(str(song_id) + "\t" + str(i) + "\t" + str(len_fingerprints) + "\t" + cube_text(fingerprints1[i]) + "\t" + cube_text(fingerprints5[i]) + "\t" + row_hashes[i] + "\n")
+        buffer.seek(0)
+        self.cur.execute("CREATE TEMP TABLE IF NOT EXISTS fingerprints_staging (song_id integer, window_index integer, num_fingerprints numeric, "
+                         "fingerprint1 cube, fingerprint5 cube, fingerprint_hash text) ON COMMIT DELETE ROWS;")
+        self.cur.copy_expert("COPY fingerprints_staging (song_id, window_index, num_fingerprints, fingerprint1, fingerprint5, fingerprint_hash) FROM STDIN", buffer)
+        # ORDER BY hands out the fingerprint_ids in window order
+        self.cur.execute("INSERT INTO fingerprints (song_id, num_fingerprints, fingerprint1, fingerprint5, fingerprint_hash) "
+                         "SELECT song_id, num_fingerprints, fingerprint1, fingerprint5, fingerprint_hash FROM fingerprints_staging "
+                         "ORDER BY window_index ON CONFLICT (song_id, fingerprint_hash) DO NOTHING;")
+        rows = self.cur.rowcount
+        self.cur.execute("TRUNCATE fingerprints_staging;")
+        return(rows)
+
+    def copy_hashes(self, song_id, hashes):
+        """
+        Function streams a song's constellation hashes into the inverted index with a single COPY, unless the song already has them.
+        Does not commit, so it can share a transaction with the songs row.
+
+        Inputs: song_id (integer)
+                hashes (hashes, anchor_times numpy.ndarrays, from spectral_analysis.constellation_hashes)
+
+        Outputs: Nothing
+        """
+        self.cur.execute("SELECT 1 FROM fingerprint_hashes WHERE song_id = %s LIMIT 1", (song_id,))
+        if self.cur.fetchone() is not None:
+            return
+        values, anchor_times = hashes
+        buffer = io.StringIO()
+        np.savetxt(buffer, np.column_stack([values, np.full(len(values), song_id), anchor_times]), fmt = "%d", delimiter = "\t")
+        buffer.seek(0)
+        self.cur.copy_expert("COPY fingerprint_hashes (hash, song_id, anchor_time) FROM STDIN", buffer)
+
+    def insert_song(self, title, artist, album, path, samplerate, date, source, fingerprints1, fingerprints5, content_hash, hashes = None, decimated = False):
+        # songs added before content hashes existed are claimed by their details the first time they are added again
+        self.cur.execute("UPDATE songs SET content_hash = %s, decimated = %s WHERE song_id = (SELECT min(song_id) FROM songs WHERE content_hash IS NULL "
+                         "AND title = %s AND artist = %s AND album = %s AND path = %s) AND NOT EXISTS (SELECT 1 FROM songs WHERE content_hash = %s) "
+                         "RETURNING song_id", (content_hash, bool(decimated), title, artist, album, path, content_hash))
+        for legacy_song in self.cur.fetchall():
+            self.cur.execute("DELETE FROM fingerprints WHERE song_id = %s AND fingerprint_hash IS NULL", (legacy_song[0],))
+
+        # decimated isn't updated on a conflict, since the stored fingerprints are kept
+        self.cur.execute("INSERT INTO songs (title, artist, album, path, sample_rate, date, source, content_hash, decimated) "
+                         "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                         "ON CONFLICT (content_hash) DO UPDATE SET title = EXCLUDED.title, artist = EXCLUDED.artist, album = EXCLUDED.album, "
+                         "path = EXCLUDED.path, date = EXCLUDED.date, source = EXCLUDED.source "
+                         "RETURNING song_id, (xmax = 0) AS inserted", (title, artist, album, path, samplerate, date, source, content_hash, bool(decimated)))
+        song_id, inserted = self.cur.fetchone()
+
+        rows = self.copy_fingerprints(song_id, fingerprints1, fingerprints5)
+        if hashes is not None:
+            self.copy_hashes(song_id, hashes)
+        return([song_id, inserted, rows])
+
+    def remove_song(self, title, artist, album):
+        self.cur.execute("DELETE FROM songs where title = %s and artist = %s and album = %s", (title,artist,album))
+        self.conn.commit()
+
+    def update_album(self, title, artist, new_album):
+        self.cur.execute("UPDATE songs set album = %s where title = %s and artist = %s", (new_album, title, artist))
+        self.conn.commit()
+
+    def update_artist(self, title, new_artist, album):
+        self.cur.execute("UPDATE songs set artist = %s where title = %s and album = %s",(new_artist, title, album))
+        self.conn.commit()
+
+    def list_songs(self):
+        self.cur.execute("SELECT song_id, title, artist, album, path, sample_rate, date, source from songs;")
+        return(self.cur.fetchall())
+
+    def catalog_decimation(self):
+        self.cur.execute("SELECT DISTINCT decimated FROM songs;")
+        return(set(bool(row[0]) for row in self.cur.fetchall()))
+
+    def load_catalog(self, method):
+        column = FINGERPRINT_COLUMNS[method]
+        dims = FINGERPRINT_DIMENSIONS[method]
+        coords = ", ".join(["cube_ll_coord(" + column + ", " + str(i) + ")::float8" for i in range(1, dims + 1)])
+        buffer = io.BytesIO()
+        self.cur.copy_expert("COPY (SELECT song_id::int4, fingerprint_id::int4, " + coords + " FROM fingerprints "
+                             "ORDER BY song_id, fingerprint_id) TO STDOUT WITH (FORMAT binary)", buffer)
+        data = buffer.getvalue()
+        # binary COPY: 11-byte signature, flags, header extension, then fixed-width rows of (field count, then length + value per field)
+        header_length = 19 + int(np.frombuffer(data, dtype = ">i4", count = 1, offset = 15)[0])
+        fields = [("field_count", ">i2"), ("song_id_length", ">i4"), ("song_id", ">i4"), ("fingerprint_id_length", ">i4"), ("fingerprint_id", ">i4")]
+        for i in range(dims):
+            fields += [("length" + str(i), ">i4"), ("coord" + str(i), ">f8")]
+        row_dtype = np.dtype(fields)
+        records = np.frombuffer(data, dtype = row_dtype, offset = header_length, count = (len(data) - header_length - 2)//row_dtype.itemsize)
+        fingerprints = np.empty((len(records), dims))
+        for i in range(dims):
+            fingerprints[:, i] = records["coord" + str(i)]
+        logger.info('Loaded ' + str(len(records)) + ' fingerprints for method ' + method)
+        return([records["song_id"].astype(np.int64), records["fingerprint_id"].astype(np.int64), fingerprints])
+
+    def nearest_fingerprints(self, fingerprints, method):
+        import psycopg2.extras
+        column = FINGERPRINT_COLUMNS[method]
+        query_rows = [(index_row, [float(x) for x in fingerprints[index_row]]) for index_row in range(len(fingerprints))]
+        if not query_rows:
+            return([])
+        # one LATERAL kNN lookup per window, all in a single query; ORDER BY <-> ... LIMIT 1 on the bare fingerprints table is what lets Postgres use the GiST index
+        query = ("SELECT q.window_id, songs.song_id, nearest.fingerprint_id, songs.title, songs.artist, nearest.distance "
+                 "FROM (VALUES %s) AS q (window_id, query) "
+                 "CROSS JOIN LATERAL (SELECT song_id, fingerprint_id, " + column + " <-> q.query AS distance "
+                 "FROM fingerprints ORDER BY " + column + " <-> q.query LIMIT 1) AS nearest "
+                 "JOIN songs ON songs.song_id = nearest.song_id "
+                 "ORDER BY q.window_id;")
+        matches = psycopg2.extras.execute_values(self.cur, query, query_rows, template = "(%s, cube(%s::float8[]))",
+                                                 page_size = len(query_rows), fetch = True)
+        return(matches)
+
+    def lookup_hashes(self, hashes):
+        self.cur.execute("SELECT fingerprint_hashes.hash, song_id, anchor_time FROM fingerprint_hashes "
+                         "JOIN unnest(%s::int[]) AS q (hash) ON fingerprint_hashes.hash = q.hash", (unique_hashes(hashes),))
+        return(hash_rows(self.cur.fetchall()))
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Embedded single-file backend: no server needed. Each song's fingerprints are stored as one numpy blob per method,
+    and fast search uses an in-process KD-tree built from those blobs (rebuilt after writes).
+    """
+    name = "sqlite"
+
+    def __init__(self, path = "freezam.db"):
+        self.path = path
+        # the connection may be handed to one writer thread (add_dir), so it is not tied to the thread that opened it
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("PRAGMA foreign_keys = ON;")
+        self.conn.execute("PRAGMA journal_mode = WAL;")
+        self.indexes = {}
+
+    def create_tables(self):
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS songs (
+            song_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title text NOT NULL CHECK (length(title) > 0),
+            artist text NOT NULL CHECK (length(artist) > 0),
+            album text NOT NULL CHECK (length(album) > 0),
+            path text NOT NULL CHECK (length(path) > 0),
+            sample_rate numeric NOT NULL CHECK (sample_rate > 0),
+            date text NOT NULL CHECK (length(date) > 0),
+            source text NOT NULL CHECK (length(source) > 0),
+            content_hash text UNIQUE,
+            decimated integer NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS songs_title_artist_album ON songs (title, artist, album);
+        -- one row per song: every window's fingerprints as a float64 matrix, in window order
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            song_id integer PRIMARY KEY REFERENCES songs (song_id) ON DELETE CASCADE,
+            num_fingerprints integer NOT NULL CHECK (num_fingerprints > 0),
+            fingerprint1 blob NOT NULL,
+            fingerprint5 blob NOT NULL
+        );
+        -- inverted index of constellation hashes
+        CREATE TABLE IF NOT EXISTS fingerprint_hashes (
+            hash integer NOT NULL,
+            song_id integer NOT NULL REFERENCES songs (song_id) ON DELETE CASCADE,
+            anchor_time integer NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS fingerprint_hashes_hash ON fingerprint_hashes (hash);
+        CREATE INDEX IF NOT EXISTS fingerprint_hashes_song_id ON fingerprint_hashes (song_id);
+        """)
+        # files made before songs recorded their decimation setting (SQLite has no ADD COLUMN IF NOT EXISTS)
+        if "decimated" not in self.song_columns():
+            self.conn.execute("ALTER TABLE songs ADD COLUMN decimated integer NOT NULL DEFAULT 0;")
+        self.conn.commit()
+
+    def song_columns(self):
+        """Function lists the columns of the songs table (none if it doesn't exist)."""
+        return([row[1] for row in self.conn.execute("PRAGMA table_info(songs);")])
+
+    def missing_schema(self):
+        names = set(row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index');"))
+        missing = [name for name in ["songs", "fingerprints", "fingerprint_hashes", "songs_title_artist_album", "fingerprint_hashes_hash"] if name not in names]
+        if "songs" in names and "decimated" not in self.song_columns():
+            missing.append("songs.decimated")
+        return(missing)
+
+    def maintain_indexes(self, reindex = False):
+        if reindex:
+            self.conn.execute("REINDEX;")
+        self.conn.execute("ANALYZE;")
+        self.conn.commit()
+        self.indexes = {}
+
+    def insert_song(self, title, artist, album, path, samplerate, date, source, fingerprints1, fingerprints5, content_hash, hashes = None, decimated = False):
+        fingerprints1 = np.asarray(fingerprints1, dtype = np.float64)
+        fingerprints5 = np.asarray(fingerprints5, dtype = np.float64)
+        existing = self.conn.execute("SELECT song_id FROM songs WHERE content_hash = ?", (content_hash,)).fetchone()
+        if existing is None:
+            song_id = self.conn.execute("INSERT INTO songs (title, artist, album, path, sample_rate, date, source, content_hash, decimated) "
+                                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (title, artist, album, path, samplerate, date, source, content_hash,
+                                                                               int(bool(decimated)))).lastrowid
+            self.conn.execute("INSERT INTO fingerprints (song_id, num_fingerprints, fingerprint1, fingerprint5) VALUES (?, ?, ?, ?)",
+                              (song_id, int(len(fingerprints1)), fingerprints1.tobytes(), fingerprints5.tobytes()))
+            rows = len(fingerprints1)
+            self.indexes = {}
+        else:
+            song_id = existing[0]
+            self.conn.execute("UPDATE songs SET title = ?, artist = ?, album = ?, path = ?, date = ?, source = ? WHERE song_id = ?",
+                              (title, artist, album, path, date, source, song_id))
+            rows = 0
+        if hashes is not None and self.conn.execute("SELECT 1 FROM fingerprint_hashes WHERE song_id = ? LIMIT 1", (song_id,)).fetchone() is None:
+            values, anchor_times = hashes
+            self.conn.executemany("INSERT INTO fingerprint_hashes (hash, song_id, anchor_time) VALUES (?, ?, ?)",
+                                  zip(np.asarray(values).tolist(), [song_id]*len(values), np.asarray(anchor_times).tolist()))
+        return([song_id, existing is None, rows])
+
+    def remove_song(self, title, artist, album):
+        self.conn.execute("DELETE FROM songs where title = ? and artist = ? and album = ?", (title,artist,album))
+        self.conn.commit()
+        self.indexes = {}
+
+    def update_album(self, title, artist, new_album):
+        self.conn.execute("UPDATE songs set album = ? where title = ? and artist = ?", (new_album, title, artist))
+        self.conn.commit()
+        self.indexes = {}
+
+    def update_artist(self, title, new_artist, album):
+        self.conn.execute("UPDATE songs set artist = ? where title = ? and album = ?", (new_artist, title, album))
+        self.conn.commit()
+        self.indexes = {}
+
+    def list_songs(self):
+        return(self.conn.execute("SELECT song_id, title, artist, album, path, sample_rate, date, source from songs;").fetchall())
+
+    def catalog_decimation(self):
+        return(set(bool(row[0]) for row in self.conn.execute("SELECT DISTINCT decimated FROM songs;")))
+
+    def load_catalog(self, method):
+        column = FINGERPRINT_COLUMNS[method]
+        dims = FINGERPRINT_DIMENSIONS[method]
+        song_ids = []
+        blocks = []
+        for song_id, blob in self.conn.execute("SELECT song_id, " + column + " FROM fingerprints ORDER BY song_id;"):
+            block = np.frombuffer(blob, dtype = np.float64).reshape(-1, dims)
+            song_ids.append(np.full(len(block), song_id, dtype = np.int64))
+            blocks.append(block)
+        if not blocks:
+            return([np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros((0, dims))])
+        song_ids = np.concatenate(song_ids)
+        # fingerprint_id is the position of the window within its song
+        song_starts = np.flatnonzero(np.r_[True, song_ids[1:] != song_ids[:-1]])
+        fingerprint_ids = np.arange(len(song_ids)) - np.repeat(song_starts, np.diff(np.r_[song_starts, len(song_ids)]))
+        logger.info('Loaded ' + str(len(song_ids)) + ' fingerprints for method ' + method)
+        return([song_ids, fingerprint_ids, np.concatenate(blocks)])
+
+    def nearest_fingerprints(self, fingerprints, method):
+        import fingerprint_index
+        if method not in self.indexes:
+            song_ids, fingerprint_ids, catalog = self.load_catalog(method)
+            self.indexes[method] = fingerprint_index.build_index(song_ids, fingerprint_ids, catalog, self.song_details())
+        return(fingerprint_index.nearest_matches(self.indexes[method], fingerprints))
+
+    def lookup_hashes(self, hashes):
+        # the distinct snippet hashes go in a temporary table so the lookup is one indexed join
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS query_hashes (hash integer PRIMARY KEY);")
+        self.conn.execute("DELETE FROM query_hashes;")
+        self.conn.executemany("INSERT INTO query_hashes (hash) VALUES (?)", [(value,) for value in unique_hashes(hashes)])
+        rows = self.conn.execute("SELECT fingerprint_hashes.hash, song_id, anchor_time FROM query_hashes "
+                                 "JOIN fingerprint_hashes ON fingerprint_hashes.hash = query_hashes.hash").fetchall()
+        self.conn.commit()
+        return(hash_rows(rows))
+
+    def close(self):
+        self.conn.close()
+
+
+BACKENDS = {"postgres": PostgresBackend, "sqlite": SQLiteBackend}
+
+
+class LazyBackend:
+    """
+    Stands in for a backend and only opens it (see get_backend) when one of its methods is first used,
+    so importing database_manager never connects to a database. When it opens, it warns if the tables (or the columns and
+    indexes added since they were made) are missing, so the user knows to run python freezam.py init.
+    """
+
+    def __init__(self, name = None, **options):
+        self.backend_name = name
+        self.options = options
+        self.backend = None
+
+    def open(self, check = True):
+        """Function opens the backend if it isn't open yet (checking its schema unless check is False), and returns it."""
+        if self.backend is None:
+            self.backend = get_backend(self.backend_name, **self.options)
+            missing = self.backend.missing_schema() if check else []
+            if missing:
+                logger.warning('The ' + self.backend.name + ' database is missing ' + ", ".join(missing) + ': run python freezam.py init')
+        return(self.backend)
+
+    def __getattr__(self, attribute):
+        if attribute in ("backend_name", "options", "backend"):
+            raise AttributeError(attribute)
+        # init is how a missing schema gets made, so it isn't checked first
+        return(getattr(self.open(check = attribute != "create_tables"), attribute))
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+
+def is_schema_error(error):
+    """
+    Function tells whether a database error means the tables (or a column added since they were made) are missing,
+    i.e. that python freezam.py init hasn't been run on this database.
+
+    Inputs: error (Exception)
+
+    Outputs: boolean
+    """
+    if isinstance(error, sqlite3.OperationalError):
+        return(str(error).startswith(("no such table", "no such column")))
+    # psycopg2's undefined_table and undefined_column (psycopg2 is only imported when Postgres is used)
+    return(getattr(error, "pgcode", None) in ("42P01", "42703"))
+
+
+def get_backend(name = None, **options):
+    """
+    Function opens a storage backend. Without a name, FREEZAM_BACKEND is used ("postgres" by default, or "sqlite";
+    FREEZAM_SQLITE_PATH sets the SQLite file, default freezam.db).
+
+    Inputs: name (str, postgres or sqlite, optional)
+            options (keyword arguments for the backend, e.g. dsn for postgres or path for sqlite)
+
+    Outputs: backend (StorageBackend)
+    """
+    name = name or os.environ.get("FREEZAM_BACKEND", "postgres")
+    if name == "sqlite" and "path" not in options:
+        options["path"] = os.environ.get("FREEZAM_SQLITE_PATH", "freezam.db")
+    backend = BACKENDS[name](**options)
+    logger.info('Opened ' + name + ' backend')
+    return(backend)
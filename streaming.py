@@ -0,0 +1,268 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 18, 2020
+### Use: Real-time recognition from a stream of audio blocks (microphone, file or generator)
+#########################################
+
+## NOTE: To run, use: python freezam.py fast_search --source="stream" --epsilon=50000 --method="five"
+## Or from python, with any iterable of audio blocks as the source:
+#  streaming.recognize_stream(streaming.file_source("snippets/jarofhearts_snippet.wav", realtime = True), 44100, "five", 50000)
+
+import time
+import queue
+import logging
+import numpy as np
+
+import spectral_analysis
+import database_manager
+import profiling
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the most recent samples of a stream. Positions are counted from the start of the stream,
+    so a window is read by where it starts rather than by where it sits in the buffer.
+    """
+
+    def __init__(self, capacity, dtype = np.float32):
+        self.data = np.zeros(capacity, dtype = dtype)
+        self.capacity = capacity
+        self.end = 0
+
+    def write(self, block):
+        """Appends samples, overwriting the oldest ones once the buffer is full."""
+        block = np.asarray(block, dtype = self.data.dtype)[-self.capacity:]
+        start = self.end % self.capacity
+        first = min(len(block), self.capacity - start)
+        self.data[start:start + first] = block[:first]
+        self.data[:len(block) - first] = block[first:]
+        self.end += len(block)
+
+    def read(self, start, length):
+        """Returns a copy of the samples from position start (counted from the start of the stream) on."""
+        if start < self.end - self.capacity or start + length > self.end:
+            raise ValueError("Samples " + str(start) + " to " + str(start + length) + " are not in the buffer")
+        return(np.take(self.data, np.arange(start, start + length) % self.capacity))
+
+
+class Decimator:
+    """
+    Downsamples a stream by an integer factor as it arrives, with the anti-aliasing filter of scipy.signal.resample_poly,
+    so the samples it returns are the ones spectral_analysis.decimate_series returns for the whole stream at once.
+    An output sample needs the input up to half a filter past it, so the last ones only come out when the stream is flushed.
+    """
+
+    def __init__(self, factor, dtype = np.float32):
+        self.factor, self.dtype = factor, dtype
+        self.received = 0
+        self.produced = 0
+        if factor == 1:
+            return
+        # scipy.signal is slow to import, so it is only imported when decimating
+        from scipy import signal
+        self.half_len = 10*factor
+        self.taps = signal.firwin(2*self.half_len + 1, 1/factor, window = ("kaiser", 5.0))[::-1]
+        # input from position produced*factor - half_len on, with zeros before the stream
+        self.pending = np.zeros(self.half_len)
+
+    def emit(self, last):
+        """Function returns every output sample whose filter ends at input position last or before."""
+        count = max(0, (last - self.half_len)//self.factor + 1 - self.produced)
+        if not count:
+            return(np.zeros(0, dtype = self.dtype))
+        length = (count - 1)*self.factor + len(self.taps)
+        frames = np.lib.stride_tricks.sliding_window_view(self.pending[:length], len(self.taps))[::self.factor]
+        self.pending = self.pending[count*self.factor:]
+        self.produced += count
+        return((frames @ self.taps).astype(self.dtype))
+
+    def write(self, block):
+        """Function takes the next input samples and returns the output samples they complete."""
+        block = np.asarray(block)
+        self.received += len(block)
+        if self.factor == 1:
+            self.produced += len(block)
+            return(block)
+        self.pending = np.concatenate([self.pending, block])
+        return(self.emit(self.received - 1))
+
+    def flush(self):
+        """Function returns the remaining output samples, taking the stream to end with zeros (as decimate_series does)."""
+        if self.factor == 1:
+            return(np.zeros(0, dtype = self.dtype))
+        total = -(-self.received//self.factor)
+        self.pending = np.concatenate([self.pending, np.zeros(len(self.taps) + self.factor)])
+        return(self.emit((total - 1)*self.factor + self.half_len))
+
+
+class StreamingRecognizer:
+    """
+    Identifies a stream as it arrives: blocks of any size fill a ring buffer, each h-second window is fingerprinted and looked up
+    as soon as its last sample arrives (every delta seconds), and votes are counted as in database_manager.progressive_identify.
+    With decimation the stream is decimated as it arrives, before the ring buffer, so its windows match those of the whole song.
+    """
+
+    def __init__(self, samplerate, method, epsilon, index = None, h = 5, delta = 1, alpha = .01, threshold = .05):
+        if method not in database_manager.FINGERPRINT_COLUMNS:
+            raise ValueError("Streaming needs a fingerprint method the database stores (" + ", ".join(database_manager.FINGERPRINT_COLUMNS) + "), not " + str(method))
+        self.samplerate, self.method, self.epsilon, self.index = samplerate, method, epsilon, index
+        self.alpha, self.threshold = alpha, threshold
+        # With decimation the buffer holds the stream downsampled, as compute_fingerprints does for the whole song
+        self.factor = spectral_analysis.decimation_factor(samplerate, method, h = h) if spectral_analysis.DECIMATE else 1
+        self.decimator = Decimator(self.factor)
+        self.rate = samplerate//self.factor
+        self.window_length, self.hop = h*self.rate, delta*self.rate
+        self.hamming_window = spectral_analysis.periodic_window("hamming", self.window_length)
+        # a hop of input can complete a little more than a hop of output, since the decimator lags behind
+        self.buffer = RingBuffer(self.window_length + 2*self.hop)
+        self.received = 0
+        self.next_window = 0
+        self.tally = database_manager.new_tally()
+        self.decisive = False
+
+    def feed(self, block):
+        """
+        Function adds a block of samples (mono, or frames x channels) and processes every window it completes.
+
+        Inputs: block (numpy.ndarray)
+
+        Outputs: the result (dictionary, see database_manager.tally_result) once the answer is decisive, else None
+        """
+        block = spectral_analysis.to_mono(np.asarray(block))
+        # Write a hop at a time so no window is overwritten before it is processed, however large the block
+        step = self.hop*self.factor
+        for start in range(0, len(block), step):
+            self.buffer.write(self.decimator.write(block[start:start + step]))
+            self.received += len(block[start:start + step])
+            self.process_windows()
+        return(self.result() if self.decisive else None)
+
+    def finish(self):
+        """
+        Function processes the windows left once the stream has ended (the decimator holds back the last few samples).
+
+        Inputs: None
+
+        Outputs: the result (dictionary, see result)
+        """
+        if not self.decisive:
+            self.buffer.write(self.decimator.flush())
+            self.process_windows()
+        return(self.result())
+
+    def process_windows(self):
+        """Function processes every complete window, stopping once the answer is decisive."""
+        # A window must also be complete in the full-rate stream: the decimator rounds the length up
+        while (not self.decisive and self.next_window + self.window_length <= self.buffer.end
+               and (self.next_window + self.window_length)*self.factor <= self.received):
+            self.process_window(self.buffer.read(self.next_window, self.window_length))
+            self.next_window += self.hop
+
+    @profiling.timed("streaming.process_window")
+    def process_window(self, window):
+        """Function fingerprints one window, looks it up and counts its vote."""
+        freq, power_densities = spectral_analysis.get_periodogram_batch(self.hamming_window*window, self.rate)
+        fingerprints = np.asarray(spectral_analysis.FINGERPRINT_METHODS[self.method](power_densities, freq), dtype = np.float64)
+        matches = database_manager.nearest_fingerprints(fingerprints, self.method, index = self.index)
+        self.decisive = database_manager.count_votes(self.tally, matches, self.epsilon, alpha = self.alpha, threshold = self.threshold)
+
+    def result(self):
+        """
+        Function returns the answer so far, with the seconds of audio it took.
+
+        Inputs: None
+
+        Outputs: Dictionary, see database_manager.tally_result, plus decisive (boolean) and audio_seconds (float)
+        """
+        result = database_manager.tally_result(self.tally, threshold = self.threshold)
+        result.update({"decisive": self.decisive, "audio_seconds": self.received/self.samplerate})
+        return(result)
+
+
+def recognize_stream(source, samplerate, method, epsilon, index = None, max_seconds = None, **options):
+    """
+    Function identifies a stream of audio blocks, and stops reading it as soon as the answer is decisive.
+
+    Inputs: source (iterable of numpy.ndarray blocks, e.g. microphone_source, file_source or any generator)
+            samplerate (integer, of the source)
+            method (str, one or five), epsilon (float)
+            index (dictionary from database_manager.build_index for the same method, optional)
+            max_seconds (float, stop after this much audio, default when the source ends)
+            options (keyword arguments of StreamingRecognizer: h, delta, alpha, threshold)
+
+    Outputs: Dictionary, see StreamingRecognizer.result, plus seconds (float, wall time until the answer)
+    """
+    start = time.perf_counter()
+    recognizer = StreamingRecognizer(samplerate, method, epsilon, index = index, **options)
+    for block in source:
+        if recognizer.feed(block) is not None or (max_seconds is not None and recognizer.received >= max_seconds*samplerate):
+            break
+    else:
+        recognizer.finish()
+    if hasattr(source, "close"):
+        source.close()
+    result = recognizer.result()
+    result["seconds"] = time.perf_counter() - start
+    logger.info('Stream answered after ' + str(round(result["audio_seconds"], 1)) + 's of audio (' + str(result["windows"]) + ' windows)')
+    return(result)
+
+
+def microphone_source(samplerate = 44100, block_seconds = .25, channels = 1, max_seconds = 30):
+    """
+    Function streams blocks from the microphone: sounddevice calls back with each block, which is queued for the recognizer.
+    Recording stops when the generator is closed (as recognize_stream does once it has an answer) or after max_seconds.
+
+    Inputs: samplerate (integer), block_seconds (float, length of each block)
+            channels (integer), max_seconds (float)
+
+    Outputs: Generator of blocks (numpy.ndarray, frames x channels)
+    """
+    # sounddevice loads the audio drivers, so it is only imported when recording
+    import sounddevice as sd
+    blocks = queue.Queue()
+
+    def callback(indata, frames, time_info, status):
+        if status:
+            logger.warning('Audio input: ' + str(status))
+        blocks.put(indata.copy())
+
+    with sd.InputStream(samplerate = samplerate, blocksize = int(block_seconds*samplerate), channels = channels, dtype = 'int16', callback = callback):
+        logger.info("Listening now!")
+        received = 0
+        while received < max_seconds*samplerate:
+            block = blocks.get()
+            received += len(block)
+            yield(block)
+
+
+def file_source(path, block_seconds = .25, realtime = False):
+    """
+    Function streams a WAV in blocks, as a stand-in for the microphone.
+
+    Inputs: path (str, path to a WAV)
+            block_seconds (float, length of each block)
+            realtime (boolean, wait between blocks as if they were being recorded)
+
+    Outputs: Generator of blocks (numpy.ndarray)
+    """
+    samplerate, series = spectral_analysis.analyze_song(path)
+    return(array_source(series, samplerate, block_seconds = block_seconds, realtime = realtime))
+
+
+def array_source(series, samplerate, block_seconds = .25, realtime = False):
+    """
+    Function streams a series already in memory in blocks (see file_source).
+
+    Inputs: series (numpy.ndarray), samplerate (integer)
+            block_seconds (float), realtime (boolean)
+
+    Outputs: Generator of blocks (numpy.ndarray)
+    """
+    block_length = max(1, int(block_seconds*samplerate))
+    for start in range(0, len(series), block_length):
+        if realtime:
+            time.sleep(block_seconds)
+        yield(series[start:start + block_length])
@@ -11,19 +11,109 @@ import pytest
 import audio_processing
 import spectral_analysis
 import database_manager
+import fingerprint_index
+import storage_backends
 import random
 import math
-import psycopg2
-import credentials
+import numpy as np
+from scipy import signal
+from scipy.spatial import distance
+from scipy.io import wavfile
+import os
+import sys
+import logging
+import sqlite3
 
 
-conn = psycopg2.connect(
-    host="sculptor.stat.cmu.edu",
-    database=credentials.DB_USER,
-    user=credentials.DB_USER,
-    password=credentials.DB_PASSWORD
-)
-cur = conn.cursor()
+@pytest.fixture(autouse = True)
+def fingerprint_cache_dir(tmp_path, monkeypatch):
+    """
+    Fixture gives every test its own fingerprint cache, so the suite never writes to ./fingerprint_cache
+    or reads entries left by earlier runs (worker processes inherit it through FREEZAM_CACHE_DIR).
+    """
+    cache_dir = str(tmp_path / "fingerprint_cache")
+    monkeypatch.setenv("FREEZAM_CACHE_DIR", cache_dir)
+    monkeypatch.setattr(spectral_analysis.fingerprint_cache, "CACHE_DIR", cache_dir)
+    monkeypatch.setattr(spectral_analysis.fingerprint_cache, "_cache_bytes", None)
+    return(cache_dir)
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    """
+    Fixture points database_manager at a fresh SQLite database in tmp_path for one test, then closes it and puts the previous backend back.
+    """
+    monkeypatch.setattr(database_manager, "backend", database_manager.backend)
+    backend = database_manager.set_backend(storage_backends.get_backend("sqlite", path = str(tmp_path / "freezam.db")))
+    yield backend
+    backend.close()
+
+
+def count_songs(title, artist, album):
+    """Function counts the songs in the current backend with the given title, artist and album."""
+    return(len([row for row in database_manager.backend.list_songs() if tuple(row[1:4]) == (title, artist, album)]))
+
+
+def write_tone_wav(path, seconds = 40, seed = 0, channels = 2):
+    """
+    Function writes a synthetic 16-bit WAV (a few tones whose pitches change every second, over quiet noise) for the tests
+    that need a song, so they don't depend on the songs in WAVs/.
+
+    Inputs: path (str), seconds (integer), seed (integer), channels (integer)
+
+    Outputs: path (str)
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(44100*seconds)/44100
+    pitches = rng.uniform(100, 4000, size = (seconds, 3))[(t).astype(int)]
+    tones = sum(amplitude*np.sin(2*np.pi*pitches[:, index_tone]*t) for index_tone, amplitude in enumerate([1, .6, .3]))
+    data = np.stack([tones + .05*rng.randn(len(t)) for _ in range(channels)], axis = 1)
+    wavfile.write(path, 44100, (data/np.abs(data).max()*20000).astype(np.int16))
+    return(path)
+
+
+def baseline_periodograms(series, samplerate, h, delta):
+    """Function windows a series and computes one scipy periodogram per window, as get_window and get_periodogram originally did."""
+    from skimage import util
+    windows = np.multiply(signal.get_window("hamming", h*samplerate), util.view_as_windows(np.asarray(series, dtype = np.float64), window_shape = (h*samplerate,), step = delta*samplerate))
+    periodograms = [signal.periodogram(x = window, fs = samplerate, scaling = "spectrum") for window in windows]
+    return([np.array([freq for freq, _ in periodograms]), np.array([pd for _, pd in periodograms])])
+
+
+def baseline_fingerprints(freq, pd):
+    """Function computes fingerprints one and five window by window, as the original fingerprint_one and fingerprint_five did."""
+    finger1, finger5 = [], []
+    for index1 in range(len(pd)):
+        peaks,_ = signal.find_peaks(pd[index1])
+        top3 = peaks[np.argpartition(pd[index1][peaks], -3)[-3:]]
+        finger1.append(np.sort(freq[index1][top3]/freq[index1][peaks].max()))
+        pd_short = pd[index1][freq[index1] <= 5000]
+        finger5.append([max(pd_short[round(2**(-(8 - octave_iter))*5000/2):round(2**(-(8 - octave_iter) + 1)*5000/2)]) for octave_iter in range(8)])
+    return([np.array(finger1), np.array(finger5)])
+
+
+@pytest.mark.parametrize("offset,length", [(0, 44100), (44100*30, 44100*12), (1234, None)])
+def test_analyze_song_excerpt(tmp_path, offset, length):
+    """
+    Function tests that analyze_song() reads the same samples for an excerpt as slicing the whole song, and the same series
+    as the original analyze_song (the mean of the channels of the whole WAV).
+
+    Inputs: offset (integer, first sample of the excerpt)
+            length (integer, number of samples in the excerpt)
+
+    Outputs: assertion        
+    """
+    path = write_tone_wav(str(tmp_path / "song.wav"), seconds = 45)
+    samplerate,series_results = spectral_analysis.analyze_song(path)
+    samplerate_excerpt,excerpt = spectral_analysis.analyze_song(path, offset = offset, length = length)
+    end = len(series_results) if length is None else offset + length
+
+    assert samplerate_excerpt == samplerate
+    assert series_results.dtype == np.float32
+    assert np.array_equal(excerpt, series_results[offset:end])
+    assert np.array_equal(series_results, np.mean(wavfile.read(path)[1], axis = 1))
+    assert spectral_analysis.song_info(path) == [samplerate, len(series_results)]
+
 
 @pytest.mark.parametrize("path,h,delta", [("WAVs/betty_Taylor Swift_folklore_2020.wav", 5, 1), ("WAVs/Cruel Summer_Taylor Swift_Lover_2019.wav", 10, 3), ("WAVs/Paper Rings_Taylor Swift_Lover_2019.wav", 12, 7)])
 def test_get_window(path,h,delta):
@@ -66,6 +156,30 @@ def test_get_periodogram(path,h,delta):
     assert (len(pd[1])) == ((samplerate*h/2) + 1)
 
 
+@pytest.mark.parametrize("h,delta", [(5, 1), (10, 3)])
+def test_get_periodogram_batch(tmp_path, h, delta):
+    """
+    Function tests that get_periodogram_batch() matches the original per-window scipy periodogram of every window.
+
+    Inputs: h (integer, length of window in seconds)
+            delta (integer, length of window step in seconds)
+
+    Outputs: assertion        
+    """
+    samplerate,series_results = spectral_analysis.analyze_song(write_tone_wav(str(tmp_path / "song.wav"), seconds = 30))
+    windows = spectral_analysis.get_window(series = series_results, sample_rate = samplerate, h = h, delta = delta)
+    freq,pd = spectral_analysis.get_periodogram_batch(windows,samplerate)
+    freq_ref,pd_ref = baseline_periodograms(series_results, samplerate, h, delta)
+    assert pd.shape == pd_ref.shape
+    for index1 in range(len(pd_ref)):
+        assert np.allclose(freq, freq_ref[index1])
+        assert np.allclose(pd[index1], pd_ref[index1], rtol = 1e-7, atol = 1e-12*pd_ref[index1].max())
+
+    freq32,pd32 = spectral_analysis.get_periodogram_batch(windows,samplerate,dtype = np.float32)
+    assert pd32.dtype == np.float32
+    assert np.allclose(pd32, pd, rtol = 1e-3, atol = 1e-5*pd.max())
+
+
 @pytest.mark.parametrize("path,h,delta", [("WAVs/betty_Taylor Swift_folklore_2020.wav", 5, 1), ("WAVs/Cruel Summer_Taylor Swift_Lover_2019.wav", 10, 3), ("WAVs/Paper Rings_Taylor Swift_Lover_2019.wav", 12, 7)])
 def test_fingerprint_two(path,h,delta):
     """
@@ -89,6 +203,85 @@ def test_fingerprint_two(path,h,delta):
     assert (len(fingers_two[1]) == 2000*h + 1)
 
 
+def test_fingerprint_kernels(tmp_path):
+    """
+    Function tests the matrix fingerprint_one() and fingerprint_five() against a per-window computation, and against the
+    original per-window fingerprint functions.
+
+    Inputs: Nothing
+
+    Outputs: assertion        
+    """
+    samplerate,series_results = spectral_analysis.analyze_song(write_tone_wav(str(tmp_path / "song.wav"), seconds = 30))
+    windows = spectral_analysis.get_window(series = series_results, sample_rate = samplerate, h=5,delta=1)
+    freq,pd = spectral_analysis.get_periodogram_batch(windows,samplerate)
+    fingers_one = spectral_analysis.fingerprint_one(pd,freq)
+    fingers_five = spectral_analysis.fingerprint_five(pd,freq)
+    assert isinstance(fingers_one, np.ndarray) and fingers_one.shape == (len(windows), 3)
+    assert isinstance(fingers_five, np.ndarray) and fingers_five.shape == (len(windows), 8)
+
+    pd_short_length = int(np.sum(freq <= 5000))
+    for index1 in range(len(windows)):
+        peaks,_ = signal.find_peaks(pd[index1])
+        top3 = peaks[np.argsort(pd[index1][peaks])[-3:]]
+        assert np.array_equal(fingers_one[index1], freq[top3]/freq[peaks].max())
+        for octave_iter, (start_freq, end_freq) in enumerate(spectral_analysis.octave_bands()):
+            assert fingers_five[index1][octave_iter] == max(pd[index1][:pd_short_length][start_freq:end_freq])
+    finger1_ref, finger5_ref = baseline_fingerprints(np.tile(freq, (len(pd), 1)), pd)
+    assert np.array_equal(np.sort(fingers_one, axis = 1), finger1_ref)
+    assert np.array_equal(fingers_five, finger5_ref)
+
+
+@pytest.mark.parametrize("block_size", [1, 16])
+def test_compute_fingerprints(tmp_path, block_size):
+    """
+    Function tests that the block-at-a-time compute_fingerprints() gives the same fingerprints as windowing the whole song at once,
+    and as the original pipeline (per-window periodograms and fingerprints), also from the memory-mapped stereo samples of the WAV.
+
+    Inputs: block_size (integer, number of windows per block)
+
+    Outputs: assertion        
+    """
+    samplerate,series_results = spectral_analysis.analyze_song(write_tone_wav(str(tmp_path / "song.wav"), seconds = 30))
+    windows = spectral_analysis.get_window(series = series_results, sample_rate = samplerate, h=5,delta=1)
+    freq,pd = spectral_analysis.get_periodogram(series_results,windows,samplerate,h=5,delta=1)
+    fingerprints = spectral_analysis.compute_fingerprints(series_results, samplerate, methods = ("one", "five"), block_size = block_size)
+
+    assert np.array_equal(fingerprints["one"], np.array(spectral_analysis.fingerprint_one(pd,freq)))
+    assert np.allclose(fingerprints["five"], np.array(spectral_analysis.fingerprint_five(pd,freq)))
+    finger1_ref, finger5_ref = baseline_fingerprints(*baseline_periodograms(series_results, samplerate, 5, 1))
+    assert np.allclose(np.sort(fingerprints["one"], axis = 1), finger1_ref)
+    assert np.allclose(fingerprints["five"], finger5_ref, rtol = 1e-5)
+    # each block of windows is downmixed on its own, to exactly the same fingerprints and content hash
+    _, data = spectral_analysis._read_wav(str(tmp_path / "song.wav"))
+    assert data.ndim == 2
+    mapped = spectral_analysis.compute_fingerprints(data, samplerate, methods = ("one", "five"), block_size = block_size)
+    assert np.array_equal(mapped["one"], fingerprints["one"]) and np.array_equal(mapped["five"], fingerprints["five"])
+    assert spectral_analysis.content_hash(data, samplerate) == spectral_analysis.content_hash(series_results, samplerate)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_match_fingerprints(chunk_size):
+    """
+    Function tests that match_fingerprints() gives the euclidean distance between every song and snippet window, in any chunk size.
+
+    Inputs: chunk_size (integer, number of song windows compared at once)
+
+    Outputs: assertion        
+    """
+    snip = np.random.RandomState(1).rand(11, 8)
+    song = np.random.RandomState(2).rand(40, 8)
+    dist = spectral_analysis.match_fingerprints(snip, song, chunk_size = chunk_size)
+    assert dist.shape == (40, 11)
+    for index1 in range(11):
+        for index2 in range(40):
+            assert math.isclose(dist[index2, index1], distance.euclidean(snip[index1], song[index2]))
+
+    squared = spectral_analysis.match_fingerprints(snip, song, chunk_size = chunk_size, squared = True)
+    assert np.allclose(squared, dist**2)
+    assert spectral_analysis.match_fingerprints(snip, song, dtype = np.float32).dtype == np.float32
+
+
 def test_return_match():
     """
     Function tests the return_match() function using various assertions. NOTE: I need to add tests here
@@ -111,6 +304,69 @@ def test_return_match():
     assert (spectral_analysis.return_match(df_dist,150) == "Match!")
 
 
+def test_score_alignment():
+    """
+    Function tests that score_alignment() finds the offset where a snippet was cut from a song.
+
+    Inputs: Nothing
+
+    Outputs: assertion        
+    """
+    song = np.random.RandomState(3).rand(60, 8)
+    snip = song[17:29] + 1e-3
+    dist = spectral_analysis.match_fingerprints(snip, song)
+    offset, score, hit_ratio = spectral_analysis.score_alignment(dist, 0.01)
+    assert (offset, score, hit_ratio) == (17, 12, 1.0)
+
+    _, _, hit_ratio_early = spectral_analysis.score_alignment(dist, 0.01, early_stop = True, block_size = 1)
+    assert hit_ratio_early >= .05
+    assert spectral_analysis.return_match(dist, 0.01) == "Match!"
+    assert spectral_analysis.return_match(dist, 1e-9) == "Not a match."
+
+
+def test_score_catalog():
+    """
+    Function tests that score_catalog() scores every song of a catalog the same way score_alignment() scores each song.
+
+    Inputs: Nothing
+
+    Outputs: assertion        
+    """
+    lengths = [30, 5, 60, 12]
+    catalog = np.random.RandomState(4).rand(sum(lengths), 8)
+    song_starts = np.cumsum([0] + lengths[:-1])
+    snip = catalog[song_starts[2] + 20:song_starts[2] + 32] + 1e-3
+    best_offset, score, hit_ratio = spectral_analysis.score_catalog(snip, catalog, song_starts, 0.01, chunk_size = 16)
+    for index1 in range(len(lengths)):
+        song = catalog[song_starts[index1]:song_starts[index1] + lengths[index1]]
+        expected = spectral_analysis.score_alignment(spectral_analysis.match_fingerprints(snip, song), 0.01)
+        assert [best_offset[index1], score[index1], hit_ratio[index1]] == expected
+    assert np.argmax(hit_ratio) == 2 and best_offset[2] == 20
+
+
+def test_fingerprint_index():
+    """
+    Function tests that the KD-tree index finds the same nearest fingerprints as a brute-force search.
+
+    Inputs: Nothing
+
+    Outputs: assertion        
+    """
+    catalog = np.random.RandomState(5).rand(500, 8)
+    song_ids = np.repeat(np.arange(1, 11), 50)
+    index = fingerprint_index.build_index(song_ids, np.arange(500), catalog, song_details = {3: ("betty", "Taylor Swift")})
+    snip = catalog[110:121] + 1e-4
+    found_songs, found_ids, distances = fingerprint_index.query_index(index, snip, k = 2)
+    dist = spectral_analysis.match_fingerprints(snip, catalog)
+    assert np.array_equal(found_ids, np.argsort(dist, axis = 0)[:2].T)
+    assert np.allclose(distances, np.sort(dist, axis = 0)[:2].T)
+    assert np.all(found_songs[:, 0] == 3)
+
+    matches = fingerprint_index.nearest_matches(index, snip)
+    assert [match[0] for match in matches] == list(range(11))
+    assert all(match[3:5] == ("betty", "Taylor Swift") for match in matches)
+
+
 def test_slow_search():
     """
     Function tests the slow_search() function using various assertions. 
@@ -217,9 +473,7 @@ def test_add_remove_song():
               artist = "Taylor Swift",
               album = "folklore")
 
-    cur.execute("SELECT COUNT(*) from songs where title = %s and artist = %s and album = %s;", ("betty", "Taylor Swift", "folklore")) 
-    is_song_there = cur.fetchall()  
-    assert is_song_there[0][0] == 0        
+    assert count_songs("betty", "Taylor Swift", "folklore") == 0        
     
     database_manager.add_function(path = "Test_MP3s/betty_Taylor Swift_folklore_2020.mp3", 
               title = "betty", 
@@ -229,7 +483,566 @@ def test_add_remove_song():
               source = "local")
 
 
-    cur.execute("SELECT COUNT(*) from songs where title = %s and artist = %s and album = %s;", ("betty", "Taylor Swift", "folklore")) 
-    is_song_there_now = cur.fetchall() 
-    assert is_song_there_now[0][0] != 0            
+    assert count_songs("betty", "Taylor Swift", "folklore") != 0            
           
+
+
+def test_constellation_hashes():
+    """
+    Function tests that a snippet's constellation hashes vote for the song it was cut from, at the offset it was cut at.
+    """
+    rng = np.random.RandomState(0)
+    songs = [rng.randn(44100*20) for _ in range(3)]
+    hashes, song_ids, anchor_times = [], [], []
+    for song_id, song in enumerate(songs):
+        song_hashes, song_times = spectral_analysis.constellation_hashes(song)
+        assert song_hashes.dtype == np.int32 and np.all(np.diff(song_times) >= 0)
+        hashes.append(song_hashes)
+        anchor_times.append(song_times)
+        song_ids.append(np.full(len(song_hashes), song_id))
+    hashes, song_ids, anchor_times = np.concatenate(hashes), np.concatenate(song_ids), np.concatenate(anchor_times)
+
+    snippet = songs[1][512*300:512*300 + 44100*5] + .1*rng.randn(44100*5)
+    query_hashes, query_times = spectral_analysis.constellation_hashes(snippet)
+    found = np.isin(hashes, query_hashes)
+    matched_songs, best_offset, score = spectral_analysis.score_hashes(query_hashes, query_times, hashes[found], song_ids[found], anchor_times[found])
+    best = np.argmax(score)
+    assert matched_songs[best] == 1 and best_offset[best] == 300
+    assert score[best] > 10*np.sort(score)[-2]
+
+
+@pytest.mark.parametrize("path,details", [("WAVs/betty_Taylor Swift_folklore_2020.wav", ["betty", "Taylor Swift", "folklore", "2020"]),
+                                          ("C:/music/Song_Artist_Album_1999_remaster.wav", ["Song", "Artist", "Album", "1999"])])
+def test_parse_filename(path,details):
+    """
+    Function tests that parse_filename() reads title, artist, album and date from the filename convention.
+    """
+    assert database_manager.parse_filename(path) == details
+
+
+def test_parse_filename_bad():
+    """
+    Function tests that parse_filename() rejects filenames which do not follow the convention.
+    """
+    with pytest.raises(ValueError):
+        database_manager.parse_filename("WAVs/betty.wav")
+
+
+def test_sqlite_backend(tmp_path):
+    """
+    Function tests the embedded SQLite backend end to end: writes (and re-writes) songs, lists them, loads the catalog and searches it.
+    """
+    backend = storage_backends.get_backend("sqlite", path = str(tmp_path / "freezam.db"))
+    backend.create_tables()
+    rng = np.random.RandomState(0)
+    songs = {}
+    for index_song in range(3):
+        fingerprints1 = np.sort(rng.rand(50, 3), axis = 1)
+        fingerprints5 = rng.lognormal(8, 2, (50, 8))
+        hashes = (rng.randint(0, 2**26, 200).astype(np.int32), np.sort(rng.randint(0, 1000, 200)).astype(np.int32))
+        song_id, inserted, _ = backend.write_song("song " + str(index_song), "artist", "album", "path.wav", 44100, "2020", "local",
+                                                  fingerprints1, fingerprints5, "hash " + str(index_song), hashes = hashes)
+        assert inserted
+        songs[song_id] = fingerprints5
+    # the same audio again only updates its details
+    song_id, inserted, _ = backend.write_song("renamed", "artist", "album", "path.wav", 44100, "2020", "local",
+                                              fingerprints1, fingerprints5, "hash 2", hashes = hashes)
+    assert not inserted and len(backend.list_songs()) == 3
+    assert backend.song_details()[song_id] == ("renamed", "artist")
+
+    song_ids, fingerprint_ids, catalog = backend.load_catalog("five")
+    assert catalog.shape == (150, 8)
+    for song_id, fingerprints5 in songs.items():
+        assert np.array_equal(catalog[song_ids == song_id], fingerprints5)
+        assert np.array_equal(fingerprint_ids[song_ids == song_id], np.arange(50))
+
+    matches = backend.nearest_fingerprints(fingerprints5[10:20], "five")
+    assert [row[1] for row in matches] == [song_id]*10
+    assert all(row[2] == 10 + row[0] and row[5] == 0 for row in matches)
+
+    # every stored copy of a looked-up hash comes back once, however often the snippet repeats it
+    found_hashes, found_songs, found_times = backend.lookup_hashes(np.r_[hashes[0][:20], hashes[0][:20]])
+    assert len(found_hashes) >= 20 and set(found_hashes.tolist()) == set(hashes[0][:20].tolist())
+    own = found_songs == song_id
+    assert sorted(zip(found_hashes[own].tolist(), found_times[own].tolist())) == sorted(zip(hashes[0][:20].tolist(), hashes[1][:20].tolist()))
+
+    # a batch is one transaction: a bad song rolls back the whole batch
+    with pytest.raises(Exception):
+        backend.write_songs([dict(title = "batch", artist = "artist", album = "album", path = "path.wav", samplerate = 44100, date = "2020",
+                                  source = "local", fingerprints1 = fingerprints1, fingerprints5 = fingerprints5, content_hash = "batch"),
+                             dict(title = "", artist = "artist", album = "album", path = "path.wav", samplerate = 44100, date = "2020",
+                                  source = "local", fingerprints1 = fingerprints1, fingerprints5 = fingerprints5, content_hash = "bad")])
+    assert len(backend.list_songs()) == 3
+
+    backend.remove_song("renamed", "artist", "album")
+    assert len(backend.list_songs()) == 2 and len(backend.load_catalog("five")[0]) == 100
+    assert song_id not in backend.lookup_hashes(hashes[0])[1].tolist()
+    assert song_id not in [row[1] for row in backend.nearest_fingerprints(fingerprints5[10:20], "five")]
+    backend.close()
+
+
+def test_repeated_windows(tmp_path):
+    """
+    Function tests that windows repeated within a song (silence, a looped bar) are all stored, so fingerprint_id stays the
+    window's position in the song and offset scoring lines up after the first repeat.
+    """
+    rng = np.random.RandomState(0)
+    fingerprints1 = np.sort(rng.rand(40, 3), axis = 1)
+    fingerprints5 = rng.lognormal(8, 2, (40, 8))
+    fingerprints1[:10], fingerprints5[:10] = fingerprints1[0], fingerprints5[0]
+    fingerprints1[20:25], fingerprints5[20:25] = fingerprints1[15:20], fingerprints5[15:20]
+    row_hashes = storage_backends.fingerprint_row_hashes(fingerprints1, fingerprints5)
+    assert len(set(row_hashes)) == 40 and row_hashes == storage_backends.fingerprint_row_hashes(fingerprints1, fingerprints5)
+    backend = storage_backends.get_backend("sqlite", path = str(tmp_path / "freezam.db"))
+    backend.create_tables()
+    for _ in range(2):
+        song_id, _, _ = backend.write_song("song", "artist", "album", "path.wav", 44100, "2020", "local", fingerprints1, fingerprints5, "hash")
+    song_ids, fingerprint_ids, catalog = backend.load_catalog("five")
+    assert np.array_equal(fingerprint_ids, np.arange(40)) and np.array_equal(catalog, fingerprints5)
+    assert [row[2] for row in backend.nearest_fingerprints(fingerprints5[30:35], "five")] == list(range(30, 35))
+    backend.close()
+
+
+def test_missing_schema(tmp_path, caplog):
+    """
+    Function tests that a database which hasn't been through init is noticed: opening it warns, and its errors are told apart.
+    """
+    lazy = storage_backends.LazyBackend("sqlite", path = str(tmp_path / "freezam.db"))
+    with caplog.at_level(logging.WARNING, logger = "storage_backends"):
+        with pytest.raises(sqlite3.OperationalError) as error:
+            lazy.list_songs()
+    assert "freezam.py init" in caplog.text
+    assert storage_backends.is_schema_error(error.value)
+    assert not storage_backends.is_schema_error(sqlite3.OperationalError("database is locked"))
+    assert "songs" in lazy.missing_schema()
+    lazy.create_tables()
+    assert lazy.missing_schema() == [] and lazy.list_songs() == []
+    lazy.close()
+
+
+def test_add_dir(tmp_path, sqlite_backend):
+    """
+    Function tests add_dir on a directory with a corrupt file and a song the database rejects (an empty title): the worker
+    processes fingerprint the rest, and the writer retries the failed batch one song at a time so only the bad song is lost.
+    """
+    song_dir = tmp_path / "songs"
+    song_dir.mkdir()
+    good = [write_tone_wav(str(song_dir / ("dir song " + str(index_song) + "_artist_album_2020.wav")), seconds = 10, seed = index_song)
+            for index_song in range(3)]
+    write_tone_wav(str(song_dir / "_artist_album_2020.wav"), seconds = 10, seed = 3)
+    with open(str(song_dir / "corrupt_artist_album_2020.wav"), "wb") as f:
+        f.write(b"RIFF not really a wav")
+    summary = database_manager.add_dir(str(song_dir), workers = 2, batch_size = 8)
+    assert (summary["files"], summary["added"], summary["updated"], summary["failed"]) == (5, 3, 0, 2)
+    assert sorted(row[1] for row in sqlite_backend.list_songs()) == ["dir song 0", "dir song 1", "dir song 2"]
+    assert summary["fingerprints"] == sum(len(spectral_analysis.fingerprint_file(path)["fingerprints1"]) for path in good)
+
+
+def test_recommend(tmp_path, sqlite_backend):
+    """
+    Function tests that recommend() ranks the catalog songs a library is made of first, without changing the working directory.
+    """
+    rng = np.random.RandomState(0)
+    library = tmp_path / "library"
+    library.mkdir()
+    songs = [(rng.randn(44100*12)*3000).astype(np.int16) for _ in range(3)]
+    for index_song, song in enumerate(songs):
+        path = str(tmp_path / ("song " + str(index_song) + "_artist " + str(index_song) + "_album_2020.wav"))
+        wavfile.write(path, 44100, song)
+        title, artist, album, date = database_manager.parse_filename(path)
+        database_manager.write_song(title, artist, album, path, date = date, source = "local", **spectral_analysis.fingerprint_file(path))
+    # the library holds song 1 twice and song 2 once
+    for index_file, index_song in enumerate([1, 1, 2]):
+        wavfile.write(str(library / ("file" + str(index_file) + ".wav")), 44100, songs[index_song])
+    working_directory = os.getcwd()
+    closest_songs, closest_artists = database_manager.recommend(str(library), workers = 1)
+    assert os.getcwd() == working_directory
+    assert list(closest_songs.index) == ["song 1", "song 2"] and closest_songs.iloc[0] == 2*closest_songs.iloc[1]
+    assert list(closest_artists.index) == ["artist 1", "artist 2"]
+
+
+def test_fingerprint_cache(tmp_path, monkeypatch):
+    """
+    Function tests that fingerprint_file() reads an unchanged song back from the fingerprint cache without decoding it,
+    recomputes a song whose file changed, and that eviction empties the cache.
+    """
+    path = str(tmp_path / "song.wav")
+    wavfile.write(path, 44100, (np.random.RandomState(0).randn(44100*12)*3000).astype(np.int16))
+    song = spectral_analysis.fingerprint_file(path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the song was decoded again")
+    with monkeypatch.context() as patch:
+        patch.setattr(spectral_analysis, "analyze_song", fail)
+        cached = spectral_analysis.fingerprint_file(path)
+    assert cached["content_hash"] == song["content_hash"] and cached["samplerate"] == song["samplerate"]
+    assert np.array_equal(cached["fingerprints1"], song["fingerprints1"]) and np.array_equal(cached["fingerprints5"], song["fingerprints5"])
+    assert all(np.array_equal(a, b) for a, b in zip(cached["hashes"], song["hashes"]))
+
+    wavfile.write(path, 44100, (np.random.RandomState(1).randn(44100*12)*3000).astype(np.int16))
+    os.utime(path, ns = (0, 0))
+    assert spectral_analysis.fingerprint_file(path)["content_hash"] != song["content_hash"]
+    assert spectral_analysis.fingerprint_cache.clear() > 0 and spectral_analysis.fingerprint_cache.cache_size() == 0
+
+
+def test_sensitivity_benchmark(tmp_path, sqlite_backend):
+    """
+    Function tests that the sensitivity benchmark is reproducible for a seed and scores excerpts of songs in and not in the database.
+    """
+    import sensitivity_analysis
+    rng = np.random.RandomState(0)
+    for directory, songs in [("in", 2), ("out", 1)]:
+        (tmp_path / directory).mkdir()
+        for index_song in range(songs):
+            path = str(tmp_path / directory / (directory + " song " + str(index_song) + "_artist_album_2020.wav"))
+            wavfile.write(path, 44100, (rng.randn(44100*20)*3000).astype(np.int16))
+            if directory == "in":
+                title, artist, album, date = database_manager.parse_filename(path)
+                database_manager.write_song(title, artist, album, path, date = date, source = "local", **spectral_analysis.fingerprint_file(path))
+    run = lambda: sensitivity_analysis.run_benchmark(database_manager, [str(tmp_path / "in")], [str(tmp_path / "out")], ["five", "constellation"],
+                                                     {"five": [1000, 25000]}, [8], trials = 3, seed = 1)
+    report = run()
+    assert [(result["method"], result["epsilon"]) for result in report["results"]] == [("five", 1000), ("five", 25000), ("constellation", None)]
+    constellation = report["results"][2]
+    assert constellation["trials_in_database"] == 3 and constellation["trials_not_in_database"] == 3
+    assert constellation["precision"] == 1 and constellation["recall"] == 1
+    assert constellation["latency_ms"]["p50"] <= constellation["latency_ms"]["p99"]
+    assert [result["true_positives"] for result in run()["results"]] == [result["true_positives"] for result in report["results"]]
+    # method two isn't stored, so it is refused up front rather than failing in the backend
+    with pytest.raises(ValueError):
+        sensitivity_analysis.run_benchmark(database_manager, [str(tmp_path / "in")], [], ["two"], {}, [8], trials = 1)
+    with pytest.raises(SystemExit):
+        sensitivity_analysis.parser.parse_args(["--methods", "two"])
+
+
+def test_sensitivity_ingest(tmp_path, monkeypatch):
+    """
+    Function tests the benchmark from the command line on a new SQLite file: --ingest adds the songs without an init first.
+    """
+    import json
+    import sensitivity_analysis
+    for directory, songs in [("in", 2), ("out", 1)]:
+        (tmp_path / directory).mkdir()
+        for index_song in range(songs):
+            write_tone_wav(str(tmp_path / directory / (directory + " song " + str(index_song) + "_artist_album_2020.wav")), seconds = 20,
+                           seed = index_song + 10*(directory == "out"))
+    for variable in ["FREEZAM_BACKEND", "FREEZAM_SQLITE_PATH"]:
+        monkeypatch.setenv(variable, os.environ.get(variable, ""))
+    # as in a new process, where database_manager starts with a backend which isn't open yet
+    monkeypatch.setattr(database_manager, "backend", storage_backends.LazyBackend())
+    monkeypatch.setattr(sys, "argv", ["sensitivity_analysis.py", "--backend=sqlite", "--sqlite_path=" + str(tmp_path / "bench.db"), "--ingest",
+                                      "--in_database", str(tmp_path / "in"), "--not_in_database", str(tmp_path / "out"), "--methods", "five",
+                                      "constellation", "--lengths", "8", "--trials", "2", "--output", str(tmp_path / "results.json")])
+    try:
+        sensitivity_analysis.main()
+    finally:
+        database_manager.backend.close()
+    report = json.load(open(str(tmp_path / "results.json")))
+    assert report["settings"]["backend"] == "sqlite"
+    assert [result["method"] for result in report["results"]] == ["five", "constellation"]
+    assert report["results"][1]["recall"] == 1
+
+
+def test_profiling(tmp_path):
+    """
+    Function tests that profiling records the calls, rows and peak memory of each stage only while it is on, and exports a Chrome trace.
+    """
+    import json
+    import profiling
+
+    @profiling.timed("allocate", rows = len)
+    def allocate(n):
+        with profiling.span("inner") as stage:
+            stage.rows = n
+            return(list(np.ones(n)))
+
+    allocate(10)
+    assert "allocate" not in profiling.summary()
+    profiling.enable(memory = True)
+    try:
+        allocate(100000)
+        allocate(10)
+    finally:
+        profiling.disable()
+    allocate(10)
+    stages = profiling.summary()
+    assert stages["allocate"]["calls"] == 2 and stages["allocate"]["rows"] == 100010 and stages["inner"]["rows"] == 100010
+    assert stages["allocate"]["peak_bytes"] >= stages["inner"]["peak_bytes"] >= 800000
+    profiling.export(str(tmp_path / "trace.json"))
+    trace = json.load(open(str(tmp_path / "trace.json")))
+    assert len(trace["traceEvents"]) == 4 and set(trace["stages"]) == {"allocate", "inner"}
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in trace["traceEvents"])
+
+
+def test_server(tmp_path, sqlite_backend):
+    """
+    Function tests that the search server adds, lists and identifies songs (as a WAV body or a path) and rejects bad requests.
+    """
+    import io
+    import json
+    import threading
+    import urllib.request
+    import urllib.error
+    import server
+    httpd = server.make_server(port = 0, methods = ["five", "constellation"])
+    threading.Thread(target = httpd.serve_forever, daemon = True).start()
+    url = "http://127.0.0.1:" + str(httpd.server_address[1])
+    request = lambda path, body = None, headers = {}: json.loads(urllib.request.urlopen(urllib.request.Request(url + path, data = body, headers = headers)).read())
+    try:
+        song = (np.random.RandomState(0).randn(44100*20)*3000).astype(np.int16)
+        path = str(tmp_path / "song.wav")
+        wavfile.write(path, 44100, song)
+        added = request("/add", json.dumps({"path": path, "title": "song", "artist": "artist", "album": "album", "date": "2020"}).encode())
+        assert added["inserted"] and [listed["title"] for listed in request("/list")["songs"]] == ["song"]
+        snippet = io.BytesIO()
+        wavfile.write(snippet, 44100, song[44100*3:44100*13])
+        result = request("/identify?method=five&epsilon=1", snippet.getvalue(), {"Content-Type": "audio/wav"})
+        assert result["match"] and result["title"] == "song" and result["message"] == "Match Found!: song by artist."
+        assert request("/identify", json.dumps({"path": path, "method": "constellation"}).encode())["title"] == "song"
+        with pytest.raises(urllib.error.HTTPError) as error:
+            request("/identify", json.dumps({"path": path, "method": "five"}).encode())
+        assert error.value.code == 400
+        # method two isn't stored in the database
+        with pytest.raises(urllib.error.HTTPError) as error:
+            request("/identify", json.dumps({"path": path, "method": "two", "epsilon": 1}).encode())
+        assert error.value.code == 400
+        with pytest.raises(ValueError):
+            server.make_state(methods = ["two"])
+        with pytest.raises(urllib.error.HTTPError) as error:
+            request("/add", json.dumps({"path": path, "title": "song", "artist": "artist", "album": "album"}).encode())
+        assert error.value.code == 400 and "date" in json.loads(error.value.read())["error"]
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.mark.parametrize("name,length", [("hamming", 44100*5), ("hann", 2048), ("hann", 11)])
+def test_periodic_window(name, length):
+    """
+    Function tests that periodic_window() gives exactly the window scipy.signal.get_window() does.
+    """
+    assert np.array_equal(spectral_analysis.periodic_window(name, length), signal.get_window(name, length))
+
+
+def test_progressive_identify(tmp_path, sqlite_backend):
+    """
+    Function tests that progressive search stops early on a clean excerpt of a song in the database, and searches every window otherwise.
+    """
+    rng = np.random.RandomState(0)
+    songs = [(rng.randn(44100*60)*3000).astype(np.int16) for _ in range(3)]
+    for index_song, song in enumerate(songs[:2]):
+        path = str(tmp_path / ("song " + str(index_song) + "_artist_album_2020.wav"))
+        wavfile.write(path, 44100, song)
+        title, artist, album, date = database_manager.parse_filename(path)
+        database_manager.write_song(title, artist, album, path, date = date, source = "local", **spectral_analysis.fingerprint_file(path))
+    excerpt = songs[1][44100*3:44100*43].astype(np.float32)
+    result = database_manager.progressive_identify(excerpt, 44100, "five", 1)
+    assert result["match"] and result["title"] == "song 1" and result["stopped_early"]
+    assert result["windows"] < result["windows_total"] == 36 and result["p_value"] < .01
+    full = database_manager.identify_matches(database_manager.nearest_fingerprints(spectral_analysis.compute_fingerprints(excerpt, 44100, methods = ("five",))["five"], "five"), 36, 1)
+    assert full["title"] == result["title"]
+    result = database_manager.progressive_identify(songs[2][:44100*40].astype(np.float32), 44100, "five", 1)
+    assert not result["match"] and not result["stopped_early"] and result["windows"] == 36
+    assert database_manager.lead_p_value(0, 0) == 1 and database_manager.lead_p_value(10, 0) == 2**-10
+
+
+def test_streaming_recognizer(tmp_path, sqlite_backend):
+    """
+    Function tests that the ring buffer keeps the latest samples, and that a stream of uneven blocks is identified as soon as
+    enough windows agree (each window matching the catalog's fingerprint of it exactly).
+    """
+    import streaming
+    ring = streaming.RingBuffer(10)
+    ring.write(np.arange(7))
+    ring.write(np.arange(7, 16))
+    assert np.array_equal(ring.read(8, 8), np.arange(8, 16)) and ring.end == 16
+    with pytest.raises(ValueError):
+        ring.read(5, 4)
+    # method two is not stored, so a stream can't be searched with it
+    with pytest.raises(ValueError):
+        streaming.StreamingRecognizer(44100, "two", 1)
+    rng = np.random.RandomState(0)
+    song = (rng.randn(44100*60)*3000).astype(np.int16)
+    path = str(tmp_path / "song_artist_album_2020.wav")
+    wavfile.write(path, 44100, song)
+    database_manager.write_song("song", "artist", "album", path, date = "2020", source = "local", **spectral_analysis.fingerprint_file(path))
+    excerpt = song[44100*10:44100*40]
+    starts = np.cumsum([0] + [44100//3, 44100*2, 999]*30)
+    blocks = (excerpt[start:end] for start, end in zip(starts[:-1], starts[1:]))
+    result = streaming.recognize_stream(blocks, 44100, "five", 1)
+    assert result["match"] and result["title"] == "song" and result["decisive"] and result["votes"] == result["windows"]
+    assert result["audio_seconds"] < 20
+    recognizer = streaming.StreamingRecognizer(44100, "five", 1e-06)
+    assert recognizer.feed(excerpt[:44100*7]) is None and recognizer.tally["windows"] == 3
+
+
+def test_decimation():
+    """
+    Function tests that fingerprints two and five computed from decimated audio match the full-rate ones, with far smaller windows.
+    """
+    rng = np.random.RandomState(0)
+    t = np.arange(44100*12)/44100
+    series = (np.sin(2*np.pi*220*t) + .5*np.sin(2*np.pi*1500*t) + .3*np.sin(2*np.pi*9000*t) + .2*rng.randn(len(t))).astype(np.float32)
+    assert spectral_analysis.decimation_factor(44100, "one") == 1
+    assert spectral_analysis.decimation_factor(44100, "two") == 7 and spectral_analysis.decimation_factor(44100, "five") == 35
+    samplerate, decimated = spectral_analysis.decimate_series(series, 44100, 7)
+    assert samplerate == 6300 and len(decimated) == len(series)//7 and decimated.dtype == np.float32
+    full = spectral_analysis.compute_fingerprints(series, 44100, methods = ("one", "two", "five"), decimate = False)
+    fast = spectral_analysis.compute_fingerprints(series, 44100, methods = ("one", "two", "five"), decimate = True)
+    assert np.array_equal(full["one"], fast["one"])
+    for method in ("two", "five"):
+        assert fast[method].shape == full[method].shape
+        assert (np.linalg.norm(fast[method] - full[method], axis = 1) < .01*np.linalg.norm(full[method], axis = 1)).all()
+
+
+def test_read_wav_stream(tmp_path):
+    """
+    Function tests that a WAV read from a pipe-like stream (unknown sizes, odd-sized reads) gives the same series as analyze_song,
+    that the copy written on the side is a valid WAV, that a metadata chunk after a sized data chunk isn't read as samples,
+    and that a WAV which isn't 16-bit PCM is refused.
+    """
+    import io
+    data = (np.random.RandomState(0).randn(44100*3, 2)*3000).astype(np.int16)
+    path = str(tmp_path / "song.wav")
+    wavfile.write(path, 44100, data)
+    raw = bytearray(open(path, "rb").read())
+    raw[4:8] = raw[40:44] = b"\xff\xff\xff\xff"
+    with open(str(tmp_path / "copy.wav"), "w+b") as copy:
+        samplerate, series = audio_processing.read_wav_stream(io.BufferedReader(io.BytesIO(bytes(raw)), 1001), wav_file = copy, block_size = 1001)
+    assert samplerate == 44100 and series.dtype == np.float32
+    assert np.array_equal(series, spectral_analysis.analyze_song(path)[1])
+    assert np.array_equal(wavfile.read(str(tmp_path / "copy.wav"))[1], data)
+    tagged = bytearray(open(path, "rb").read()) + b"LIST" + (10).to_bytes(4, "little") + b"INFOISFT\x00\x00"
+    tagged[4:8] = (len(tagged) - 8).to_bytes(4, "little")
+    assert np.array_equal(audio_processing.read_wav_stream(io.BytesIO(bytes(tagged)), block_size = 1001)[1], spectral_analysis.analyze_song(path)[1])
+    wavfile.write(path, 44100, data.astype(np.float32))
+    with open(path, "rb") as f, pytest.raises(audio_processing.WavFormatError):
+        audio_processing.read_wav_stream(f)
+
+
+def test_decimated_stream(tmp_path, sqlite_backend, monkeypatch):
+    """
+    Function tests that a stream is decimated as it arrives exactly as a whole song is, so every streamed window matches the
+    catalog's decimated fingerprint of it, and that a catalog is only searched with the decimation setting it was fingerprinted with.
+    """
+    import streaming
+    rng = np.random.RandomState(0)
+    series = rng.randn(44100*3 + 13).astype(np.float32)
+    decimator = streaming.Decimator(35)
+    starts = np.cumsum([0] + [1000, 44100, 7]*3 + [len(series)])
+    blocks = [decimator.write(series[start:end]) for start, end in zip(starts[:-1], starts[1:])] + [decimator.flush()]
+    assert np.allclose(np.concatenate(blocks), spectral_analysis.decimate_series(series, 44100, 35)[1], atol = 1e-05)
+    monkeypatch.setattr(spectral_analysis, "DECIMATE", True)
+    song = (rng.randn(44100*20)*3000).astype(np.int16)
+    path = str(tmp_path / "song_artist_album_2020.wav")
+    wavfile.write(path, 44100, song)
+    database_manager.write_song("song", "artist", "album", path, date = "2020", source = "local", **spectral_analysis.fingerprint_file(path))
+    assert database_manager.backend.catalog_decimation() == {True}
+    # alpha 0 is never decisive, so every window of the song is looked up
+    starts = list(np.cumsum([0] + [44100//3, 44100*2, 999]*8)) + [len(song)]
+    result = streaming.recognize_stream((song[start:end] for start, end in zip(starts[:-1], starts[1:])), 44100, "five", 1e-03, alpha = 0)
+    assert result["windows"] == 16 and result["votes"] == 16 and result["title"] == "song"
+    index = database_manager.build_index("five")
+    assert index["decimated"] == {True}
+    monkeypatch.setattr(spectral_analysis, "DECIMATE", False)
+    with pytest.raises(ValueError):
+        streaming.recognize_stream([song], 44100, "five", 1)
+    with pytest.raises(ValueError):
+        database_manager.identify(song, 44100, "five", 1, index = index)
+    # method one is never decimated, so it can still be searched
+    assert database_manager.identify(song, 44100, "one", 1e-03)["title"] == "song"
+
+
+@pytest.mark.skipif(audio_processing.shutil.which("ffmpeg") is None, reason = "ffmpeg is not installed")
+def test_decode_audio(tmp_path):
+    """
+    Function tests that ffmpeg decodes a file, and a stream fed to it as it is read, to the same series as analyze_song.
+    """
+    path = str(tmp_path / "song.wav")
+    wavfile.write(path, 44100, (np.random.RandomState(0).randn(44100*3, 2)*3000).astype(np.int16))
+    expected = spectral_analysis.analyze_song(path)[1]
+    assert np.array_equal(audio_processing.decode_audio(path)[1], expected)
+    with open(path, "rb") as f:
+        assert np.array_equal(audio_processing.decode_audio(f, wav_path = str(tmp_path / "copy.wav"))[1], expected)
+    assert np.array_equal(spectral_analysis.analyze_song(str(tmp_path / "copy.wav"))[1], expected)
+    assert audio_processing.decode_audio(path, samplerate = 22050)[0] == 22050
+    assert audio_processing.mp3_length(open(path, "rb").read(8192)) is None
+    # a streamed MP3 is cut to the length in its tags, as ffmpeg cuts a file
+    mp3_path = str(tmp_path / "song.mp3")
+    audio_processing.subprocess.run([audio_processing.ffmpeg_command(), "-v", "error", "-i", path, mp3_path], check = True)
+    expected = audio_processing.decode_audio(mp3_path)[1]
+    assert audio_processing.mp3_length(open(mp3_path, "rb").read(8192)) == len(expected)
+    with open(mp3_path, "rb") as f:
+        assert np.array_equal(audio_processing.decode_audio(f, wav_path = str(tmp_path / "copy.wav"), block_size = 1000)[1], expected)
+    assert np.array_equal(spectral_analysis.analyze_song(str(tmp_path / "copy.wav"))[1], expected)
+
+
+@pytest.mark.skipif(audio_processing.shutil.which("ffmpeg") is None, reason = "ffmpeg is not installed")
+def test_fetch_mp3(tmp_path, monkeypatch):
+    """
+    Function tests that an MP3 URL is decoded while it downloads, to the same series as the downloaded file, which is kept in the cache.
+    """
+    import urllib.parse
+    import url_fetcher
+    import benchmarks
+    served = tmp_path / "served"
+    served.mkdir()
+    path = write_tone_wav(str(tmp_path / "song.wav"), seconds = 8)
+    mp3_path = str(served / "mp3 song_artist_album_2020.mp3")
+    audio_processing.subprocess.run([audio_processing.ffmpeg_command(), "-v", "error", "-i", path, mp3_path], check = True)
+    httpd, base_url = benchmarks.serve_directory(str(served))
+    monkeypatch.setattr(url_fetcher, "DOWNLOAD_DIR", str(tmp_path / "downloads"))
+    try:
+        url = base_url + urllib.parse.quote(os.path.basename(mp3_path))
+        samplerate, series, fetched = url_fetcher.fetch_audio(url)
+        assert fetched == {"status": "downloaded", "bytes": os.path.getsize(mp3_path)}
+        assert np.array_equal(series, audio_processing.decode_audio(mp3_path)[1])
+        assert open(url_fetcher.cache_paths(url)[0], "rb").read() == open(mp3_path, "rb").read()
+        assert np.array_equal(url_fetcher.fetch_audio(url)[1], series)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_add_urls(tmp_path, monkeypatch, sqlite_backend):
+    """
+    Function tests that add_urls downloads songs concurrently over kept-alive connections, then revalidates finished downloads
+    instead of downloading them again, and that an interrupted download is resumed with a Range request.
+    """
+    import json
+    import urllib.parse
+    import url_fetcher
+    import benchmarks
+    served = tmp_path / "served"
+    served.mkdir()
+    paths = benchmarks.write_synthetic_wavs(str(served), 3, seconds = 6)
+    # a float WAV can't be streamed, so it is read once it has downloaded
+    float_path = str(served / "float song_bench artist_bench album_2020.wav")
+    wavfile.write(float_path, 44100, np.random.RandomState(1).randn(44100*6).astype(np.float32))
+    httpd, base_url = benchmarks.serve_directory(str(served))
+    urls = [base_url + urllib.parse.quote(os.path.basename(path)) for path in paths]
+    monkeypatch.setattr(url_fetcher, "DOWNLOAD_DIR", str(tmp_path / "downloads"))
+    try:
+        summary = database_manager.add_urls(urls, workers = 2)
+        assert (summary["added"], summary["downloaded"], summary["failed"]) == (3, 3, 0)
+        assert httpd.requests == 3 and httpd.connections <= 2
+        assert sorted(row[1] for row in database_manager.backend.list_songs()) == ["bench song 0", "bench song 1", "bench song 2"]
+        summary = database_manager.add_urls(urls, workers = 2)
+        assert (summary["updated"], summary["cached"], summary["bytes"]) == (3, 3, 0)
+        # cut the first download short, as if the connection had dropped halfway
+        body_path, meta_path = url_fetcher.cache_paths(urls[0])
+        with open(body_path, "r+b") as f:
+            f.truncate(os.path.getsize(body_path)//2)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(meta_path, "w") as f:
+            json.dump(dict(meta, complete = False), f)
+        samplerate, series, fetched = url_fetcher.fetch_audio(urls[0])
+        assert fetched["status"] == "resumed" and fetched["bytes"] == os.path.getsize(paths[0]) - os.path.getsize(paths[0])//2
+        assert np.array_equal(series, spectral_analysis.analyze_song(paths[0])[1])
+        assert os.path.getsize(body_path) == os.path.getsize(paths[0])
+        samplerate, series, fetched = url_fetcher.fetch_audio(base_url + urllib.parse.quote(os.path.basename(float_path)))
+        assert fetched["status"] == "downloaded" and np.array_equal(series, spectral_analysis.analyze_song(float_path)[1])
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,303 @@
+#########################################
+### Author: Vinni Bhatia
+### Last Edited: Dec 18, 2020
+### Use: Concurrent, resumable and cached downloads of songs from URLs
+#########################################
+
+## NOTE: To run, use: python freezam.py add_urls --urls_file=urls.txt --workers=8
+## where urls.txt lists one URL per line, each ending in a title_artist_album_date.mp3 (or .wav) filename.
+
+import os
+import json
+import shutil
+import hashlib
+import itertools
+import logging
+import threading
+import http.client
+import urllib.parse
+import concurrent.futures
+
+import audio_processing
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# Where downloaded songs are kept (one body and one metadata file per URL), so they are resumed or revalidated rather than downloaded again
+DOWNLOAD_DIR = os.environ.get("FREEZAM_DOWNLOAD_DIR", "download_cache")
+
+# Redirects followed before a URL is given up on
+MAX_REDIRECTS = 5
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections, one per host for each thread, so a worker downloading many songs from the same server
+    opens one connection rather than one per song (which urllib.request does).
+    """
+
+    def __init__(self, timeout = 30):
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def connection(self, scheme, netloc):
+        """Function returns this thread's connection to a host, opening it if there is none."""
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            connection = connections[(scheme, netloc)] = connection_class(netloc, timeout = self.timeout)
+            # every worker thread opens its own connections, so the count is shared
+            with self.lock:
+                self.opened += 1
+        return(connection)
+
+    def discard(self, scheme, netloc):
+        """Function closes this thread's connection to a host (after an error, or when the server closed it)."""
+        connection = getattr(self.local, "connections", {}).pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def request(self, url, headers = None):
+        """
+        Function sends a GET and returns the response once its headers have arrived, following redirects. A connection the server
+        has closed since its last use is reopened once.
+
+        Inputs: url (str, http or https)
+                headers (dictionary, optional)
+
+        Outputs: response (http.client.HTTPResponse, its body not yet read) and the final URL (str)
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise ValueError("Only http and https URLs can be fetched, not " + url)
+            target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+            for attempt in range(2):
+                connection = self.connection(parts.scheme, parts.netloc)
+                try:
+                    connection.request("GET", target, headers = headers or {})
+                    response = connection.getresponse()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    self.discard(parts.scheme, parts.netloc)
+                    if attempt:
+                        raise
+            if response.status not in (301, 302, 303, 307, 308):
+                if response.will_close:
+                    # The connection can't be reused, so the next request opens a new one (the response still reads to the end)
+                    getattr(self.local, "connections", {}).pop((parts.scheme, parts.netloc), None)
+                return([response, url])
+            response.read()
+            url = urllib.parse.urljoin(url, response.getheader("Location"))
+        raise OSError("Too many redirects fetching " + url)
+
+    def close(self):
+        """Function closes this thread's connections."""
+        for connection in getattr(self.local, "connections", {}).values():
+            connection.close()
+        self.local.connections = {}
+
+
+class _TeeReader:
+    """
+    Readable stream handed to the decoder: the bytes already downloaded (when resuming) followed by the rest of the response,
+    with every new byte also appended to the download cache.
+    """
+
+    def __init__(self, response, body_file, cached = None):
+        self.response, self.body_file, self.cached = response, body_file, cached
+        self.received = 0
+
+    def read(self, size = -1):
+        if self.cached is not None:
+            data = self.cached.read(size)
+            if data:
+                return(data)
+            self.cached.close()
+            self.cached = None
+        data = self.response.read(size) if size is not None and size >= 0 else self.response.read()
+        if data:
+            self.body_file.write(data)
+            self.received += len(data)
+        return(data)
+
+    def close(self):
+        if self.cached is not None:
+            self.cached.close()
+        self.response.close()
+        self.body_file.close()
+
+
+def cache_paths(url):
+    """
+    Function finds where a URL's download is kept: the body, and a metadata file with its ETag (or Last-Modified) and
+    whether the download finished.
+
+    Inputs: url (str)
+
+    Outputs: path of the body (str) and path of the metadata (str)
+    """
+    key = hashlib.sha1(url.encode()).hexdigest()
+    base = os.path.join(DOWNLOAD_DIR, key[:2], key)
+    return([base + ".body", base + ".json"])
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return(json.load(f))
+    except (OSError, ValueError):
+        return({})
+
+
+def _write_meta(meta_path, meta):
+    temp_path = meta_path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(temp_path, meta_path)
+
+
+def is_wav(url):
+    """Function tells whether a URL points to a WAV (by its extension)."""
+    return(os.path.splitext(urllib.parse.urlsplit(url).path)[1].lower() == ".wav")
+
+
+def read_wav(stream, wav_path = None):
+    """
+    Function reads a WAV from a stream (see audio_processing.read_wav_stream), also writing it to wav_path if one is given.
+
+    Inputs: stream (readable binary file object)
+            wav_path (str, optional)
+
+    Outputs: The samplerate (integer) and series data (numpy.ndarray, float32)
+    """
+    if wav_path is None:
+        return(audio_processing.read_wav_stream(stream))
+    with open(wav_path, "w+b") as wav_file:
+        return(audio_processing.read_wav_stream(stream, wav_file = wav_file))
+
+
+def read_download(body_path, url, wav_path = None):
+    """
+    Function decodes a finished download: a WAV is read in full (analyze_song reads every WAV flavour), anything else goes through ffmpeg.
+
+    Inputs: body_path (str, the download), url (str, its extension picks the decoder)
+            wav_path (str, also write the decoded WAV here, optional)
+
+    Outputs: The samplerate (integer) and series data (numpy.ndarray, float32)
+    """
+    if not is_wav(url):
+        return(audio_processing.decode_audio(body_path, wav_path = wav_path))
+    import spectral_analysis
+    # analyze_song wants a .wav path, so the download is read through a link (or a copy) with that extension
+    wav_copy = wav_path or body_path + "." + str(threading.get_ident()) + ".wav"
+    if wav_path is not None and os.path.exists(wav_path):
+        os.remove(wav_path)
+    try:
+        os.link(body_path, wav_copy)
+    except OSError:
+        shutil.copyfile(body_path, wav_copy)
+    try:
+        return(spectral_analysis.analyze_song(wav_copy))
+    finally:
+        if wav_path is None:
+            os.remove(wav_copy)
+
+
+def fetch_audio(url, pool = None, wav_path = None):
+    """
+    Function downloads a song into DOWNLOAD_DIR, where it is kept under the URL with its ETag: a finished download is revalidated
+    (If-None-Match, a 304 reply means it is read from disk), and an interrupted one is resumed with a Range request (If-Range,
+    so a changed file is downloaded again from the start). The body is decoded as its bytes arrive, through the cache file: a 16-bit
+    PCM WAV is read directly, and an MP3 (or other audio) is fed to ffmpeg, its end padding cut as when ffmpeg reads a file (see
+    audio_processing.decode_audio), so the samples match a local file's. Other WAVs, or audio ffmpeg can't decode from a stream,
+    are read once they have downloaded (see read_download).
+
+    Inputs: url (str, http or https)
+            pool (ConnectionPool, default a new one)
+            wav_path (str, also write the decoded WAV here, optional)
+
+    Outputs: The samplerate (integer), series data (numpy.ndarray, float32) and a dictionary of how it was fetched
+             (status: downloaded, resumed or cached, and bytes downloaded)
+    """
+    pool = pool or ConnectionPool()
+    body_path, meta_path = cache_paths(url)
+    meta = _read_meta(meta_path) if os.path.exists(body_path) else {}
+    validator = meta.get("etag") or meta.get("last_modified")
+    headers = {}
+    if validator and meta.get("complete"):
+        headers["If-None-Match" if meta.get("etag") else "If-Modified-Since"] = validator
+    elif validator and os.path.getsize(body_path) > 0:
+        headers.update({"Range": "bytes=" + str(os.path.getsize(body_path)) + "-", "If-Range": validator})
+    response, final_url = pool.request(url, headers = headers)
+    if response.status == 304:
+        response.read()
+        return(read_download(body_path, final_url, wav_path = wav_path) + [{"status": "cached", "bytes": 0}])
+    if response.status not in (200, 206):
+        response.read()
+        raise OSError("Could not fetch " + url + " (HTTP " + str(response.status) + " " + response.reason + ")")
+    resumed = response.status == 206 and "Range" in headers and \
+        (response.getheader("Content-Range") or "").startswith("bytes " + str(os.path.getsize(body_path)) + "-")
+    if response.status == 206 and not resumed:
+        response.close()
+        raise OSError("Could not resume " + url + ": unexpected Content-Range " + str(response.getheader("Content-Range")))
+    os.makedirs(os.path.dirname(body_path), exist_ok = True)
+    if not resumed:
+        # Record the validator before the body, so a download cut short can be resumed next time
+        meta = {"url": url, "etag": response.getheader("ETag"), "last_modified": response.getheader("Last-Modified"), "complete": False}
+        _write_meta(meta_path, meta)
+    stream = _TeeReader(response, open(body_path, "ab" if resumed else "wb"), cached = open(body_path, "rb") if resumed else None)
+    streamed = False
+    try:
+        try:
+            if is_wav(final_url):
+                samplerate, series = read_wav(stream, wav_path = wav_path)
+            else:
+                samplerate, series = audio_processing.decode_audio(stream, wav_path = wav_path)
+            streamed = True
+        except ValueError as error:
+            logger.info('Reading ' + url + ' once it has downloaded: ' + str(error))
+        # Read whatever the decoder left (trailing chunks or tags), so the download is whole and the connection can be reused
+        while stream.read(2**20):
+            pass
+    finally:
+        stream.close()
+    meta["complete"] = True
+    _write_meta(meta_path, meta)
+    if not streamed:
+        samplerate, series = read_download(body_path, final_url, wav_path = wav_path)
+    return([samplerate, series, {"status": "resumed" if resumed else "downloaded", "bytes": stream.received}])
+
+
+def fetch_many(urls, work, workers = 8, pool = None):
+    """
+    Function fetches many URLs at once on a bounded pool of threads sharing keep-alive connections: each thread runs work(url, pool),
+    which usually calls fetch_audio, so downloading, decoding and fingerprinting overlap across songs. Only workers URLs are
+    in flight at a time, so finished songs never pile up in memory faster than the caller takes them.
+
+    Inputs: urls (iterable of str)
+            work (callable taking a URL and a ConnectionPool)
+            workers (integer, most downloads at once)
+            pool (ConnectionPool, default a new one)
+
+    Outputs: Generator of (url, result, error) as each URL finishes, error being None unless work raised
+    """
+    pool = pool or ConnectionPool()
+    remaining = iter(urls)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        pending = {executor.submit(work, url, pool): url for url in itertools.islice(remaining, workers)}
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                url = pending.pop(future)
+                for next_url in itertools.islice(remaining, 1):
+                    pending[executor.submit(work, next_url, pool)] = next_url
+                try:
+                    yield((url, future.result(), None))
+                except Exception as error:
+                    yield((url, None, error))